@@ -4,11 +4,19 @@
 # The main purpose of this is to study the design of the FORTH language
 # by attempting a modern implementation of it.
 
+import os
+import select
+import struct
 import sys
+import threading
+import zlib
 
 #----- CONFIGURATION ----------------------------------------------------------
 
+MEM_SIZE = 65536 # bytes of memory given to each Forth machine
+CELL_BITS = 16   # width of a cell, 16, 32 or 64, a double is two cells
 DISK_FILE_NAME = "forth_disk.bin"
+DISK_COMMIT_INTERVAL = 1.0 # seconds between journal flushes, for write-behind disks
 
 
 #----- DEBUG ------------------------------------------------------------------
@@ -48,72 +56,75 @@ class Debug():
 
 
 #----- NUMBER and DOUBLE accessors --------------------------------------------
+#
+# A cell is 16 bits wide unless a Machine is booted with another width.
+# A double is always two cells. Number and Double are the 16 bit pair, and
+# cell_types() gives the pair for a Machine of another width.
 
 class NumberBigEndian():
-    """A big-endian 16-bit number helper"""
-    @staticmethod
-    def from_bytes(b):
-        b0 = (b[0] & 0xFF)
-        b1 = (b[1] & 0xFF)
-        return (b0<<8)+b1
-
-    @staticmethod
-    def to_bytes(n):
-        b0 = (n & 0xFF00)>>8
-        b1 = (n & 0xFF)
-        return (b0, b1)
-
-    @staticmethod
-    def asSigned(number):
-        number = number & 0xFFFF
-        if number >= 0x8000:
-            number = number - 0x10000
+    """A big-endian cell sized number helper"""
+    BITS = 16
+    SIZE = 2 # bytes
+    MASK = 0xFFFF
+
+    @classmethod
+    def configure(cls, bits):
+        cls.BITS = bits
+        cls.SIZE = bits // 8
+        cls.MASK = (1 << bits) - 1
+
+    @classmethod
+    def from_bytes(cls, b):
+        n = 0
+        for i in range(cls.SIZE):
+            n = (n<<8) + (b[i] & 0xFF)
+        return n
+
+    @classmethod
+    def to_bytes(cls, n):
+        n = n & cls.MASK
+        return tuple([(n>>shift) & 0xFF for shift in range(cls.BITS-8, -8, -8)])
+
+    @classmethod
+    def asSigned(cls, number):
+        number = number & cls.MASK
+        if number >> (cls.BITS-1):
+            number = number - (cls.MASK+1)
         return number
 
-    @staticmethod
-    def asUnsigned(number):
-        number = number & 0xFFFF
-        if number < 0:
-            number = number + 0x10000
-        return number
-
-class DoubleBigEndian():
-    """A big-endian 32-bit number helper"""
-    @staticmethod
-    def from_bytes(b):
-        b0 = (b[0] & 0xFF)
-        b1 = (b[1] & 0xFF)
-        b2 = (b[2] & 0xFF)
-        b3 = (b[3] & 0xFF)
-        return (b0<<24)+(b1<<16)+(b2<<8)+b3
+    @classmethod
+    def asUnsigned(cls, number):
+        return number & cls.MASK
 
-    @staticmethod
-    def to_bytes(n):
-        b0 = (n & 0xFF000000)>>24
-        b1 = (n & 0x00FF0000)>>16
-        b2 = (n & 0x0000FF00)>>8
-        b3 = (n & 0x000000FF)
-        return (b0, b1, b2, b3)
-
-    @staticmethod
-    def asSigned(number):
-        number = number & 0xFFFFFFFF
-        if number >= 0x80000000:
-            number = number - 0x1000000
-        return number
-
-    @staticmethod
-    def asUnsigned(number):
-        number = number & 0xFFFFFFFF
-        if number < 0:
-            number = number + 0x1000000
-        return number
+class DoubleBigEndian(NumberBigEndian):
+    """A big-endian double cell number helper"""
+    BITS = 32
+    SIZE = 4 # bytes
+    MASK = 0xFFFFFFFF
 
 # The standard says that byte order is not defined. We will use big-endian.
 
 class Number(NumberBigEndian):pass
 class Double(DoubleBigEndian):pass
 
+CELL_TYPES = {16: (Number, Double)}
+
+def cell_types(bits):
+    """The (Number, Double) classes for a cell of 16, 32 or 64 bits.
+       Each width has its own pair, so Machines of different widths can share a process."""
+    if bits not in (16, 32, 64):
+        Debug.fail("Unsupported cell width:%s" % str(bits))
+    if bits not in CELL_TYPES:
+        class WideNumber(NumberBigEndian):pass
+        class WideDouble(DoubleBigEndian):pass
+        WideNumber.configure(bits)
+        WideDouble.configure(bits*2)
+        CELL_TYPES[bits] = (WideNumber, WideDouble)
+    return CELL_TYPES[bits]
+
+# A literal may be a Python 2 long, when cells are 64 bits
+INTEGER_TYPES = (int, type(1<<64))
+
 
 #----- BUFFER -----------------------------------------------------------------
 
@@ -125,6 +136,10 @@ class Buffer():
         self.bytes   = storage
         self.start   = start
         self.size    = size
+        self.Number, self.Double = Number, Double
+        if isinstance(storage, Buffer):
+            # a buffer over a Memory has the cell width of that Memory
+            self.Number, self.Double = storage.Number, storage.Double
 
     #---- LOW LEVEL (overridable) storage access
     def __setitem__(self, key, value):
@@ -135,8 +150,8 @@ class Buffer():
 
     #---- HIGH LEVEL storage access (always uses lower level)
     def readn(self, addr):
-        """Read a cell sized 2 byte variable"""
-        value = Number.from_bytes((self[addr], self[addr+1]))
+        """Read a cell sized variable"""
+        value = self.Number.from_bytes([self[a] for a in range(addr, addr+self.Number.SIZE)])
         return value
 
     def readb(self, addr):
@@ -145,15 +160,15 @@ class Buffer():
         return value
 
     def readd(self, addr):
-        """Read a double length variable (4 byte, 32 bits)"""
-        value = Number.from_bytes((self[addr], self[addr+1], self[addr+2], self[addr+3]))
+        """Read a double length variable (two cells)"""
+        value = self.Double.from_bytes([self[a] for a in range(addr, addr+self.Double.SIZE)])
         return value
 
     def writen(self, addr, value):
-        """Write a cell sized 2 byte variable"""
-        b0, b1 = Number.to_bytes(value)
-        self[addr]   = b0
-        self[addr+1] = b1
+        """Write a cell sized variable"""
+        for b in self.Number.to_bytes(value):
+            self[addr] = b
+            addr += 1
 
     def writeb(self, addr, value):
         """Write a 1 byte variable"""
@@ -161,12 +176,10 @@ class Buffer():
         self[addr] = low
 
     def writed(self, addr, value):
-        """Write a double length variable (4 byte, 32 bits)"""
-        b0, b1, b2, b3 = Double.to_bytes(value)
-        self[addr]   = b0
-        self[addr+1] = b1
-        self[addr+2] = b2
-        self[addr+3] = b3
+        """Write a double length variable (two cells)"""
+        for b in self.Double.to_bytes(value):
+            self[addr] = b
+            addr += 1
 
     def dump(self, start, len):
         """Dump memory to stdout, for debug reasons"""
@@ -177,17 +190,79 @@ class Buffer():
 
 #----- MEMORY -----------------------------------------------------------------
 #
-# Access to a block of memory, basically a Python list.
-
-MEMSIZE = 65536
-mem = [0 for i in range(MEMSIZE)]
+# Access to a block of memory, basically a Python bytearray.
+# Each Machine owns its own storage, so many Forths can coexist in one process.
 
 class Memory(Buffer):
-    """An abstraction around a block of memory, with named and mapped regions"""
-    def __init__(self, storage, size=None):
-        Buffer.__init__(self, storage, start=0, size=size)
+    """An abstraction around a block of memory, with named and mapped regions.
+       Storage is a list of pages. A snapshot shares the pages, and a page is
+       only copied when it is next written, so snapshots cost no more than the
+       pages that change between them."""
+    PAGE_SHIFT = 10
+    PAGE_SIZE  = 1 << PAGE_SHIFT
+    PAGE_MASK  = PAGE_SIZE - 1
+    ZERO       = bytearray(PAGE_SIZE) # shared by every Machine, never written
+
+    def __init__(self, size, bits=CELL_BITS):
+        if size % Memory.PAGE_SIZE != 0:
+            raise ValueError("Memory size:0x%x is not a whole number of pages" % size)
+        Buffer.__init__(self, None, start=0, size=size)
+        self.Number, self.Double = cell_types(bits)
+        count = size // Memory.PAGE_SIZE
+        # Every page starts as the shared zero page, and gets its own storage
+        # when first written, so regions that are never written (the sealed
+        # base words, unused space) cost nothing per Machine.
+        self.pages = [Memory.ZERO] * count
+        self.owned = [False] * count # False while the page is shared
         self.map = []
 
+    def own(self, i):
+        """Take a private copy of a shared page, before writing to it"""
+        page = bytearray(self.pages[i])
+        self.pages[i] = page
+        self.owned[i] = True
+        return page
+
+    def snapshot(self):
+        """Capture memory as a tuple of pages, without copying any of them"""
+        self.owned = [False] * len(self.pages)
+        return tuple(self.pages)
+
+    def restore(self, pages):
+        """Go back to a snapshot, sharing its pages until they are written"""
+        self.pages = list(pages)
+        self.owned = [False] * len(self.pages)
+
+    def load(self, addr, count):
+        """Copy a run of storage out as a bytearray, ignoring any handler"""
+        i   = addr >> Memory.PAGE_SHIFT
+        ofs = addr & Memory.PAGE_MASK
+        if ofs + count <= Memory.PAGE_SIZE:
+            return self.pages[i][ofs:ofs+count]
+        data = bytearray()
+        while count > 0:
+            n = min(count, Memory.PAGE_SIZE - ofs)
+            data += self.pages[i][ofs:ofs+n]
+            count -= n
+            i += 1
+            ofs = 0
+        return data
+
+    def store(self, addr, data):
+        """Copy a run of bytes into storage, ignoring any handler"""
+        i   = addr >> Memory.PAGE_SHIFT
+        ofs = addr & Memory.PAGE_MASK
+        done = 0
+        while done < len(data):
+            n = min(len(data) - done, Memory.PAGE_SIZE - ofs)
+            page = self.pages[i]
+            if not self.owned[i]:
+                page = self.own(i)
+            page[ofs:ofs+n] = data[done:done+n]
+            done += n
+            i += 1
+            ofs = 0
+
     #---- LOW LEVEL (override) storage access
     #this routes via handler if a handler is provided for that region
     #if there is no handler, it calls back to the Buffer.__setitem__ and Buffer.__getitem__
@@ -196,8 +271,12 @@ class Memory(Buffer):
     def __setitem__(self, key, value):
         handler, start = self.handlerfor(key)
         if handler == None:
-            # use default list access
-            self.bytes[key] = value
+            # use the page, taking a copy first if a snapshot shares it
+            i = key >> Memory.PAGE_SHIFT
+            page = self.pages[i]
+            if not self.owned[i]:
+                page = self.own(i)
+            page[key & Memory.PAGE_MASK] = value
         else:
             # use handler override
             handler[key-start] = value
@@ -206,11 +285,70 @@ class Memory(Buffer):
         handler, start = self.handlerfor(key)
         if handler == None:
             # use default handler
-            return self.bytes[key]
+            return self.pages[key >> Memory.PAGE_SHIFT][key & Memory.PAGE_MASK]
         else:
             # use override handler
             return handler[key-start]
 
+    def unmapped(self, addr, count):
+        """Is the whole range plain storage, with no handler region in it?"""
+        end = addr + count - 1
+        for i in self.map:
+            name, start, size, handler = i
+            if handler != None and addr <= start+size-1 and end >= start:
+                return False
+        return addr >= 0 and end < self.size
+
+    def readbytes(self, addr, count):
+        """Read a run of bytes as a bytearray, in one slice if no handler is in the way"""
+        if self.unmapped(addr, count):
+            return self.load(addr, count)
+        return bytearray([self[a] for a in range(addr, addr+count)])
+
+    def writebytes(self, addr, data):
+        """Write a run of bytes, in one slice if no handler is in the way"""
+        if self.unmapped(addr, len(data)):
+            self.store(addr, data)
+        else:
+            for i in range(len(data)):
+                self[addr+i] = data[i]
+
+    def copy(self, src, dst, count, backwards=False):
+        """Copy count bytes one at a time, like CMOVE, or like CMOVE> if backwards.
+           Overlapping copies repeat a pattern, exactly as the byte loop would."""
+        if count <= 0:
+            return
+        if self.unmapped(src, count) and self.unmapped(dst, count):
+            gap = dst - src
+            if backwards:
+                gap = -gap
+            if gap > 0 and gap < count:
+                # each byte copied is read again, gap bytes later
+                if backwards:
+                    tail = self.load(src+count-gap, gap)
+                    data = (tail * (count//gap + 1))[-count:]
+                else:
+                    data = (self.load(src, gap) * (count//gap + 1))[:count]
+            else:
+                data = self.load(src, count)
+            self.store(dst, data)
+        elif backwards:
+            for i in range(count-1, -1, -1):
+                self[dst+i] = self[src+i]
+        else:
+            for i in range(count):
+                self[dst+i] = self[src+i]
+
+    def fill(self, addr, count, byte):
+        """Set count bytes to byte"""
+        if count <= 0:
+            return
+        if self.unmapped(addr, count):
+            self.store(addr, bytearray([byte & 0xFF]) * count)
+        else:
+            for i in range(count):
+                self[addr+i] = byte & 0xFF
+
     def call(self, addr):
         handler, start = self.handlerfor(addr)
         if handler == None:
@@ -239,6 +377,9 @@ class Memory(Buffer):
             start = addr
         end = start + size - 1
 
+        if start < 0 or end >= self.size:
+            raise ValueError("Region %s does not fit in memory size:0x%x" % (name, self.size))
+
         # check for overlaps with an existing region
         for i in self.map:
             iname, istart, isize, h = i
@@ -453,14 +594,12 @@ class IndexedBuffer(Buffer):
         self.write(rel=index, bytes=(byte,))
 
     def setn(self, index, number):
-        """Write to a 16 bit number at a 16 bit position relative to top of stack"""
-        b0, b1 = Number.to_bytes(number)
-        self.write(rel=index*2, bytes=(b0, b1))
+        """Write to a cell at a cell position relative to top of stack"""
+        self.write(rel=index*self.Number.SIZE, bytes=self.Number.to_bytes(number))
 
     def setd(self, index, double):
-        """Write to a 32 bit number at a 32 bit position relative to stop of stack"""
-        b0, b1, b2, b3 = Double.to_bytes(double)
-        self.write(rel=index*4, bytes=(b0, b1, b2, b3))
+        """Write to a double at a double position relative to stop of stack"""
+        self.write(rel=index*self.Double.SIZE, bytes=self.Double.to_bytes(double))
 
     def getb(self, index):
         """Get an 8 bit number at an 8 bit position relative to top of stack"""
@@ -468,32 +607,29 @@ class IndexedBuffer(Buffer):
         return bytes[0]
 
     def getn(self, index):
-        """Get a 16 bit number at a 16-bit position relative to top of stack"""
-        b0, b1 = self.read(rel=index*2, size=2)
-        number = Number.from_bytes((b0, b1))
+        """Get a cell at a cell position relative to top of stack"""
+        number = self.Number.from_bytes(self.read(rel=index*self.Number.SIZE, size=self.Number.SIZE))
         return number
 
     def getd(self, index):
-        """Get a 32 bit number at a 32 bit position relative to top of stack"""
-        b0, b1, b2, b3 = self.read(rel=index*4, size=4)
-        double = Double.from_bytes((b0, b1, b2, b3))
+        """Get a double at a double position relative to top of stack"""
+        double = self.Double.from_bytes(self.read(rel=index*self.Double.SIZE, size=self.Double.SIZE))
         return double
 
     # Helpful routines for memory mapping pointer register
 
     def rd_p(self, offset):
-        if offset not in [0,1]:
+        if offset < 0 or offset >= self.Number.SIZE:
             raise ValueError("Out of range offset:0x%x" % offset)
-        bytes = Number.to_bytes(self.ptr)
+        bytes = self.Number.to_bytes(self.ptr)
         return bytes[offset]
 
     def wr_p(self, offset, byte):
-        if offset not in [0,1]:
+        if offset < 0 or offset >= self.Number.SIZE:
             raise ValueError("Out of range offset:0x%x" % offset)
-        b0, b1 = Number.to_bytes(self.ptr)
-        bytes = [b0, b1]
+        bytes = list(self.Number.to_bytes(self.ptr))
         bytes[offset] = byte
-        self.ptr = Number.from_bytes(bytes)
+        self.ptr = self.Number.from_bytes(bytes)
 
 #----- PAD --------------------------------------------------------------------
 
@@ -591,14 +727,12 @@ class Stack(IndexedBuffer):
         return self.push((byte, ))
 
     def pushn(self, number):
-        """Push a 16 bit number onto the stack"""
-        b0, b1 = Number.to_bytes(number)
-        return self.push((b0, b1))
+        """Push a cell onto the stack"""
+        return self.push(self.Number.to_bytes(number))
 
     def pushd(self, double):
-        """Push a 32 bit double onto the stack"""
-        b0, b1, b2, b3 = Double.to_bytes(double)
-        return self.push((b0, b1, b2, b3))
+        """Push a double onto the stack"""
+        return self.push(self.Double.to_bytes(double))
 
     def popb(self):
         """Pop an 8 bit byte from the stack"""
@@ -606,16 +740,14 @@ class Stack(IndexedBuffer):
         return bytes[0]
 
     def popn(self):
-        """Pop a 16 bit number from the stack"""
-        b0, b1 = self.pop(2)
-        number = Number.from_bytes((b0, b1))
+        """Pop a cell from the stack"""
+        number = self.Number.from_bytes(self.pop(self.Number.SIZE))
         #print("popped %d" % number)
         return number
 
     def popd(self):
-        """Pop a 32 bit double from the stack"""
-        b0, b1, b2, b3 = self.pop(4)
-        double = Double.from_bytes((b0, b1, b2, b3))
+        """Pop a double from the stack"""
+        double = self.Double.from_bytes(self.pop(self.Double.SIZE))
         return double
 
 
@@ -677,6 +809,38 @@ class ForthStack(Stack):
         self.setn(0, n2)
         self.pushn(n1)
 
+    def dup2(self): # ( d -- d d)
+        """Forth 2DUP the top two cells"""
+        n1 = self.getn(1)
+        n0 = self.getn(0)
+        self.pushn(n1)
+        self.pushn(n0)
+
+    def swap2(self): # ( d1 d2 -- d2 d1)
+        """Forth 2SWAP the top two pairs of cells"""
+        n0, n1, n2, n3 = self.getn(0), self.getn(1), self.getn(2), self.getn(3)
+        self.setn(0, n2)
+        self.setn(1, n3)
+        self.setn(2, n0)
+        self.setn(3, n1)
+
+    def over2(self): # ( d1 d2 -- d1 d2 d1)
+        """Forth 2OVER, copy the second pair of cells on to the top"""
+        n3 = self.getn(3)
+        n2 = self.getn(2)
+        self.pushn(n3)
+        self.pushn(n2)
+
+    def drop2(self): # ( d -- )
+        """Forth 2DROP the top two cells"""
+        self.popn()
+        self.popn()
+
+    def items(self):
+        """List the signed numbers on the stack, bottom first"""
+        count = self.getused() // self.Number.SIZE
+        return [self.Number.asSigned(self.getn(i)) for i in range(count-1, -1, -1)]
+
 
 #----- VARS -------------------------------------------------------------------
 
@@ -685,8 +849,8 @@ class Vars(Stack):
     def __init__(self, storage, start, size):
         Stack.__init__(self, storage, start, size, growdirn=1, ptrtype=Stack.LASTUSED)
 
-    def create(self, size=2):
-        """Create a new constant or variable of the given size in bytes"""
+    def create(self, size=None):
+        """Create a new constant or variable of the given size in bytes, a cell if None"""
         addr = self.ptr
         self.pushn(0)
         # A variable is just an address in a managed region, so reading and
@@ -714,10 +878,10 @@ class UserVars(Vars):
 #   HEADER
 #     FFA->FF   (flags field) {b7=immediate flag, b6=defining, b5=unused, b4..b0=count 0..31}
 #     NFA->NF   (name field) name string
-#     LFA->LF   (link field) {16bit addr of prev entry}
+#     LFA->LF   (link field) {cell addr of prev entry}
 #   BODY
-#     CFA->CF (code field) {16bit addr of machine code routine}
-#     PFA->PF (parameter field) list of {16 bit parameters specific to CFA type}
+#     CFA->CF (code field) {cell addr of machine code routine}
+#     PFA->PF (parameter field) list of {cell parameters specific to CFA type}
 
 class Dictionary(Stack):
     """A dictionary of defined Forth WORDs"""
@@ -726,12 +890,19 @@ class Dictionary(Stack):
     FLAG_UNUSED    = 0x20
     FIELD_COUNT    = 0x1F # 0..31
 
-    def __init__(self, storage, start, size):
+    def __init__(self, storage, start, size, base=None):
         Stack.__init__(self, storage, start, size, growdirn=1, ptrtype=Stack.LASTUSED)
 
-        self.pushb(0) # first FFA entry is always zero, to mark end of search chain
-        self.last_ffa = self.ptr
+        self.base = base # sealed words below our own, or None
+        if base == None:
+            self.pushb(0) # first FFA entry is always zero, to mark end of search chain
+            self.last_ffa = self.ptr
+        else:
+            # carry on from the end of the sealed words
+            self.ptr = base.ptr
+            self.last_ffa = base.last_ffa
         self.defining_ffa = None
+        self.index = None # name -> FFA of our own finished words, built by names()
 
         # for easy debug
         self.cfa_cache = {}
@@ -764,7 +935,7 @@ class Dictionary(Stack):
         for ch in nf:
             self.allot(1)
             self.storeb(ord(ch))
-        self.allot(2)
+        self.allot()
         self.store(lf)
 
         # if cf/pf provided, fill them in too
@@ -772,7 +943,7 @@ class Dictionary(Stack):
             self.allot()
             self.store(cf)
             #for fast debug
-            cfa = (self.ptr-1)
+            cfa = self.ptr - (self.Number.SIZE-1)
             self.cfa_cache[cfa] = nf
 
         #for fast debug
@@ -794,13 +965,30 @@ class Dictionary(Stack):
         # get FFA
         # clear 'defining' bit
         if self.defining_ffa == None:
-            Debug.fail("Trying to finish an already finished dict defn at:%d", self.last_ffa)
+            Debug.fail("Trying to finish an already finished dict defn at:%d" % self.last_ffa)
 
         ff = self.bytes.readb(self.defining_ffa)
         self.bytes.writeb(self.defining_ffa, ff & ~ Dictionary.FLAG_DEFINING)
         # advance end pointer
         self.last_ffa = self.defining_ffa
         self.defining_ffa = None
+        if self.index != None:
+            self.index[self.readname(self.ffa2nfa(self.last_ffa), ff & Dictionary.FIELD_COUNT)] = self.last_ffa
+
+    def abandon(self):
+        """Forget the record that is being defined, if there is one"""
+        if self.defining_ffa != None:
+            self.ptr = self.defining_ffa - 1
+            self.defining_ffa = None
+
+    def immediate(self, ffa=None):
+        """Mark a word, the last one defined if None, as immediate"""
+        if ffa == None:
+            ffa = self.last_ffa
+        self.bytes.writeb(ffa, self.bytes.readb(ffa) | Dictionary.FLAG_IMMEDIATE)
+
+    def is_immediate(self, ffa):
+        return self.bytes.readb(ffa) & Dictionary.FLAG_IMMEDIATE != 0
 
     def readname(self, addr, count):
         buf = ""
@@ -810,9 +998,13 @@ class Dictionary(Stack):
         return buf
 
     def cfa2name(self, cfa):
+        if self.base != None and cfa <= self.base.ptr:
+            return self.base.cfa_cache[cfa]
         return self.cfa_cache[cfa]
 
     def pfa02name(self, pfa0):
+        if self.base != None and pfa0 <= self.base.ptr:
+            return self.base.pfa0_cache[pfa0]
         return self.pfa0_cache[pfa0]
 
     def dump(self):
@@ -854,7 +1046,7 @@ class Dictionary(Stack):
             prev_nf = self.readname(lf+1, self.bytes.readb(lf) & Dictionary.FIELD_COUNT)
             lf_buf = "lfa:0x%x=0x%x->(%s)" % (lfa, lf, prev_nf)
             #print(lf_buf)
-            ptr += 2
+            ptr += self.Number.SIZE
 
             #### CF - Code Field
             cfa = ptr
@@ -862,7 +1054,7 @@ class Dictionary(Stack):
             #TODO: cf_name comes from machine.dispatch
             cf_buf = "cfa:0x%x=0x%x" % (cfa, cf)
             #print(cf_buf)
-            ptr += 2
+            ptr += self.Number.SIZE
 
             #### PF - Parameter Field
             #TODO:Need to know how to sense the end of this?
@@ -872,7 +1064,7 @@ class Dictionary(Stack):
             # dump first one for now
             pf = self.bytes.readn(pfa)
             #note, this is the CFA of the item. How do we back-step to it's NF?
-            #-2 is the LF
+            #-1 cell is the LF
             #but before that is arbitrary ascii chars, and a single FF field which
             #might actually be a printable ascii char, so it's ambiguous.
             #Can't assume LF's are sequential, when vocabularies in use.
@@ -886,18 +1078,35 @@ class Dictionary(Stack):
             # Move to prev
             ffa = self.prev(ffa)
 
-    def allot(self, size=2):
-        """Allot some extra space in the presently defining dictionary record"""
-        if size == 2:
+    def allot(self, size=None):
+        """Allot some extra space in the presently defining dictionary record, a cell if None"""
+        if size == None or size == self.Number.SIZE:
             self.pushn(0) # note this moves the pointer
         else:
             for i in range(size):
                 self.pushb(0) # note this moves the pointer
 
     def store(self, number):
-        """Write a 16 bit number at the present H pointer in the dictionary"""
+        """Write a cell at the present H pointer in the dictionary"""
         self.setn(0, number) # note this does not move the pointer
 
+    def comma(self, number):
+        """Allot and store a cell, like , does. Returns the address of the cell."""
+        self.allot()
+        self.store(number)
+        return self.ptr - (self.Number.SIZE-1)
+
+    def comma_bytes(self, data):
+        """Allot and store a run of bytes, padded with zeros to whole cells"""
+        S = self.Number.SIZE
+        data = data + bytearray(-len(data) % S)
+        for i in range(0, len(data), S):
+            self.comma(self.Number.from_bytes(data[i:i+S]))
+
+    def here(self):
+        """Address of the next free byte in the dictionary"""
+        return self.ptr + 1
+
     def storeb(self, byte):
         """Write an 8 bit number at the present H pointer in the dictionary"""
         self.setb(0, byte) # note this does not move the pointer
@@ -923,17 +1132,17 @@ class Dictionary(Stack):
 
     def cfa(self, lfa):
         """relative skip from lfa to cfa"""
-        return lfa+2
+        return lfa+self.Number.SIZE
 
     def pfa(self, cfa):
         """relative skip from cfa to pfa"""
-        return cfa+2
+        return cfa+self.Number.SIZE
 
     def pfa2cfa(self, pfa):
-        return pfa-2 # back skip to cfa
+        return pfa-self.Number.SIZE # back skip to cfa
 
     def cfa2pfa(self, cfa):
-        return cfa+2 # forward skip to pfa
+        return cfa+self.Number.SIZE # forward skip to pfa
 
     def ffa2nfa(self, ffa):
         """relative skip from ffa to nfa"""
@@ -952,21 +1161,44 @@ class Dictionary(Stack):
         """relative skip from ffa to cfa"""
         if ffa == None:
             ffa = self.last_ffa
-        return self.ffa2lfa(ffa)+2
+        return self.ffa2lfa(ffa)+self.Number.SIZE
 
     def ffa2pfa(self, ffa=None):
         """relative skip from ffa to pfa"""
         if ffa == None:
             ffa = self.last_ffa
-        pfa = self.ffa2lfa(ffa)+4
+        pfa = self.ffa2lfa(ffa)+2*self.Number.SIZE
         return pfa
 
+    def names(self):
+        """Index our own finished words by name, the newest of each name wins"""
+        if self.index == None:
+            self.index = {}
+            ffa = self.last_ffa
+            while (self.base == None or ffa != self.base.last_ffa) and self.bytes.readb(ffa) != 0:
+                ff = self.bytes.readb(ffa)
+                if ff & Dictionary.FLAG_DEFINING == 0:
+                    name = self.readname(self.ffa2nfa(ffa), ff & Dictionary.FIELD_COUNT)
+                    if name not in self.index:
+                        self.index[name] = ffa
+                ffa = self.prev(ffa)
+        return self.index
+
     def find(self, name, ffa=None):
         """Find a word by it's name, following the chain from ffa backwards"""
         if ffa == None:
-            ffa = self.last_ffa
+            # The usual search, from the newest word, is answered by the indexes
+            ffa = self.names().get(name)
+            if ffa != None:
+                return ffa
+            if self.base != None:
+                return self.base.index.get(name, 0)
+            return 0
 
         while True:
+            if self.base != None and ffa == self.base.last_ffa:
+                # the rest of the chain is sealed, so it has an index
+                return self.base.index.get(name, 0)
             # check if FFA is zero
             ff = self.bytes.readb(ffa)
             if ff == 0:
@@ -991,7 +1223,9 @@ class Dictionary(Stack):
 
         ffa = self.find(name)
         if ffa == 0:
-            Debug.fail("Could not find word to forget it:%s", name)
+            Debug.fail("Could not find word to forget it:%s" % name)
+        if self.base != None and ffa <= self.base.ptr:
+            Debug.fail("Cannot forget a word in the sealed base dictionary:%s" % name)
 
         # ffa is the FFA of the first item to delete (the new dict ptr)
         prev = self.prev(ffa) # addr of FFA of the item we want to be the last defined item
@@ -999,12 +1233,45 @@ class Dictionary(Stack):
         # Adjust the pointers
         self.last_ffa = prev # the last defined word in the dictionary
         self.ptr      = ffa  # the H pointer, next free byte in dictionary
+        self.index    = None # it has forgotten words in it
 
 
     #TODO: might be some functions for address calculations exposed as natives too!
     #beware, we might not be able to pass parameters to them, so defaults should be good?
 
 
+class BaseDictionary():
+    """The words of a booted Machine, sealed so that many Machines can share them"""
+    def __init__(self, machine):
+        d = machine.dict
+        self.start    = d.start
+        self.ptr      = d.ptr
+        self.last_ffa = d.last_ffa
+        self.image    = machine.mem.load(d.start, d.ptr+1-d.start)
+        self.cfa_cache  = d.cfa_cache
+        self.pfa0_cache = d.pfa0_cache
+
+        # The sealed words can't change, so index them by name for find()
+        self.index = {}
+        ffa = d.last_ffa
+        while ffa != 0 and self.image[ffa-self.start] != 0:
+            name = d.readname(d.ffa2nfa(ffa), self.image[ffa-self.start] & Dictionary.FIELD_COUNT)
+            if name not in self.index:
+                self.index[name] = ffa # a later word hides an earlier one
+            ffa = d.prev(ffa)
+
+        # Variables of the sealed words live in the user area, so take their initial values
+        uv = machine.uv
+        self.uv_ptr   = uv.ptr
+        self.uv_image = machine.mem.load(uv.start, uv.ptr+1-uv.start)
+
+    def __setitem__(self, key, value):
+        Debug.fail("Tried to write to sealed dictionary offset:0x%x value:0x%x" % (key, value))
+
+    def __getitem__(self, key):
+        return self.image[key]
+
+
 class DataStack(ForthStack):
     """A stack for pushing application data on to """
     def __init__(self, mem, start, size):
@@ -1029,54 +1296,93 @@ class ReturnStack(ForthStack):
 #---- I/O ---------------------------------------------------------------------
 
 class Input():
+    TRIM = 4096 # characters read, before append() drops them from the buffer
+
     def __init__(self):
         self.buf = ""
+        self.pos = 0 # next character to read from buf
 
     def clear(self):
         self.buf = ""
+        self.pos = 0
 
     def set(self, string):
         self.buf = string
+        self.pos = 0
 
-    def append(self, ch):
-        self.buf += ch
+    def append(self, data):
+        # Drop what has been read already, so a long running input doesn't grow forever
+        if self.pos >= Input.TRIM:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        self.buf += data
 
     def waiting(self):
-        return len(self.buf)
+        return len(self.buf) - self.pos
 
     def getch(self, wait=True):
-        if len(self.buf) > 0:
-            c = self.buf[0]
+        if self.pos < len(self.buf):
+            c = self.buf[self.pos]
             #print("getch returns:%s" % c)
-            self.buf = self.buf[1:]
+            self.pos += 1
             return c
         if wait:
-            if len(self.buf) == 0:
-                Debug.fail("WAIT on mock buffer called")
+            Debug.fail("WAIT on mock buffer called")
         return None # nothing in buffer
 
 
 class KeyboardInput(Input):
-    """A way to poll and get characters from the keyboard"""
+    """A way to poll and get characters from the keyboard, or any other readable file"""
+    READ_SIZE = 4096
+
+    def __init__(self, stream=None):
+        Input.__init__(self)
+        self.stream = stream # a file, or a file descriptor, None means sys.stdin
+
+    def fileno(self):
+        stream = self.stream
+        if stream == None:
+            stream = sys.stdin # looked up late, so it can be redirected after import
+        if type(stream) == int:
+            return stream
+        return stream.fileno()
+
+    def fill(self, wait):
+        """Read whatever has arrived into the buffer, a line or a chunk at a time"""
+        fd = self.fileno()
+        if not wait:
+            ready = select.select([fd], [], [], 0)[0]
+            if len(ready) == 0:
+                return
+        data = os.read(fd, KeyboardInput.READ_SIZE)
+        if len(data) == 0: # EOF
+            #Debug.trace("EOF on Keyboard input stream")
+            self.eof = True
+            data = chr(4) # CTRL-D
+        elif type(data) != str:
+            data = data.decode("latin-1")
+        # Drop what has been read already, so buf never grows past one unread chunk
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
 
     def waiting(self):
-        Debug.fail("Not yet implemented")
+        if self.pos == len(self.buf) and not self.eof:
+            self.fill(wait=False)
+        return len(self.buf) - self.pos
 
     eof = False
 
     def getch(self):
-        if self.eof:
-            Debug.fail("EOF followed by another getch()")
-        while True:
-            ch = sys.stdin.read(1) # blocking, line buffered
-            if ch == "": # EOF
-                #Debug.trace("EOF on Keyboard input stream")
-                self.eof = True
-                return chr(4) # CTRL-D
-            if ch == '\r':
-                #print("strip return char")
-                pass # strip return(13), interpret newline(10) #TODO: is this correct?
-            return ch
+        if self.pos == len(self.buf):
+            if self.eof:
+                Debug.fail("EOF followed by another getch()")
+            self.fill(wait=True)
+        ch = self.buf[self.pos]
+        self.pos += 1
+        if ch == '\r':
+            #print("strip return char")
+            pass # strip return(13), interpret newline(10) #TODO: is this correct?
+        return ch
 
 class Output():
     def __init__(self):
@@ -1126,10 +1432,803 @@ class Disk(): #TODO: DiskFile(Disk) - to allow mocking
         return buf
 
     def write(self, blocknum, bytes):
-        f = open(self.filename, "wb")
-        f.seek(Disk.BLOCK_SIZE * blocknum)
-        f.write(bytes) # must be string or buffer, not list
+        self.writemany([(blocknum, bytes)])
+
+    def writemany(self, blocks, sync=False):
+        """Write a batch of (blocknum, bytes) pairs, with at most one fsync"""
+        if os.path.exists(self.filename):
+            f = open(self.filename, "r+b") # update in place, keep other blocks
+        else:
+            f = open(self.filename, "wb")
+        for blocknum, bytes in blocks:
+            f.seek(Disk.BLOCK_SIZE * blocknum)
+            f.write(bytes) # must be string or buffer, not list
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+        f.close()
+
+
+class CompressedDisk(Disk):
+    """A block file that stores each block compressed, behind a sparse index"""
+
+    # File layout:
+    #   HEADER  magic, codec, index offset, index count
+    #   DATA    compressed block payloads, in the order they were appended
+    #   INDEX   one (blocknum, offset, length) entry per block ever written
+    #
+    # All-blank blocks are stored as zero-length entries with no payload.
+    # Blocks that have never been written read back as blank.
+    #
+    # Version 1 files (magic PFZB) have 16 bit block numbers. They are still
+    # read, and become version 2 the next time their index is written.
+
+    MAGIC  = b"PFZ2"
+    HEADER = struct.Struct(">4sBII")
+    ENTRY  = struct.Struct(">QII")
+    ENTRIES = {b"PFZB": struct.Struct(">HII"), MAGIC: ENTRY} # by magic, for each version
+    CODECS = ["zlib", "lzma"]
+    BLANK  = b" " * Disk.BLOCK_SIZE
+
+    def __init__(self, name, codec="zlib"):
+        Disk.__init__(self, name)
+        if codec not in CompressedDisk.CODECS:
+            Debug.fail("Unknown block codec:%s" % codec)
+        self.codec = codec
+        self.index = {} # blocknum -> (offset, length)
+        self.index_offset = CompressedDisk.HEADER.size
+
+        if os.path.exists(self.filename):
+            self.load_index()
+        else:
+            f = open(self.filename, "wb")
+            self.save_index(f)
+            f.close()
+
+    def compressor(self):
+        if self.codec == "lzma":
+            import lzma # not available on all Pythons, so only load it on demand
+            return lzma
+        return zlib
+
+    def load_index(self):
+        """Read the header and index of an existing block file"""
+        f = open(self.filename, "rb")
+        header = f.read(CompressedDisk.HEADER.size)
+        if len(header) != CompressedDisk.HEADER.size:
+            Debug.fail("Truncated block file header:%s" % self.filename)
+        magic, codec, offset, count = CompressedDisk.HEADER.unpack(header)
+        if magic not in CompressedDisk.ENTRIES or codec >= len(CompressedDisk.CODECS):
+            Debug.fail("Not a compressed block file:%s" % self.filename)
+        self.codec = CompressedDisk.CODECS[codec]
+        entry = CompressedDisk.ENTRIES[magic]
+
+        f.seek(offset)
+        entries = f.read(entry.size * count)
         f.close()
+        for i in range(count):
+            blocknum, ofs, length = entry.unpack_from(entries, i * entry.size)
+            self.index[blocknum] = (ofs, length)
+        self.index_offset = offset
+
+    def save_index(self, f):
+        """Write the index at the end of the data, then point the header at it"""
+        entries = []
+        for blocknum in sorted(self.index):
+            ofs, length = self.index[blocknum]
+            entries.append(CompressedDisk.ENTRY.pack(blocknum, ofs, length))
+        f.seek(self.index_offset)
+        f.write(b"".join(entries))
+        f.truncate()
+
+        codec = CompressedDisk.CODECS.index(self.codec)
+        f.seek(0)
+        f.write(CompressedDisk.HEADER.pack(CompressedDisk.MAGIC, codec, self.index_offset, len(entries)))
+
+    def read(self, blocknum):
+        entry = self.index.get(blocknum)
+        if entry == None or entry[1] == 0:
+            return CompressedDisk.BLANK
+
+        ofs, length = entry
+        f = open(self.filename, "rb")
+        f.seek(ofs)
+        payload = f.read(length)
+        f.close()
+        return self.compressor().decompress(payload)
+
+    def writemany(self, blocks, sync=False):
+        f = open(self.filename, "r+b")
+        for blocknum, data in blocks:
+            data = bytes(bytearray(data))
+            if len(data) != Disk.BLOCK_SIZE:
+                Debug.fail("Block write must be exactly %d bytes" % Disk.BLOCK_SIZE)
+
+            if data == CompressedDisk.BLANK:
+                payload = b""
+            else:
+                payload = self.compressor().compress(data)
+
+            entry = self.index.get(blocknum)
+            if entry != None and len(payload) <= entry[1]:
+                # re-use the existing slot, the tail of it just becomes slack
+                ofs = entry[0]
+            else:
+                # append where the index currently is, the index moves up after it
+                ofs = self.index_offset
+                self.index_offset += len(payload)
+            f.seek(ofs)
+            f.write(payload)
+            self.index[blocknum] = (ofs, len(payload))
+
+        self.save_index(f)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+        f.close()
+
+
+class JournalDisk(Disk):
+    """A write-behind journal in front of another Disk.
+
+    WBLK appends the block to the journal and returns straight away. A
+    background flusher commits the journal and applies the batch to the
+    block file every 'interval' seconds, with one fsync per batch. Anything
+    left in the journal from a previous run is replayed when opened."""
+
+    # A journal starts with MAGIC, then one RECORD and its data per WBLK.
+    # A version 1 journal has no MAGIC, and 16 bit block numbers.
+    MAGIC     = b"PFJ2"
+    RECORD    = struct.Struct(">QII") # blocknum, length, crc32
+    RECORD_V1 = struct.Struct(">HII")
+
+    def __init__(self, disk, journal_name=None, interval=DISK_COMMIT_INTERVAL):
+        Disk.__init__(self, disk.filename)
+        self.disk = disk
+        if journal_name == None:
+            journal_name = disk.filename + ".jnl"
+        self.journal_name = journal_name
+        self.pending  = {} # blocknum -> bytes, in the journal but not in the block file
+        self.applying = {} # the batch the flusher is writing to the block file now
+        self.lock = threading.Lock()
+        self.flushing = threading.Lock() # only one batch in flight at a time
+
+        self.replay()
+        self.open_journal()
+
+        self.flusher = None
+        if interval != None:
+            self.interval = interval
+            self.stopping = threading.Event()
+            self.flusher = threading.Thread(target=self.run_flusher)
+            self.flusher.daemon = True
+            self.flusher.start()
+
+    def replay(self):
+        """Apply any journal records left behind by an earlier run"""
+        # The .old journal is a batch that was committed but maybe not applied
+        for name in (self.journal_name + ".old", self.journal_name):
+            if not os.path.exists(name):
+                continue
+            f = open(name, "rb")
+            log = f.read()
+            f.close()
+
+            batch = {}
+            ofs = 0
+            record = JournalDisk.RECORD_V1
+            if log[:len(JournalDisk.MAGIC)] == JournalDisk.MAGIC:
+                ofs = len(JournalDisk.MAGIC)
+                record = JournalDisk.RECORD
+            while ofs + record.size <= len(log):
+                blocknum, length, crc = record.unpack_from(log, ofs)
+                ofs += record.size
+                data = log[ofs:ofs+length]
+                if len(data) != length or (zlib.crc32(data) & 0xFFFFFFFF) != crc:
+                    break # torn write at the tail, it was never committed
+                batch[blocknum] = data
+                ofs += length
+
+            if len(batch) > 0:
+                self.disk.writemany(sorted(batch.items()), sync=True)
+            os.remove(name)
+
+    def open_journal(self):
+        """Start a new, empty journal. MAGIC is written with the first record."""
+        self.journal = open(self.journal_name, "ab")
+        self.started = False
+
+    def read(self, blocknum):
+        with self.lock:
+            data = self.pending.get(blocknum)
+            if data == None:
+                data = self.applying.get(blocknum)
+        if data != None:
+            return data
+        return self.disk.read(blocknum)
+
+    def write(self, blocknum, data):
+        data = bytes(bytearray(data))
+        record = JournalDisk.RECORD.pack(blocknum, len(data), zlib.crc32(data) & 0xFFFFFFFF)
+        with self.lock:
+            if not self.started:
+                record = JournalDisk.MAGIC + record
+                self.started = True
+            self.journal.write(record + data)
+            self.pending[blocknum] = data
+
+    def commit(self):
+        """Make every block written so far durable in the journal"""
+        with self.lock:
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+
+    def flush(self):
+        """Commit the journal, and apply the pending batch to the block file"""
+        with self.flushing:
+            if len(self.applying) != 0:
+                self.apply() # an earlier batch failed part way, its .old journal is still there
+            with self.lock:
+                if len(self.pending) == 0:
+                    return
+                # Commit and rotate the journal, so writers can carry on while we apply
+                self.journal.flush()
+                os.fsync(self.journal.fileno())
+                self.journal.close()
+                os.rename(self.journal_name, self.journal_name + ".old")
+                self.open_journal()
+                self.applying = self.pending
+                self.pending  = {}
+            self.apply()
+
+    def apply(self):
+        """Write the batch being applied to the block file, and drop its journal"""
+        self.disk.writemany(sorted(self.applying.items()), sync=True)
+        with self.lock:
+            self.applying = {}
+            os.remove(self.journal_name + ".old")
+
+    def run_flusher(self):
+        while not self.stopping.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        """Stop the flusher and apply everything still pending"""
+        if self.flusher != None:
+            self.stopping.set()
+            self.flusher.join()
+            self.flusher = None
+        self.flush()
+        self.journal.close()
+
+
+#----- ARRAYS -----------------------------------------------------------------
+#
+# Typed arrays for the ARRAY words. They live outside the 16 bit address
+# space, so Forth code refers to them by a small handle. NumPy is only
+# imported when the first array is made. Lengths and indexes are unsigned
+# cells, so an array has at most Number.MASK elements.
+
+class ArrayStore():
+    """Typed arrays, each one a NumPy view over its own bytearray"""
+    TYPES = ["int16", "int32", "float64"] # indexed by the INT16, INT32, FLOAT64 constants
+
+    def __init__(self):
+        try:
+            import numpy
+        except ImportError:
+            Debug.fail("The ARRAY words need numpy")
+        self.numpy  = numpy
+        self.arrays = [] # handle-1 -> array, None once freed
+        self.owned  = [] # handle-1 -> False while a copy of the store shares the array
+
+    def create(self, count, type):
+        """Make a zeroed array of count elements, returns its handle"""
+        if type >= len(ArrayStore.TYPES):
+            Debug.fail("Unknown array type:%d" % type)
+        dtype = self.numpy.dtype(ArrayStore.TYPES[type])
+        self.arrays.append(self.numpy.frombuffer(bytearray(count * dtype.itemsize), dtype))
+        self.owned.append(True)
+        return len(self.arrays)
+
+    def get(self, handle, write=False):
+        """The array with this handle, a private copy of it if it is to be written"""
+        if handle < 1 or handle > len(self.arrays) or self.arrays[handle-1] is None:
+            Debug.fail("Not an array:%d" % handle)
+        a = self.arrays[handle-1]
+        if write and not self.owned[handle-1]:
+            a = self.numpy.frombuffer(bytearray(a.tobytes()), a.dtype)
+            self.arrays[handle-1] = a
+            self.owned[handle-1] = True
+        return a
+
+    def free(self, handle):
+        self.get(handle)
+        self.arrays[handle-1] = None
+
+    def copy(self):
+        """A copy for a checkpoint. The arrays are shared, and copied when next written."""
+        store = ArrayStore.__new__(ArrayStore)
+        store.numpy  = self.numpy
+        store.arrays = list(self.arrays)
+        store.owned  = [False] * len(self.arrays)
+        self.owned   = [False] * len(self.arrays)
+        return store
+
+
+#----- TRANSLATOR -------------------------------------------------------------
+#
+# Translates the PF of a high level word into a Python function, and installs
+# it as a native routine by pointing the word's CF at it. Values are kept in
+# Python variables within straight line code, and only pushed onto DS before
+# a branch or a call to a native. A word that NEXT has to be involved in, one
+# that uses KEY, PAUSE or EXECUTE for example, is not translated.
+
+class Translation():
+    """A high level word translated to Python"""
+    def __init__(self, cfa, body, guard, source):
+        self.cfa    = cfa
+        self.body   = body   # runs the word, called directly by other translations
+        self.guard  = guard  # (start, end, bytes) of every PF it was translated from
+        self.source = source
+        self.addr   = None   # native routine address, once installed in the CF
+
+    def changed(self, mem):
+        for start, end, image in self.guard:
+            if mem.load(start, end-start) != image:
+                return True
+        return False
+
+
+class Suspend(Exception):
+    """Raised by a translated word at a branch back, when run() has to stop.
+       levels holds (return address, loop frames) for each translated word
+       on the way out, innermost first, so NEXT can carry on from pc."""
+    def __init__(self, pc, loops):
+        Exception.__init__(self)
+        self.pc = pc
+        self.levels = [(None, loops)]
+
+
+class Translator():
+    """Translates high level words to Python functions"""
+
+    # Natives that need ip, RS frames or the scheduler, so they only work from NEXT
+    UNSAFE = ("EXECUTE", "KEY", "PAUSE", "TASK", "ACTIVATE", "STOP", "BYE", "ABORT",
+              "RP@", "RP!", " INTERPRET")
+
+    # Natives that are translated into expressions on values, name: (inputs, expression)
+    EXPRESSIONS = {
+        "+":      (2, "(%s + %s) & M"),
+        "-":      (2, "(%s - %s) & M"),
+        "*":      (2, "(%s * %s) & M"),
+        "AND":    (2, "%s & %s"),
+        "OR":     (2, "%s | %s"),
+        "XOR":    (2, "%s ^ %s"),
+        "=":      (2, "T if %s == %s else 0"),
+        "<>":     (2, "T if %s != %s else 0"),
+        "<":      (2, "T if %s ^ H < %s ^ H else 0"), # signed, by flipping the sign bits
+        ">":      (2, "T if %s ^ H > %s ^ H else 0"),
+        "0=":     (1, "T if %s == 0 else 0"),
+        "1+":     (1, "(%s + 1) & M"),
+        "1-":     (1, "(%s - 1) & M"),
+        "2*":     (1, "(%s << 1) & M"),
+        "NEGATE": (1, "-%s & M"),
+        "@":      (1, "readn(%s)"),
+        "C@":     (1, "readb(%s)"),
+        "R>":     (0, "rpopn()"),
+        "R@":     (0, "rs.getn(0)"),
+    }
+
+    # Stack shuffles, name: (inputs, outputs as indexes into the inputs)
+    SHUFFLES = {
+        "DUP":  (1, (0, 0)),
+        "DROP": (1, ()),
+        "SWAP": (2, (1, 0)),
+        "OVER": (2, (0, 1, 0)),
+        "ROT":  (3, (1, 2, 0)),
+        "NIP":  (2, (1,)),
+        "TUCK": (2, (1, 0, 1)),
+    }
+
+    # Branches that are taken when this is false, name: (inputs, condition)
+    BRANCHES = {
+        "0BRANCH":   (1, "%s"),
+        "=0BRANCH":  (2, "%s == %s"),
+        "<>0BRANCH": (2, "%s != %s"),
+        "<0BRANCH":  (2, "%s ^ H < %s ^ H"),
+        ">0BRANCH":  (2, "%s ^ H > %s ^ H"),
+        "0=0BRANCH": (1, "%s == 0"),
+    }
+
+    MAX_CELLS = 4096 # a PF longer than this is probably not one
+
+    def __init__(self, machine):
+        self.m = machine
+        self.words = {} # cfa -> Translation
+        self.slots = {} # cfa -> native routine index, kept for when it is translated again
+
+    def translated(self, cfa):
+        """The Translation of the word at cfa, if there is one that is still good"""
+        t = self.words.get(cfa)
+        if t == None:
+            return None
+        cf = self.m.mem.readn(cfa)
+        if (t.addr != None and cf == t.addr) or (t.addr == None and cf == self.dodoes):
+            if not t.changed(self.m.mem):
+                return t
+        self.deoptimise(cfa)
+        return None
+
+    def optimise(self, cfa):
+        """Translate the word at cfa, and point its CF at the translation"""
+        m = self.m
+        self.dodoes = m.getNativeRoutineAddress(" DODOES")
+        if m.dict.base != None and cfa <= m.dict.base.ptr:
+            return False # sealed, so its CF can't be changed
+        t = self.translate(cfa, [])
+        if t == None:
+            return False
+        if t.addr == None:
+            if cfa in self.slots:
+                t.addr = m.nr_handler.replace(self.slots[cfa], " TRANSLATED", self.entry(t))
+            else:
+                t.addr = m.nr_handler.add(" TRANSLATED", self.entry(t))
+                self.slots[cfa] = t.addr - m.nrstart
+            m.mem.writen(cfa, t.addr)
+        return True
+
+    def deoptimise(self, cfa):
+        """Put the word at cfa back to being run by NEXT"""
+        t = self.words.pop(cfa, None)
+        if t != None and t.addr != None and self.m.mem.readn(cfa) == t.addr:
+            self.m.mem.writen(cfa, self.m.getNativeRoutineAddress(" DODOES"))
+
+    def entry(self, t):
+        """The native routine for a translation, it checks its PF has not changed first"""
+        m = self.m
+        body = t.body
+        def translated():
+            if t.changed(m.mem):
+                self.deoptimise(t.cfa)
+                m.n_dodoes() # NEXT has set ip to its PFA, so it runs as a high level word
+                return
+            m.tick() # a call is charged once, and each branch back once more
+            try:
+                body()
+            except Suspend as e:
+                self.suspend(e)
+        return translated
+
+    def suspend(self, e):
+        """Put the state of a suspended translation on RS, as NEXT would have left it"""
+        m = self.m
+        for ret, loops in reversed(e.levels):
+            m.depth += 1 # as DODOES would have done for each word
+            for leave, limit, index in loops:
+                m.rs.pushn(leave)
+                m.rs.pushn(limit)
+                m.rs.pushn(index)
+            if ret != None:
+                m.rs.pushn(ret)
+        m.rs.pushn(e.pc) # NEXT pops this into ip
+
+    def translate(self, cfa, active):
+        """Translate the word at cfa, returns None if it can't be"""
+        t = self.translated(cfa)
+        if t != None:
+            return t
+        m = self.m
+        if m.mem.readn(cfa) != self.dodoes or cfa in active:
+            return None
+        active.append(cfa)
+        try:
+            code = self.decode(cfa + m.Number.SIZE, active)
+            if code == None:
+                return None
+            source, env, guard = self.generate(cfa + m.Number.SIZE, code)
+            names = sorted(env.keys())
+            scope = {}
+            exec(compile(source, "<forth %s>" % m.dict.cfa2name(cfa), "exec"), scope)
+            body = scope["make"](*[env[n] for n in names])
+        except (RuntimeError, ValueError, IndexError, SyntaxError):
+            return None # a PF that does not make sense, NEXT can still try to run it
+        finally:
+            active.pop()
+
+        t = Translation(cfa, body, guard, source)
+        self.words[cfa] = t
+        return t
+
+    def decode(self, pfa, active):
+        """Follow every path through a PF, returns {address: (op, operand, next, size)}"""
+        m = self.m
+        S = m.Number.SIZE
+        code = {}
+        todo = [pfa]
+        while len(todo) > 0:
+            addr = todo.pop()
+            while addr not in code:
+                if len(code) > Translator.MAX_CELLS:
+                    return None
+                op = self.classify(m.mem.readn(addr), active)
+                if op == None:
+                    return None
+                name = op[1]
+                operand = None
+                next = addr + S
+                if name in (" DOLIT",):
+                    operand = m.mem.readn(addr+S)
+                    next = addr + 2*S
+                elif name in (" DOSTR", " DOSQ"):
+                    count = m.mem.readb(addr+S)
+                    operand = (addr+S, count)
+                    next = addr + S + (count//S + 1)*S
+                elif name in Translator.BRANCHES or name in ("BRANCH", " DO", " ?DO", " LOOP", " +LOOP"):
+                    operand = addr + S + S*m.Number.asSigned(m.mem.readn(addr+S))
+                    next = addr + 2*S
+                    if name != " LOOP" and name != " +LOOP":
+                        todo.append(operand)
+                code[addr] = (op, operand, next)
+                if name == "EXIT" or name == "BRANCH":
+                    break
+                addr = next
+        return code
+
+    def classify(self, cfa, active):
+        """What the word at cfa is: (kind, name, value), or None if it can't be translated"""
+        m = self.m
+        cf = m.mem.readn(cfa)
+        t = self.translated(cfa)
+        if t != None:
+            return ("call", "", t)
+        if cf == self.dodoes:
+            t = self.translate(cfa, active)
+            if t == None:
+                return None
+            return ("call", "", t)
+        index = cf - m.nrstart
+        if index < 0 or index >= len(m.nr_handler.map):
+            return None
+        name, execfn = m.nr_handler.map[index]
+        if name == " RDPFA":
+            return ("const", name, cfa + m.Number.SIZE)
+        if name == " RDPFAREL":
+            return ("var", name, cfa + m.Number.SIZE)
+        if name in Translator.UNSAFE or name == " TRANSLATED" or name == " DODOES":
+            return None
+        return ("native", name, execfn)
+
+    def generate(self, pfa, code):
+        """Python source for the decoded PF, returns (source, names it uses, guard)"""
+        m = self.m
+        S = m.Number.SIZE
+        env = {"pushn": m.ds.pushn, "popn": m.ds.popn, "rpushn": m.rs.pushn, "rpopn": m.rs.popn,
+               "rs": m.rs, "uv": m.uv, "readn": m.mem.readn, "writen": m.mem.writen,
+               "readb": m.mem.readb, "writeb": m.mem.writeb, "m": m, "Suspend": Suspend,
+               "uservar": m.uservar}
+        guard = []
+        end = pfa
+        for addr in code:
+            end = max(end, code[addr][2])
+        if m.dict.base == None or pfa > m.dict.base.ptr: # the sealed words can't change
+            guard.append((pfa, end, m.mem.load(pfa, end-pfa)))
+
+        # Blocks start where a branch goes to, and after a branch
+        starts = set([pfa])
+        loops = [] # (DO address, address after its LOOP) for I, J and LEAVE
+        for addr in code:
+            op, operand, next = code[addr]
+            name = op[1]
+            if name in Translator.BRANCHES or name in (" DO", " ?DO", " LOOP", " +LOOP"):
+                starts.add(operand)
+                starts.add(next)
+            elif name == "BRANCH":
+                starts.add(operand)
+            if name == " DO" or name == " ?DO":
+                loops.append((addr, operand))
+            if op[0] == "call":
+                env["b%d" % op[2].cfa] = op[2].body
+                guard.extend(op[2].guard)
+
+        def enclosing(addr):
+            # loops around addr, innermost last, each is (index var, limit var, leave address)
+            around = [l for l in loops if l[0] < addr < l[1]]
+            around.sort()
+            return [("i%d" % l[0], "l%d" % l[0], l[1]) for l in around]
+
+        lines = []
+        for start in sorted(starts):
+            if start not in code:
+                continue # a LEAVE address that nothing jumps to
+            block = Block()
+            addr = start
+            while True:
+                if not self.emit(block, addr, code[addr], enclosing, env):
+                    break # it has set pc, or returned
+                addr = code[addr][2]
+                if addr in starts:
+                    block.flush()
+                    block.line("pc = %d" % addr)
+                    break
+            lines.append((start, block.lines))
+
+        M, H = m.Number.MASK, 1 << (m.Number.BITS-1)
+        src = ["def make(%s):" % ", ".join(sorted(env.keys())),
+               "    M, H, T = %d, %d, %d" % (M, H, m.TRUE),
+               "    def body():"]
+        if len(lines) == 1 and lines[0][1][-1] == "return":
+            for l in lines[0][1]:
+                src.append("        " + l)
+        else:
+            src.append("        pc = %d" % pfa)
+            src.append("        while True:")
+            for start, block in lines:
+                src.append("            if pc == %d:" % start)
+                for l in block:
+                    src.append("                " + l)
+        src.append("    return body")
+        return "\n".join(src) + "\n", env, guard
+
+    def backward(self, b, dest, loops, indent=""):
+        """Python for a branch back to dest. It is charged to the budget, and
+           when run() has to stop, the loops around dest go back on RS."""
+        frames = "".join(["(%d, %s, %s), " % (leave, l, i) for i, l, leave in loops])
+        b.line(indent + "m.tick()")
+        b.line(indent + "if m.attention:")
+        b.line(indent + "    raise Suspend(%d, (%s))" % (dest, frames))
+
+    def emit(self, b, addr, instr, enclosing, env):
+        """Python for one cell of the PF, returns False if the block ends with it"""
+        op, operand, next = instr
+        kind, name, value = op
+        loops = enclosing(addr)
+        if kind == "const":
+            b.push(b.temp("readn(%d)" % value))
+        elif kind == "var":
+            b.push(b.temp("uservar(readn(%d))" % value))
+        elif kind == "call":
+            b.flush()
+            frames = "".join(["(%d, %s, %s), " % (leave, l, i) for i, l, leave in loops])
+            b.line("try:")
+            b.line("    b%d()" % value.cfa)
+            b.line("except Suspend as e:")
+            b.line("    e.levels.append((%d, (%s)))" % (next, frames))
+            b.line("    raise")
+        elif name == " DOLIT":
+            b.push(str(operand))
+        elif name == " DOSTR":
+            b.push(str(operand[0]))
+        elif name == " DOSQ":
+            b.push(str(operand[0]+1))
+            b.push(str(operand[1]))
+        elif name in Translator.SHUFFLES:
+            inputs, outputs = Translator.SHUFFLES[name]
+            values = b.pop(inputs)
+            for i in outputs:
+                b.push(values[i])
+        elif name in (">R", "R>", "R@") and len(loops) > 0:
+            # NEXT keeps loop frames on RS, so these would not see the same RS
+            raise ValueError("%s inside a loop" % name)
+        elif name in Translator.EXPRESSIONS:
+            inputs, expr = Translator.EXPRESSIONS[name]
+            b.push(b.temp(expr % tuple(b.pop(inputs))))
+        elif name == "!":
+            n, a = b.pop(2)
+            b.line("writen(%s, %s)" % (a, n))
+        elif name == "C!":
+            n, a = b.pop(2)
+            b.line("writeb(%s, %s & 0xFF)" % (a, n))
+        elif name == ">R":
+            b.line("rpushn(%s)" % b.pop(1)[0])
+        elif name == "I" or name == "J":
+            depth = 1
+            if name == "J":
+                depth = 2
+            if len(loops) < depth:
+                raise ValueError("%s outside a loop" % name)
+            b.push(loops[-depth][0])
+        elif name == "UNLOOP":
+            if len(loops) == 0:
+                raise ValueError("UNLOOP outside a loop")
+        elif name == "LEAVE":
+            if len(loops) == 0:
+                raise ValueError("LEAVE outside a loop")
+            b.flush()
+            b.line("pc = %d" % loops[-1][2])
+            return False
+        elif name == "EXIT":
+            b.flush()
+            b.line("return")
+            return False
+        elif name == "BRANCH":
+            b.flush()
+            b.line("pc = %d" % operand)
+            if operand <= addr:
+                self.backward(b, operand, enclosing(operand))
+            return False
+        elif name in Translator.BRANCHES:
+            inputs, cond = Translator.BRANCHES[name]
+            cond = cond % tuple(b.pop(inputs))
+            b.flush()
+            if operand <= addr:
+                b.line("if %s:" % cond)
+                b.line("    pc = %d" % next)
+                b.line("else:")
+                b.line("    pc = %d" % operand)
+                self.backward(b, operand, enclosing(operand), "    ")
+            else:
+                b.line("pc = %d if %s else %d" % (next, cond, operand))
+            return False
+        elif name == " DO" or name == " ?DO":
+            limit, index = b.pop(2)
+            b.flush()
+            i, l = "i%d" % addr, "l%d" % addr
+            b.line("%s, %s = %s, %s" % (i, l, index, limit))
+            if name == " ?DO":
+                b.line("pc = %d if %s == %s else %d" % (operand, i, l, next))
+            else:
+                b.line("pc = %d" % next)
+            return False
+        elif name == " LOOP" or name == " +LOOP":
+            if len(loops) == 0 or loops[-1][2] != next:
+                raise ValueError("LOOP without its DO")
+            i, l = loops[-1][0], loops[-1][1]
+            step = "1"
+            if name == " +LOOP":
+                step = b.temp("%s - ((%s & H) << 1)" % ((b.pop(1)[0],)*2)) # signed
+            b.flush()
+            b.line("left = ((%s - %s) & M) + %s" % (i, l, step))
+            b.line("if left < 0 or left > M:")
+            b.line("    pc = %d" % next)
+            b.line("else:")
+            b.line("    %s = (%s + %s) & M" % (i, i, step))
+            b.line("    pc = %d" % operand)
+            self.backward(b, operand, loops, "    ")
+            return False
+        else:
+            # any other native is called as it is, with the values on DS
+            b.flush()
+            env["n%d" % addr] = value
+            b.line("n%d()" % addr)
+        return True
+
+
+class Block():
+    """Python source for a run of cells with no branch into it, and values not yet on DS"""
+    def __init__(self):
+        self.lines  = []
+        self.values = [] # names or numbers, the top of DS is last
+        self.temps  = 0
+
+    def line(self, text):
+        self.lines.append(text)
+
+    def temp(self, expr):
+        """Evaluate expr now, into a new variable"""
+        self.temps += 1
+        name = "t%d" % self.temps
+        self.line("%s = %s" % (name, expr))
+        return name
+
+    def push(self, value):
+        self.values.append(value)
+
+    def pop(self, count):
+        """The top count values, deepest first, popping DS for any that are not held"""
+        values = []
+        for i in range(count):
+            if len(self.values) > 0:
+                values.insert(0, self.values.pop())
+            else:
+                values.insert(0, self.temp("popn()"))
+        return values
+
+    def flush(self):
+        """Push the values held onto DS"""
+        for v in self.values:
+            self.line("pushn(%s)" % v)
+        self.values = []
 
 
 #----- FORTH MACHINE INNER INTERPRETER ----------------------------------------
@@ -1138,24 +2237,28 @@ class NvMem():
     """Provides access to native variables mapped into memory"""
 
     def __init__(self, parent, start):
+        C = parent.Number.SIZE # every register is one cell
         self.map = [
-            # name,   o, l,   rd,                   wr
-            #("TREG",  0, 2,   parent.rd_test,       parent.wr_test),
-            ("IP",    2, 2,   parent.rd_ip,         parent.wr_ip),
-            ("H",     4, 2,   parent.dict.rd_p,     parent.dict.wr_p),
-            ("SP",    6, 2,   parent.ds.rd_p,       parent.ds.wr_p),
-            ("RP",    8, 2,   parent.rs.rd_p,       parent.rs.wr_p),
-            ("UVP",  10, 2,   parent.uv.rd_p,       parent.uv.wr_p),
-            ("BASE", 12, 2,   parent.rd_base,       parent.wr_base),
-            ("DS#",  14, 2,   parent.rd_dshash,     None),
-            #15
+            # name,   o,   l,   rd,                   wr
+            #("TREG",  0*C, C,   parent.rd_test,       parent.wr_test),
+            ("IP",    1*C, C,   parent.rd_ip,         parent.wr_ip),
+            ("H",     2*C, C,   parent.dict.rd_p,     parent.dict.wr_p),
+            ("SP",    3*C, C,   parent.ds.rd_p,       parent.ds.wr_p),
+            ("RP",    4*C, C,   parent.rs.rd_p,       parent.rs.wr_p),
+            ("UVP",   5*C, C,   parent.uv.rd_p,       parent.uv.wr_p),
+            ("BASE",  6*C, C,   parent.rd_base,       parent.wr_base),
+            ("DS#",   7*C, C,   parent.rd_dshash,     None),
+            ("DPL",   8*C, C,   parent.rd_dpl,        parent.wr_dpl),
+            ("STATE", 9*C, C,   parent.rd_state,      parent.wr_state),
+            #10*C
 
             #("SVP",  12, 2,   parent.sv.rd_p,       parent.sv.wr_p),
             #example of a large buffer
             #("BUF",  2, 100,   parent.rd_buf,        parent.wr_buf),
             # : FLAGS  ( -- n)                     /ADD  n_RDPFA  VAR    Address of flags variable
         ]
-        self.register_in_dict(parent, start)
+        if parent.basedict == None: # otherwise they are already in the sealed words
+            self.register_in_dict(parent, start)
 
     def register_in_dict(self, parent, start):
         """Register any native routines that want a DICT entry"""
@@ -1200,7 +2303,16 @@ class NvMem():
 
 class NvRoutine():
     """Provides access to native routines mapped into memory"""
-    def __init__(self, parent, start):
+
+    # Routines that run when they are met while compiling, rather than being compiled
+    IMMEDIATE = (";", "[", "LITERAL", "[']", "DO", "?DO", "LOOP", "+LOOP", 'S"',
+                 "IF", "ELSE", "THEN", "BEGIN", "UNTIL", "AGAIN", "WHILE", "REPEAT",
+                 "CASE", "OF", "ENDOF", "ENDCASE")
+
+    def __init__(self, parent, start, size):
+        self.parent = parent
+        self.start  = start
+        self.size   = size # at most this many routines
         self.map = [
             ("NOP",        parent.n_nop),       # 00 must always be first entry
             ("ABORT",      parent.n_abort),     # 01
@@ -1246,7 +2358,120 @@ class NvRoutine():
             ("U.",         parent.n_udot),      # 29
             ("D.",         parent.n_ddot),      # 30
             ("UD.",        parent.n_uddot),     # 31
-            #("KEYQ",       parent.n_keyq),
+            (" RDPFAREL",  parent.n_rdpfarel),  # 32
+            ("PAUSE",      parent.n_pause),     # 33
+            ("TASK",       parent.n_task),      # 34
+            ("ACTIVATE",   parent.n_activate),  # 35
+            ("STOP",       parent.n_stop),      # 36
+            ("KEY?",       parent.n_keyq),      # 37
+            ("NUMBER?",    parent.n_numberq),   # 38
+            (">NUMBER",    parent.n_tonumber),  # 39
+            ("CONVERT",    parent.n_convert),   # 40
+            ("<#",         parent.n_lessnum),   # 41
+            ("#",          parent.n_num),       # 42
+            ("#S",         parent.n_nums),      # 43
+            ("HOLD",       parent.n_hold),      # 44
+            ("SIGN",       parent.n_sign),      # 45
+            ("#>",         parent.n_numgreater),# 46
+            (".R",         parent.n_dotr),      # 47
+            ("U.R",        parent.n_udotr),     # 48
+            ("D.R",        parent.n_ddotr),     # 49
+            ("D+",         parent.n_dadd),      # 50
+            ("D-",         parent.n_dsub),      # 51
+            ("DNEGATE",    parent.n_dnegate),   # 52
+            ("D<",         parent.n_dlt),       # 53
+            ("D=",         parent.n_deq),       # 54
+            ("UM*",        parent.n_ummult),    # 55
+            ("M*",         parent.n_mmult),     # 56
+            ("UM/MOD",     parent.n_umdivmod),  # 57
+            ("SM/REM",     parent.n_smdivrem),  # 58
+            ("FM/MOD",     parent.n_fmdivmod),  # 59
+            ("*/",         parent.n_multdiv),   # 60
+            ("*/MOD",      parent.n_multdivmod),# 61
+            ("2DUP",       parent.ds.dup2),     # 62
+            ("2SWAP",      parent.ds.swap2),    # 63
+            ("2OVER",      parent.ds.over2),    # 64
+            ("2DROP",      parent.ds.drop2),    # 65
+            ("2!",         parent.n_store2),    # 66
+            ("2@",         parent.n_fetch2),    # 67
+            ("CMOVE",      parent.n_cmove),     # 68
+            ("CMOVE>",     parent.n_cmoveup),   # 69
+            ("MOVE",       parent.n_move),      # 70
+            ("FILL",       parent.n_fill),      # 71
+            ("ERASE",      parent.n_erase),     # 72
+            ("BLANK",      parent.n_blank),     # 73
+            ("COMPARE",    parent.n_compare),   # 74
+            ("SEARCH",     parent.n_search),    # 75
+            ("-TRAILING",  parent.n_trailing),  # 76
+            ("/STRING",    parent.n_slashstring),# 77
+            (" DOSQ",      parent.n_dosq),      # 78
+            ('S"',         parent.n_squote),    # 79
+            ("ARRAY",      parent.n_array),     # 80
+            ("ARRAY@",     parent.n_arrayfetch),# 81
+            ("ARRAY!",     parent.n_arraystore),# 82
+            ("ARRAY-LEN",  parent.n_arraylen),  # 83
+            ("ARRAY-FREE", parent.n_arrayfree), # 84
+            ("ARRAY-FILL", parent.n_arrayfill), # 85
+            ("ARRAY-MAP+", parent.n_arraymapadd),# 86
+            ("ARRAY-SUM",  parent.n_arraysum),  # 87
+            ("ARRAY-DOT",  parent.n_arraydot),  # 88
+            ("ARRAY-SORT", parent.n_arraysort), # 89
+            (" DO",        parent.n_do),        # 90
+            (" ?DO",       parent.n_qdo),       # 91
+            (" LOOP",      parent.n_loop),      # 92
+            (" +LOOP",     parent.n_plusloop),  # 93
+            ("I",          parent.n_i),         # 94
+            ("J",          parent.n_j),         # 95
+            ("LEAVE",      parent.n_leave),     # 96
+            ("UNLOOP",     parent.n_unloop),    # 97
+            (">R",         parent.n_tor),       # 98
+            ("R>",         parent.n_rfrom),     # 99
+            ("R@",         parent.n_rfetch),    # 100
+            ("RP@",        parent.n_rpfetch),   # 101
+            ("RP!",        parent.n_rpstore),   # 102
+            ("=",          parent.n_eq),        # 103
+            ("<>",         parent.n_ne),        # 104
+            ("<",          parent.n_lt),        # 105
+            (">",          parent.n_gt),        # 106
+            ("1+",         parent.n_inc),       # 107
+            ("1-",         parent.n_dec),       # 108
+            ("2*",         parent.n_mult2),     # 109
+            ("2/",         parent.n_div2),      # 110
+            ("NEGATE",     parent.n_negate),    # 111
+            ("ABS",        parent.n_abs),       # 112
+            ("MIN",        parent.n_min),       # 113
+            ("MAX",        parent.n_max),       # 114
+            ("/MOD",       parent.n_divmod),    # 115
+            (" INTERPRET", parent.n_interpret), # 116
+            (":",          parent.n_colon),     # 117
+            (";",          parent.n_semicolon), # 118
+            ("IMMEDIATE",  parent.n_immediate), # 119
+            ("[",          parent.n_lbracket),  # 120
+            ("]",          parent.n_rbracket),  # 121
+            ("LITERAL",    parent.n_literal),   # 122
+            ("'",          parent.n_tick),      # 123
+            ("[']",        parent.n_brackettick),# 124
+            ("DO",         parent.n_cdo),       # 125
+            ("?DO",        parent.n_cqdo),      # 126
+            ("LOOP",       parent.n_cloop),     # 127
+            ("+LOOP",      parent.n_cplusloop), # 128
+            ("=0BRANCH",   parent.n_eq0branch), # 129
+            ("<>0BRANCH",  parent.n_ne0branch), # 130
+            ("<0BRANCH",   parent.n_lt0branch), # 131
+            (">0BRANCH",   parent.n_gt0branch), # 132
+            ("0=0BRANCH",  parent.n_0eq0branch),# 133
+            ("IF",         parent.n_if),        # 134
+            ("ELSE",       parent.n_else),      # 135
+            ("THEN",       parent.n_then),      # 136
+            ("BEGIN",      parent.n_begin),     # 137
+            ("UNTIL",      parent.n_until),     # 138
+            ("AGAIN",      parent.n_again),     # 139
+            ("WHILE",      parent.n_while),     # 140
+            ("REPEAT",     parent.n_repeat),    # 141
+            ("CASE",       parent.n_case),      # 142
+            ("OF",         parent.n_of),        # 143
+            ("ENDOF",      parent.n_endof),     # 144
+            ("ENDCASE",    parent.n_endcase),   # 145
             #(" DOCOL",    parent.n_docol),
             #(" DOCON",     parent.n_docon),
             #(" DOVAR",     parent.n_dovar),
@@ -1260,8 +2485,13 @@ class NvRoutine():
             #("U<",         parent.n_ult),
             #("FLAGS",      parent.n_flags),
         ]
-        
-        self.register_in_dict(parent, start)
+        # Routines can also be added later with register(), so look them up by name
+        self.index = {}
+        for i in range(len(self.map)):
+            self.index.setdefault(self.map[i][0], i)
+
+        if parent.basedict == None: # otherwise they are already in the sealed words
+            self.register_in_dict(parent, start)
 
     def register_in_dict(self, parent, start):
         """Register any native routines that want a DICT entry"""
@@ -1275,17 +2505,35 @@ class NvRoutine():
                 if execfn != None:
                     # It's a native code call, with no parameters
                     addr = i + start
-                    parent.dict.create(nf=name, cf=addr, pf=[], finish=True)
+                    parent.dict.create(nf=name, cf=addr, pf=[], immediate=name in NvRoutine.IMMEDIATE, finish=True)
+
+    def register(self, name, execfn, immediate=False):
+        """Add a native routine after boot, with a DICT entry. Returns its address."""
+        addr = self.add(name, execfn)
+        self.index[name] = addr - self.start # a later routine hides an earlier one, like the DICT
+        self.parent.dict.create(nf=name, cf=addr, pf=[], immediate=immediate, finish=True)
+        return addr
+
+    def add(self, name, execfn):
+        """Add a native routine after boot, with no DICT entry. Returns its address."""
+        if len(self.map) >= self.size:
+            Debug.fail("No room for another native routine:%s" % name)
+        self.map.append((name, execfn))
+        return len(self.map)-1 + self.start
+
+    def replace(self, index, name, execfn):
+        """Re-use the slot of a routine added earlier. Returns its address."""
+        self.map[index] = (name, execfn)
+        return index + self.start
 
     def getIndex(self, name):
         """Get the offset index of a native routine."""
         # Note: Hidden names are preceeded by a space
         # Note: This is an index into the table, not an absolute address
-        for i in range(len(self.map)):
-            n = (self.map[i])[0]
-            if n == name:
-                return i
-        Debug.fail("native function not found:%s", name)
+        index = self.index.get(name)
+        if index == None:
+            Debug.fail("native function not found:%s" % name)
+        return index
 
     def call(self, index):
         """Look up the call index in the dispatch table, and dispatch if known"""
@@ -1304,24 +2552,84 @@ class NvRoutine():
         Debug.fail("Tried to read from NvRoutine memory offset:0x%x" % key)
 
 
+class Task():
+    """The saved registers of one cooperative task"""
+    def __init__(self, ds, rs, uv):
+        # Each task has its own data stack, return stack and user variables.
+        # These are only bookkeeping copies, the Machine's own ds/rs/uv are
+        # re-pointed at them whenever this task is switched in.
+        self.ds = ds
+        self.rs = rs
+        self.uv = uv
+        self.active  = False
+        self.stopped = False # it ran and stopped, TASK may hand its slot out again
+        self.ip    = 0
+        self.w     = None
+        self.depth = 0
+        self.base  = 10
+
+
+class Checkpoint():
+    """A saved Machine state, that can be restored any number of times"""
+    def __init__(self, pages, regs):
+        self.pages = pages # tuple of Memory pages, shared copy-on-write with the Machine
+        self.regs  = regs
+
+
+# The value of every character as a digit, for bases up to 36, 0xFF if not a digit
+DIGITS = bytearray(b"\xFF" * 256)
+for i in range(36):
+    DIGITS[ord("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"[i])] = i
+    DIGITS[ord("0123456789abcdefghijklmnopqrstuvwxyz"[i])] = i
+
+# Any of these in a number makes it a double, as in FORTH-83
+PUNCTUATION = bytearray(b",./;:-")
+
+# The character for every digit, for pictured numeric output
+DIGIT_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
 class Machine():
     """The inner-interpreter of the lower level/native FORTH words"""
 
     FALSE = 0x0000
-    TRUE  = 0xFFFF #TODO: or -1 (not the same in python, but same in Forth)
 
     def __init__(self, parent):
-        self.ip     = 0
-        self.outs   = parent.outs
-        self.ins    = parent.ins
-        self.disk   = parent.disk
-        self.base   = 10
+        self.ip      = 0
+        self.outs    = parent.outs
+        self.ins     = parent.ins
+        self.disk    = parent.disk
+        self.memsize = parent.memsize
+        self.cellbits = parent.cellbits
+        self.Number, self.Double = cell_types(parent.cellbits)
+        self.TRUE    = self.Number.MASK # all bits of a cell set
+        self.basedict = parent.basedict
+        self.base    = 10
+        self.dpl     = -1 # digits after the punctuation in the last number, -1 if none
+        self.arrays  = None # an ArrayStore, made by the first ARRAY
+        self.translator = None # a Translator, made by the first optimise()
+        self.state   = 0    # STATE, non zero while compiling a definition
+        self.csp     = 0    # bytes on DS at :, so ; can tell if a control structure is open
+
+    # Memory for each extra task, carved out of the TASKS region
+    TASK_DS_SIZE = 128
+    TASK_RS_SIZE = 128
+    TASK_UV_SIZE = 64
 
     def boot(self):
         self.build_ds()       # builds memory abstractions
         self.running = False
-        self.limit = None     # how many times round DODOES before early terminate?
-        self.exits_pending = 0
+        self.limit = None     # how many calls and backward branches before early terminate?
+        self.ticks = -1       # what is left of the budget given to run(), see tick()
+        self.blocking = True  # may KEY wait for input, or must run() return WAITING?
+        self.waiting = False  # set when KEY has no input and must not block
+        self.error = None     # the exception that made run() return ERROR
+        self.aborted = False  # set by ABORT, so a host can tell it from BYE
+        self.errors = 0       # interpreter errors so far, like an undefined word
+        self.w = None         # a CFA to run before fetching the next one from ip
+        self.depth = 0        # how many high level words are active in this task
+        self.attention = False # set when run() must look at more than the next CFA
+        self.pausing = False  # set when the current task wants to give up the machine
         return self
 
     def build_ds(self):
@@ -1329,7 +2637,7 @@ class Machine():
         #           base,             dirn/size
         NR_MEM   = (0x0000,          +256)     # native routines
         NV_MEM   = (0x0100,          +256)     # native variables
-        DICT_MEM = (0x0400,          +4096)    # dictionary
+        DICT_MEM = (0x0400,          +2048*self.Number.SIZE) # dictionary
         DS_MEM   = (0x8000,          -1024)    # data stack
         TIB_MEM  = (0x8000,          +80)      # text input buffer
         RS_MEM   = (0xA000,          -1024)    # return stack
@@ -1337,12 +2645,15 @@ class Machine():
 
         # static buffer for now, eventually it will have to float dynamically
         PAD_MEM  = (0xB000,          +80       )    # pad
+        HOLD_MEM = (0xB000,          -256)     # pictured numeric output, built down from PAD
+
+        TASK_MEM = (0xB100,          +0x0F00)  # stacks and user variables of extra tasks
 
         #BB_MEM   = (65536-(1024*2),  +(1024*2)  )    # block buffers
         #SV_MEM    = (0,               +1024     )    # system variables
         #EL_MEM    = (1024,            +0        )    # electives
 
-        self.mem = Memory(mem)
+        self.mem = Memory(self.memsize, self.cellbits)
 
         # Init sysvars
         #svstart, svsize = self.mem.region("SV", SV_MEM)
@@ -1353,13 +2664,25 @@ class Machine():
         #self.el = Elective(self.mem, elstart, elsize)
 
         # Init dictionary
-        self.dictstart, self.dictsize = self.mem.region("DICT", DICT_MEM)
-        self.dict = Dictionary(self.mem, self.dictstart, self.dictsize)
+        if self.basedict == None:
+            self.dictstart, self.dictsize = self.mem.region("DICT", DICT_MEM)
+        else:
+            # The shared sealed words come first, then this machine's own words
+            basesize = len(self.basedict.image)
+            self.mem.region("BASE", (DICT_MEM[0], basesize), handler=self.basedict)
+            self.mem.region("DICT", (DICT_MEM[0]+basesize, DICT_MEM[1]-basesize))
+            self.dictstart, self.dictsize = DICT_MEM
+        self.dict = Dictionary(self.mem, self.dictstart, self.dictsize, self.basedict)
 
         # Init pad
         self.padstart, self.padsize = self.mem.region("PAD", PAD_MEM)
         self.pad = Buffer(self.mem, self.padstart, self.padsize)
 
+        # Init pictured numeric output
+        self.holdstart, self.holdsize = self.mem.region("HOLD", HOLD_MEM)
+        self.holdend = self.holdstart + self.holdsize
+        self.hld = self.holdend # address of the last character held
+
         # Init data stack
         self.dsstart, self.dssize = self.mem.region("DS", DS_MEM)
         self.ds = DataStack(self.mem, self.dsstart, self.dssize)
@@ -1375,21 +2698,46 @@ class Machine():
         # Init user variables (BASE, S0,...)
         self.uvstart, self.uvsize = self.mem.region("UV", UV_MEM)
         self.uv = UserVars(self.mem, self.uvstart, self.uvsize)
+        if self.basedict != None:
+            image = self.basedict.uv_image
+            self.mem.store(self.uvstart, image)
+            self.uv.ptr = self.basedict.uv_ptr
+
+        # Init tasks, the operator task (0) uses the stacks and vars above
+        self.taskstart, self.tasksize = self.mem.region("TASKS", TASK_MEM)
+        operator = Task(DataStack(self.mem, self.dsstart, self.dssize),
+                        ReturnStack(self.mem, self.rsstart, self.rssize),
+                        UserVars(self.mem, self.uvstart, self.uvsize))
+        operator.uv.ptr = self.uv.ptr
+        operator.active = True
+        self.tasks = [operator]
+        self.task  = 0 # index of the running task
 
         # Init block buffers
         #bbstart, bbsize = self.mem.region("BB", BB_MEM)
         #self.bb = BlockBuffers(self.mem, bbstart, bbsize)
 
         # Init Native Routines (last so that they can refer to other data structures)
-        self.nr_handler = NvRoutine(self, NR_MEM[0])
+        self.nr_handler = NvRoutine(self, NR_MEM[0], NR_MEM[1])
         self.nrstart, self.nrsize = self.mem.region("NR", NR_MEM, handler=self.nr_handler)
 
         # Init Native Variables (last so they can refer to other data structures)
         self.nv_handler = NvMem(self, NV_MEM[0])
         self.nvstart, self.nvsize = self.mem.region("NV", NV_MEM, handler=self.nv_handler)
 
+        # Comparisons that a following 0BRANCH is fused into, see zero_branch()
+        self.fused = {}
+        for name in ("=", "<>", "<", ">", "0="):
+            self.fused[self.find_cfa(name)] = self.find_cfa(name + "0BRANCH")
+        self.last_word = None # address of the last CFA compiled, while it may still be fused
+
         #self.mem.show_map()
 
+    def var(self, name):
+        """Get the address of a variable in the running task"""
+        pfa = self.dict.ffa2pfa(self.dict.find(name))
+        return self.uv.start + self.mem.readn(pfa)
+
     def getNativeRoutineAddress(self, name):
         # Note: This will fail with an exception if it can't find the name
         addr = self.nr_handler.getIndex(name)
@@ -1399,81 +2747,362 @@ class Machine():
     def call(self, addr):
         self.mem.call(addr)
 
-    def writen(self, number):
-        """Write a cell sized 16 bit number, as a signed quantity"""
-        number = Number.asSigned(number)
-        self.outs.writestr(str(number))
+    def register(self, name, execfn, immediate=False):
+        """Add a native word, execfn is called with no arguments and works on the stacks"""
+        return self.nr_handler.register(name, execfn, immediate)
 
-    def writeu(self, number):
-        """Write a cell sized 16 bit number, as an unsigned quantity"""
-        number = Number.asUnsigned(number)
-        self.outs.writestr(str(number))
+    def optimise(self, cfa):
+        """Translate the high level word at cfa to Python, returns False if it can't be"""
+        if self.translator == None:
+            self.translator = Translator(self)
+        return self.translator.optimise(cfa)
 
-    def writed(self, double):
-        """Write a 2-cell sized 32 bit number, as a signed quantity"""
-        double = Double.asSigned(double)
-        self.outs.writestr(str(double))
+    def deoptimise(self, cfa):
+        """Run the word at cfa with NEXT again"""
+        if self.translator != None:
+            self.translator.deoptimise(cfa)
 
-    def writeud(self, double):
-        """Write a 2-cell sized 32 bit number, as an unsigned quantity"""
-        double = Number.asUnsigned(double)
-        self.outs.writestr(str(double))
+    def find_cfa(self, name):
+        """The CFA of a word, which must be in the dictionary"""
+        ffa = self.dict.find(name)
+        if ffa == 0:
+            Debug.fail("Word not in dictionary:%s" % name)
+        return self.dict.ffa2cfa(ffa)
+
+    # What run() returns
+    HALTED  = 0 # the top level word returned, or BYE or ABORT stopped the machine
+    YIELDED = 1 # the step budget ran out, run() again to carry on
+    WAITING = 2 # KEY needs a character that has not arrived yet, run() again when it has
+    ERROR   = 3 # an exception stopped the machine, it is in self.error
+
+    def start(self, cfa):
+        """Make the word at cfa the top level word of the operator task, run() runs it"""
+        if self.task != 0:
+            self.save_task()
+            self.load_task(0)
+        self.rs.reset()
+        self.w = cfa
+        self.depth = 0
+        self.running = True
+        self.attention = False
+        self.pausing = False
+        self.waiting = False
+        self.error = None
+        self.aborted = False
+
+    def execute(self, cfa):
+        """Run the word at cfa to completion, blocking in KEY if need be"""
+        # limit is a budget shared by all execute()s, spending it stops the machine
+        self.start(cfa)
+        self.budget(self.limit)
+        self.blocking = True
+        status = self.loop()
+        if self.limit != None:
+            self.limit = max(self.ticks, 0)
+            if status == Machine.YIELDED:
+                self.running = False
+        return status
+
+    def run(self, max_steps=None):
+        """Run for up to max_steps calls and backward branches, returns a status.
+           A later run() carries on exactly where this one stopped."""
+        if not self.running or (self.task == 0 and self.depth == 0 and self.w == None):
+            return Machine.HALTED
+        self.budget(max_steps)
+        self.blocking = False
+        try:
+            return self.loop()
+        except Exception as e:
+            self.error = e
+            self.running = False
+            return Machine.ERROR
+
+    def budget(self, steps):
+        """Allow steps more calls and backward branches, None means no limit"""
+        if steps == None:
+            self.ticks = -1 # counts down, but never gets back to 0
+        else:
+            self.ticks = steps
+            if steps <= 0:
+                self.attention = True
+
+    def tick(self):
+        """Charge one step to the budget, called by DODOES and backward branches"""
+        # Straight line code always ends in a call or a branch back, so
+        # this bounds the run time without a check on every NEXT
+        self.ticks -= 1
+        if self.ticks == 0:
+            self.attention = True
+
+    def loop(self):
+        """The NEXT loop, runs until schedule() has a status to return"""
+        # High level words do not recurse in Python. DODOES just pushes the
+        # caller's return address on RS, and EXIT pops it again, so the whole
+        # state of a task is in ip, w, depth and its stacks.
+        mem = self.mem
+        rs  = self.rs # re-pointed, not replaced, on a task switch
+        if self.attention:
+            status = self.schedule()
+            if status != None:
+                return status
+        while True:
+            #NEXT
+            if self.w == None:
+                # ip points to the cfa of the word to execute
+                cfa = mem.readn(self.ip)
+                ret = self.ip + self.Number.SIZE
+            else:
+                # EXECUTE, or a task resuming a word it had to retry
+                cfa = self.w
+                self.w = None
+                ret = self.ip
+            cf = mem.readn(cfa)
+            rs.pushn(ret)
+            # put something useful in self.ip, i.e. the pfa
+            self.ip = cfa+self.Number.SIZE
+            self.call(cf)
+            self.ip = rs.popn()
+
+            if self.attention or self.depth == 0:
+                status = self.schedule()
+                if status != None:
+                    return status
+
+    def schedule(self):
+        """Switch tasks if required, returns a status when loop() should return"""
+        self.attention = False
+        while self.running:
+            if self.depth == 0 and self.w == None and not self.pausing:
+                # The top level word of this task has returned
+                if self.task == 0:
+                    return Machine.HALTED
+                self.tasks[self.task].active = False
+                self.tasks[self.task].stopped = True
+                self.pausing = True
+
+            if self.waiting:
+                self.waiting = False
+                return Machine.WAITING
+
+            if self.pausing:
+                self.pausing = False
+                # Round robin to the next active task, which may be this one again
+                n = len(self.tasks)
+                for i in range(1, n+1):
+                    index = (self.task + i) % n
+                    if self.tasks[index].active:
+                        break
+                if index != self.task:
+                    self.save_task()
+                    self.load_task(index)
+                continue
+
+            if self.ticks == 0:
+                return Machine.YIELDED
+            return None
+        return Machine.HALTED
+
+    def pause(self):
+        """Ask run() to switch to the next task after the current word"""
+        self.pausing = True
+        self.attention = True
+
+    def others_active(self):
+        """Is any task, other than the running one, ready to run?"""
+        for i in range(len(self.tasks)):
+            if i != self.task and self.tasks[i].active:
+                return True
+        return False
+
+    def save_task(self):
+        """Save the registers of the running task"""
+        task = self.tasks[self.task]
+        task.ip, task.w, task.depth, task.base = self.ip, self.w, self.depth, self.base
+        task.ds.ptr = self.ds.ptr
+        task.rs.ptr = self.rs.ptr
+        task.uv.ptr = self.uv.ptr
+
+    def save_registers(self):
+        """Capture the Python side state of the machine, but not its memory"""
+        self.save_task()
+        tasks = []
+        for t in self.tasks:
+            tasks.append((t.ds.start, t.ds.size, t.ds.ptr,
+                          t.rs.start, t.rs.size, t.rs.ptr,
+                          t.uv.start, t.uv.size, t.uv.ptr,
+                          t.active, t.stopped, t.ip, t.w, t.depth, t.base))
+        return {
+            "task":      self.task,
+            "tasks":     tasks,
+            "running":   self.running,
+            "limit":     self.limit,
+            "attention": self.attention,
+            "pausing":   self.pausing,
+            "tib":       self.tib.ptr,
+            "dict":      (self.dict.ptr, self.dict.last_ffa, self.dict.defining_ffa,
+                          dict(self.dict.cfa_cache), dict(self.dict.pfa0_cache)),
+            "arrays":    self.arrays and self.arrays.copy(),
+            "state":     (self.state, self.csp),
+            "number":    (self.dpl, self.hld),
+            "last_word": self.last_word,
+            "outcome":   (self.aborted, self.errors),
+        }
+
+    def load_registers(self, regs):
+        """Put back the Python side state captured by save_registers()"""
+        self.tasks = []
+        for t in regs["tasks"]:
+            task = Task(DataStack(self.mem, t[0], t[1]),
+                        ReturnStack(self.mem, t[3], t[4]),
+                        UserVars(self.mem, t[6], t[7]))
+            task.ds.ptr, task.rs.ptr, task.uv.ptr = t[2], t[5], t[8]
+            task.active, task.stopped, task.ip, task.w, task.depth, task.base = t[9:]
+            self.tasks.append(task)
+        self.load_task(regs["task"])
+
+        self.running   = regs["running"]
+        self.limit     = regs["limit"]
+        self.attention = regs["attention"]
+        self.pausing   = regs["pausing"]
+        self.tib.ptr   = regs["tib"]
+        ptr, last_ffa, defining_ffa, cfa_cache, pfa0_cache = regs["dict"]
+        self.dict.ptr, self.dict.last_ffa, self.dict.defining_ffa = ptr, last_ffa, defining_ffa
+        self.dict.index = None
+        self.dict.cfa_cache  = dict(cfa_cache)
+        self.dict.pfa0_cache = dict(pfa0_cache)
+        self.arrays = regs["arrays"] and regs["arrays"].copy()
+        self.state, self.csp = regs["state"]
+        self.dpl, self.hld = regs["number"]
+        self.last_word = regs["last_word"]
+        self.aborted, self.errors = regs["outcome"]
+
+    def checkpoint(self):
+        """Capture memory and registers, so they can be restored later"""
+        return Checkpoint(self.mem.snapshot(), self.save_registers())
+
+    def restore(self, cp):
+        """Put the machine back to a checkpoint"""
+        self.mem.restore(cp.pages)
+        self.load_registers(cp.regs)
+
+    def load_task(self, index):
+        """Re-point the machine registers at a saved task"""
+        task = self.tasks[index]
+        self.task = index
+        self.ip, self.w, self.depth, self.base = task.ip, task.w, task.depth, task.base
+        for live, saved in ((self.ds, task.ds), (self.rs, task.rs), (self.uv, task.uv)):
+            live.start = saved.start
+            live.size  = saved.size
+            live.ptr   = saved.ptr
+
+    def uservar(self, rel):
+        """Address of the user variable at rel in the running task's area"""
+        if rel >= self.uv.size:
+            Debug.fail("User variable offset:%d outside task area of:%d" % (rel, self.uv.size))
+        return self.uv.start + rel
+
+    def radix(self):
+        """BASE, if digits can be converted in it"""
+        if self.base < 2 or self.base > 36:
+            Debug.fail("BASE out of range:%d" % self.base)
+        return self.base
+
+    def picture(self, ud, negative=False):
+        """Convert ud in the HOLD buffer, as <# #S SIGN #> would, returns the text"""
+        base = self.radix()
+        text = ""
+        while True:
+            ud, d = divmod(ud, base)
+            text = DIGIT_CHARS[d] + text
+            if ud == 0:
+                break
+        if negative:
+            text = "-" + text
+        self.hld = self.holdend - len(text)
+        if self.hld < self.holdstart:
+            Debug.fail("HOLD buffer overflow")
+        self.mem.writebytes(self.hld, bytearray([ord(c) for c in text]))
+        return text
+
+    def writen(self, number, width=0):
+        """Write a cell sized number, as a signed quantity"""
+        number = self.Number.asSigned(number)
+        self.outs.writestr(self.picture(abs(number), number < 0).rjust(width))
+
+    def writeu(self, number, width=0):
+        """Write a cell sized number, as an unsigned quantity"""
+        number = self.Number.asUnsigned(number)
+        self.outs.writestr(self.picture(number).rjust(width))
+
+    def writed(self, double, width=0):
+        """Write a 2-cell sized number, as a signed quantity"""
+        double = self.Double.asSigned(double)
+        self.outs.writestr(self.picture(abs(double), double < 0).rjust(width))
+
+    def writeud(self, double, width=0):
+        """Write a 2-cell sized number, as an unsigned quantity"""
+        double = self.Double.asUnsigned(double)
+        self.outs.writestr(self.picture(double).rjust(width))
 
 
     # functions for memory mapped registers
 
     def rd_ip(self, offset):
-        if offset not in [0,1]:
-            raise ValueError("Out of range offset:0x%x" % offset)
-        bytes = Number.to_bytes(self.ip)
-        return bytes[offset]
+        return self.rd_cell(self.ip, offset)
 
     def wr_ip(self, offset, byte):
-        if offset not in [0,1]:
+        self.ip = self.wr_cell(self.ip, offset, byte)
+
+    def rd_cell(self, value, offset):
+        """Read one byte of a cell sized register"""
+        if offset < 0 or offset >= self.Number.SIZE:
             raise ValueError("Out of range offset:0x%x" % offset)
-        b0, b1 = Number.to_bytes(self.ip)
-        bytes = [b0, b1]
+        return self.Number.to_bytes(value)[offset]
+
+    def wr_cell(self, value, offset, byte):
+        """Write one byte of a cell sized register, returns its new value"""
+        if offset < 0 or offset >= self.Number.SIZE:
+            raise ValueError("Out of range offset:0x%x" % offset)
+        bytes = list(self.Number.to_bytes(value))
         bytes[offset] = byte
-        self.ip = Number.from_bytes(bytes)
+        return self.Number.from_bytes(bytes)
 
     def rd_base(self, offset):
-        return self.base
+        return self.rd_cell(self.base, offset)
+
+    def wr_base(self, offset, byte):
+        self.base = self.wr_cell(self.base, offset, byte)
+
+    def rd_dpl(self, offset):
+        return self.rd_cell(self.dpl, offset)
+
+    def wr_dpl(self, offset, byte):
+        self.dpl = self.Number.asSigned(self.wr_cell(self.dpl, offset, byte))
 
-    def wr_base(self, value):
-        self.base = value
+    def rd_state(self, offset):
+        return self.rd_cell(self.state, offset)
+
+    def wr_state(self, offset, byte):
+        self.state = self.wr_cell(self.state, offset, byte)
 
     def rd_dshash(self, offset):
         """Read the number of bytes on the data stack"""
-        if offset not in [0,1]:
-            raise ValueError("Out of range offset:0x%x" % offset)
-        u = self.ds.getused()
-        bytes = Number.to_bytes(u)
-        return bytes[offset]
+        return self.rd_cell(self.ds.getused(), offset)
 
     # temporary testing
     testvalue = 0
 
     def rd_test(self, offset):
-        if offset not in [0,1]:
-            raise ValueError("Out of range offset:0x%x" % offset)
-
         # Every read increments the counter
         prev = self.testvalue
+        byte = self.rd_cell(prev, offset)
         self.testvalue = (self.testvalue + 1) & 0xFF
-
-        bytes = Number.to_bytes(prev)
-        byte = bytes[offset]
         #Debug.trace("rd_test ofs 0x%x byte 0x%x" % (offset, byte))
         return byte
 
     def wr_test(self, offset, byte):
         #Debug.trace("wr_test ofs 0x%x byte 0x%x" % (offset, byte))
-        if offset not in [0,1]:
-            raise ValueError("Out of range offset:0x%x" % offset)
-        b0, b1 = Number.to_bytes(self.testvalue)
-        bytes = [b0, b1]
-        bytes[offset] = byte
-        self.testvalue = Number.from_bytes(bytes)
+        self.testvalue = self.wr_cell(self.testvalue, offset, byte)
 
     # functions for native code
 
@@ -1482,16 +3111,17 @@ class Machine():
         pass
 
     def n_abort(self):
-        """Empty RS and DS and finish"""
+        """Empty DS and finish, RS is emptied when the next word is started"""
         self.ds.reset()
-        self.rs.reset()
         self.running = False #TODO: should return to top level interpreter, not stop the whole machine
+        self.attention = True
+        self.aborted = True
 
     def n_docon(self):
-        """Reads the 16 bit constant pointed to by PFA and pushes onto DS"""
+        """Reads the cell sized constant pointed to by PFA and pushes onto DS"""
         #TODO: The PFA of the current word needs to be accessible implicitly somewhere
         #the parser would have read out the CFA of the word to execute,
-        #CFA+2 is the PFA for it, and that parameter is the constant value
+        #CFA+1 cell is the PFA for it, and that parameter is the constant value
         #which needs to be pushed onto the DS
         pass #TODO:
         Debug.unimplemented("n_docon")
@@ -1590,30 +3220,451 @@ class Machine():
         flags = 0 # TODO: ZNCV
         self.ds.pushn(r)
 
+    def divmod(self):
+        # ( n1 n2 -- ) signed and floored, as in FORTH-83
+        n2 = self.Number.asSigned(self.ds.popn())
+        n1 = self.Number.asSigned(self.ds.popn())
+        return Machine.divide(n1, n2, True)
+
     def n_div(self):
         """: n_DIV   ( n1 n2 -- n-quot)
         { n2=ds_pop; n2=ds_pop; r=n1/n2; flags=zncv; ds_push(c) } ;"""
-        n2 = self.ds.popn()
-        n1 = self.ds.popn()
-        r = n1 / n2
-        flags = 0 # TODO: ZNCV
-        self.ds.pushn(r)
+        q, r = self.divmod()
+        self.ds.pushn(q)
 
     def n_mod(self):
         """: n_MOD   ( n1 n2 -- n-rem)
         { n2=ds_pop; n1=ds_pop; r=n1 mod n2; flags=zncv; ds_push(r) } ;"""
-        n2 = self.ds.popn()
-        n1 = self.ds.popn()
-        r = n1 % n2
-        flags = 0 # TODO: ZNCV
+        q, r = self.divmod()
+        self.ds.pushn(r)
+
+    def n_divmod(self):
+        """: n_DIVMOD   ( n1 n2 -- n-rem n-quot)
+        { n2=ds_pop; n1=ds_pop; ds_push(n1 mod n2); ds_push(n1/n2) } ;"""
+        q, r = self.divmod()
         self.ds.pushn(r)
+        self.ds.pushn(q)
+
+    def n_dadd(self):
+        """: n_DADD   ( d1 d2 -- d3)
+        { d2=ds_popd; d1=ds_popd; ds_pushd(d1+d2) } ;"""
+        d2 = self.ds.popd()
+        d1 = self.ds.popd()
+        self.ds.pushd((d1 + d2) & self.Double.MASK)
+
+    def n_dsub(self):
+        """: n_DSUB   ( d1 d2 -- d3)
+        { d2=ds_popd; d1=ds_popd; ds_pushd(d1-d2) } ;"""
+        d2 = self.ds.popd()
+        d1 = self.ds.popd()
+        self.ds.pushd((d1 - d2) & self.Double.MASK)
+
+    def n_dnegate(self):
+        """: n_DNEGATE   ( d -- -d)
+        { ds_pushd(-ds_popd) } ;"""
+        self.ds.pushd((-self.ds.popd()) & self.Double.MASK)
+
+    def n_dlt(self):
+        """: n_DLT   ( d1 d2 -- ?)
+        { d2=ds_popd; d1=ds_popd; ds_pushn(d1<d2) } ;"""
+        d2 = self.Double.asSigned(self.ds.popd())
+        d1 = self.Double.asSigned(self.ds.popd())
+        if d1 < d2:
+            self.ds.pushn(self.TRUE)
+        else:
+            self.ds.pushn(Machine.FALSE)
+
+    def n_deq(self):
+        """: n_DEQ   ( d1 d2 -- ?)
+        { d2=ds_popd; d1=ds_popd; ds_pushn(d1==d2) } ;"""
+        if self.ds.popd() == self.ds.popd():
+            self.ds.pushn(self.TRUE)
+        else:
+            self.ds.pushn(Machine.FALSE)
+
+    def n_ummult(self):
+        """: n_UMMULT   ( u1 u2 -- ud)
+        { u2=ds_pop; u1=ds_pop; ds_pushd(u1*u2) } ;"""
+        u2 = self.ds.popn()
+        u1 = self.ds.popn()
+        self.ds.pushd(u1 * u2)
+
+    def n_mmult(self):
+        """: n_MMULT   ( n1 n2 -- d)
+        { n2=ds_pop; n1=ds_pop; ds_pushd(n1*n2) } ;"""
+        n2 = self.Number.asSigned(self.ds.popn())
+        n1 = self.Number.asSigned(self.ds.popn())
+        self.ds.pushd((n1 * n2) & self.Double.MASK)
+
+    @staticmethod
+    def divide(n, d, floored):
+        """Divide, rounding towards minus infinity if floored, or else towards zero"""
+        if d == 0:
+            Debug.fail("Division by zero")
+        q, r = divmod(n, d) # Python divmod is floored
+        if not floored and r != 0 and (n < 0) != (d < 0):
+            q += 1
+            r -= d
+        return q, r
+
+    def n_umdivmod(self):
+        """: n_UMDIVMOD   ( ud u -- rem quot)
+        { u=ds_pop; ud=ds_popd; ds_push(ud mod u); ds_push(ud/u) } ;"""
+        u  = self.ds.popn()
+        ud = self.ds.popd()
+        q, r = Machine.divide(ud, u, True)
+        if q > self.Number.MASK:
+            Debug.fail("Division overflow")
+        self.ds.pushn(r & self.Number.MASK)
+        self.ds.pushn(q)
+
+    def sdivmod(self, floored):
+        # ( d n -- rem quot)
+        n = self.Number.asSigned(self.ds.popn())
+        d = self.Double.asSigned(self.ds.popd())
+        q, r = Machine.divide(d, n, floored)
+        if q != self.Number.asSigned(q):
+            Debug.fail("Division overflow")
+        self.ds.pushn(r & self.Number.MASK)
+        self.ds.pushn(q & self.Number.MASK)
+
+    def n_smdivrem(self):
+        """: n_SMDIVREM   ( d n -- rem quot)
+        { symmetric division, quotient rounded towards zero } ;"""
+        self.sdivmod(False)
+
+    def n_fmdivmod(self):
+        """: n_FMDIVMOD   ( d n -- rem quot)
+        { floored division, quotient rounded towards minus infinity } ;"""
+        self.sdivmod(True)
+
+    def multdivmod(self):
+        # ( n1 n2 n3 -- rem quot) with a double length intermediate product
+        n3 = self.Number.asSigned(self.ds.popn())
+        n2 = self.Number.asSigned(self.ds.popn())
+        n1 = self.Number.asSigned(self.ds.popn())
+        return Machine.divide(n1 * n2, n3, True)
+
+    def n_multdiv(self):
+        """: n_MULTDIV   ( n1 n2 n3 -- n4)
+        { n4=(n1*n2)/n3 } ;"""
+        q, r = self.multdivmod()
+        self.ds.pushn(q & self.Number.MASK)
+
+    def n_multdivmod(self):
+        """: n_MULTDIVMOD   ( n1 n2 n3 -- rem quot)
+        { rem, quot = divmod(n1*n2, n3) } ;"""
+        q, r = self.multdivmod()
+        self.ds.pushn(r & self.Number.MASK)
+        self.ds.pushn(q & self.Number.MASK)
+
+    def n_store2(self):
+        """: n_STORE2   ( d a --)
+        { a=ds_pop; d=ds_popd; mem_writed(a, d) } ;"""
+        a = self.ds.popn()
+        self.mem.writed(a, self.ds.popd())
+
+    def n_fetch2(self):
+        """: n_FETCH2   ( a -- d)
+        { a=ds_pop; ds_pushd(mem_readd(a)) } ;"""
+        self.ds.pushd(self.mem.readd(self.ds.popn()))
+
+    def n_cmove(self):
+        """: n_CMOVE   ( a1 a2 u --)
+        { copy u bytes from a1 to a2, lowest address first } ;"""
+        u  = self.ds.popn()
+        a2 = self.ds.popn()
+        a1 = self.ds.popn()
+        self.mem.copy(a1, a2, u)
+
+    def n_cmoveup(self):
+        """: n_CMOVEUP   ( a1 a2 u --)
+        { copy u bytes from a1 to a2, highest address first } ;"""
+        u  = self.ds.popn()
+        a2 = self.ds.popn()
+        a1 = self.ds.popn()
+        self.mem.copy(a1, a2, u, backwards=True)
+
+    def n_move(self):
+        """: n_MOVE   ( a1 a2 u --)
+        { copy u bytes from a1 to a2, as if through a temporary buffer } ;"""
+        u  = self.ds.popn()
+        a2 = self.ds.popn()
+        a1 = self.ds.popn()
+        self.mem.copy(a1, a2, u, backwards=a2 > a1)
+
+    def n_fill(self):
+        """: n_FILL   ( a u c --)
+        { set u bytes from a to c } ;"""
+        c = self.ds.popn()
+        u = self.ds.popn()
+        a = self.ds.popn()
+        self.mem.fill(a, u, c)
+
+    def n_erase(self):
+        """: n_ERASE   ( a u --)
+        { set u bytes from a to 0 } ;"""
+        u = self.ds.popn()
+        a = self.ds.popn()
+        self.mem.fill(a, u, 0)
+
+    def n_blank(self):
+        """: n_BLANK   ( a u --)
+        { set u bytes from a to space } ;"""
+        u = self.ds.popn()
+        a = self.ds.popn()
+        self.mem.fill(a, u, 32)
+
+    def read_string(self):
+        # ( a u -- ) returns a, u and the bytes
+        u = self.ds.popn()
+        a = self.ds.popn()
+        return a, u, self.mem.readbytes(a, u)
+
+    def n_compare(self):
+        """: n_COMPARE   ( a1 u1 a2 u2 -- n)
+        { n = -1, 0 or 1 as string 1 is before, equal to or after string 2 } ;"""
+        a2, u2, s2 = self.read_string()
+        a1, u1, s1 = self.read_string()
+        if s1 < s2:
+            self.ds.pushn(self.TRUE) # -1
+        elif s1 > s2:
+            self.ds.pushn(1)
+        else:
+            self.ds.pushn(0)
+
+    def n_search(self):
+        """: n_SEARCH   ( a1 u1 a2 u2 -- a3 u3 ?)
+        { find string 2 in string 1, a3 u3 is the rest of string 1 from there } ;"""
+        a2, u2, needle = self.read_string()
+        u1 = self.ds.popn()
+        a1 = self.ds.popn()
+        index = self.mem.readbytes(a1, u1).find(needle)
+        if index < 0:
+            self.ds.pushn(a1)
+            self.ds.pushn(u1)
+            self.ds.pushn(Machine.FALSE)
+        else:
+            self.ds.pushn(a1 + index)
+            self.ds.pushn(u1 - index)
+            self.ds.pushn(self.TRUE)
+
+    def n_trailing(self):
+        """: n_TRAILING   ( a u1 -- a u2)
+        { u2 = u1 without the trailing spaces } ;"""
+        a, u, text = self.read_string()
+        self.ds.pushn(a)
+        self.ds.pushn(len(text.rstrip(b" ")))
+
+    def n_slashstring(self):
+        """: n_SLASHSTRING   ( a u n -- a+n u-n)
+        { skip n characters of a string } ;"""
+        n = self.Number.asSigned(self.ds.popn())
+        u = self.ds.popn()
+        a = self.ds.popn()
+        self.ds.pushn((a + n) & self.Number.MASK)
+        self.ds.pushn((u - n) & self.Number.MASK)
+
+    def n_squote(self):
+        """: n_SQUOTE   ( -- a u)
+        { parse up to the next " in TIB, a u are left pointing into TIB, or compiled } ;"""
+        inp  = self.var(">IN")
+        ptr  = self.mem.readn(inp)
+        end  = self.tibstart + self.mem.readn(self.var("SPAN"))
+        text = self.mem.readbytes(ptr, end-ptr)
+        u = text.find(b'"')
+        if u < 0:
+            u = len(text)
+            self.mem.writen(inp, end)
+        else:
+            self.mem.writen(inp, ptr+u+1) # skip the closing quote
+        if self.state != 0:
+            # compiled like Forth.SQUOTE, so the string is in the definition
+            self.dict.comma(self.find_cfa(" DOSQ"))
+            self.dict.comma_bytes(Forth.pack("".join([chr(c) for c in text[:u]])))
+            return
+        self.ds.pushn(ptr)
+        self.ds.pushn(u)
+
+    def array(self, write=False):
+        # ( h -- ) the array with handle h
+        if self.arrays == None:
+            self.arrays = ArrayStore()
+        return self.arrays.get(self.ds.popn(), write)
+
+    def element(self, a):
+        # ( n -- ) n as an element of a, an integer wraps to fit like C! keeps the low byte
+        n = self.Number.asSigned(self.ds.popn())
+        if a.dtype.kind == "f":
+            return float(n)
+        bits = a.dtype.itemsize * 8
+        n &= (1 << bits) - 1
+        if n >= 1 << (bits-1):
+            n -= 1 << bits
+        return n
+
+    def n_array(self):
+        """: n_ARRAY   ( u type -- h)
+        { make an array of u zeroed elements, h is its handle.
+          u is one unsigned cell like an index, so at most 65535 with 16 bit cells } ;"""
+        type  = self.ds.popn()
+        count = self.ds.popn()
+        if self.arrays == None:
+            self.arrays = ArrayStore()
+        self.ds.pushn(self.arrays.create(count, type))
+
+    def n_arrayfetch(self):
+        """: n_ARRAYFETCH   ( i h -- n)
+        { n = h[i], truncated to a cell } ;"""
+        a = self.array()
+        i = self.ds.popn()
+        if i >= len(a):
+            Debug.fail("Array index out of range:%d" % i)
+        self.ds.pushn(int(a[i]) & self.Number.MASK)
+
+    def n_arraystore(self):
+        """: n_ARRAYSTORE   ( n i h --)
+        { h[i] = n } ;"""
+        a = self.array(write=True)
+        i = self.ds.popn()
+        if i >= len(a):
+            Debug.fail("Array index out of range:%d" % i)
+        a[i] = self.element(a)
+
+    def n_arraylen(self):
+        """: n_ARRAYLEN   ( h -- n)
+        { n = number of elements in h } ;"""
+        self.ds.pushn(len(self.array()))
+
+    def n_arrayfree(self):
+        """: n_ARRAYFREE   ( h --)
+        { forget the array h } ;"""
+        h = self.ds.popn()
+        if self.arrays == None:
+            Debug.fail("Not an array:%d" % h)
+        self.arrays.free(h)
+
+    def n_arrayfill(self):
+        """: n_ARRAYFILL   ( n h --)
+        { set every element of h to n } ;"""
+        a = self.array(write=True)
+        a.fill(self.element(a))
+
+    def n_arraymapadd(self):
+        """: n_ARRAYMAPADD   ( n h --)
+        { add n to every element of h } ;"""
+        a = self.array(write=True)
+        a += a.dtype.type(self.element(a))
+
+    def n_arraysum(self):
+        """: n_ARRAYSUM   ( h -- d)
+        { d = sum of the elements of h } ;"""
+        a = self.array()
+        if a.dtype.kind == "f":
+            total = int(a.sum())
+        else:
+            total = int(a.sum(dtype="int64"))
+        self.ds.pushd(total & self.Double.MASK)
+
+    def n_arraydot(self):
+        """: n_ARRAYDOT   ( h1 h2 -- d)
+        { d = sum of h1[i]*h2[i] } ;"""
+        a2 = self.array()
+        a1 = self.array()
+        if len(a1) != len(a2):
+            Debug.fail("Arrays are different lengths")
+        if a1.dtype.kind == "f" or a2.dtype.kind == "f":
+            total = int(self.arrays.numpy.dot(a1, a2))
+        else:
+            total = int(self.arrays.numpy.dot(a1.astype("int64"), a2.astype("int64")))
+        self.ds.pushd(total & self.Double.MASK)
+
+    def n_arraysort(self):
+        """: n_ARRAYSORT   ( h --)
+        { sort h in place, smallest first } ;"""
+        self.array(write=True).sort()
+
+    def flag(self, f):
+        # ( -- ?) push a Forth flag for a Python truth value
+        if f:
+            self.ds.pushn(self.TRUE)
+        else:
+            self.ds.pushn(Machine.FALSE)
+
+    def n_eq(self):
+        """: n_EQ   ( n1 n2 -- ?)
+        { n2=popn; n1=popn; pushn(n1==n2) } ;"""
+        self.flag(self.ds.popn() == self.ds.popn())
+
+    def n_ne(self):
+        """: n_NE   ( n1 n2 -- ?)
+        { n2=popn; n1=popn; pushn(n1!=n2) } ;"""
+        self.flag(self.ds.popn() != self.ds.popn())
+
+    def n_lt(self):
+        """: n_LT   ( n1 n2 -- ?)
+        { n2=popn; n1=popn; pushn(n1<n2), signed } ;"""
+        n2 = self.Number.asSigned(self.ds.popn())
+        n1 = self.Number.asSigned(self.ds.popn())
+        self.flag(n1 < n2)
+
+    def n_gt(self):
+        """: n_GT   ( n1 n2 -- ?)
+        { n2=popn; n1=popn; pushn(n1>n2), signed } ;"""
+        n2 = self.Number.asSigned(self.ds.popn())
+        n1 = self.Number.asSigned(self.ds.popn())
+        self.flag(n1 > n2)
+
+    def n_inc(self):
+        """: n_INC   ( n -- n+1)
+        { pushn(popn+1) } ;"""
+        self.ds.pushn(self.ds.popn() + 1)
+
+    def n_dec(self):
+        """: n_DEC   ( n -- n-1)
+        { pushn(popn-1) } ;"""
+        self.ds.pushn(self.ds.popn() - 1)
+
+    def n_mult2(self):
+        """: n_MULT2   ( n -- n*2)
+        { pushn(popn<<1) } ;"""
+        self.ds.pushn(self.ds.popn() << 1)
+
+    def n_div2(self):
+        """: n_DIV2   ( n -- n/2)
+        { pushn(popn>>1), keeping the sign } ;"""
+        self.ds.pushn(self.Number.asSigned(self.ds.popn()) >> 1)
+
+    def n_negate(self):
+        """: n_NEGATE   ( n -- -n)
+        { pushn(-popn) } ;"""
+        self.ds.pushn(-self.ds.popn())
+
+    def n_abs(self):
+        """: n_ABS   ( n -- |n|)
+        { pushn(abs(popn)), signed } ;"""
+        self.ds.pushn(abs(self.Number.asSigned(self.ds.popn())))
+
+    def n_min(self):
+        """: n_MIN   ( n1 n2 -- min)
+        { n2=popn; n1=popn; pushn(min(n1,n2)), signed } ;"""
+        n2 = self.Number.asSigned(self.ds.popn())
+        n1 = self.Number.asSigned(self.ds.popn())
+        self.ds.pushn(min(n1, n2))
+
+    def n_max(self):
+        """: n_MAX   ( n1 n2 -- max)
+        { n2=popn; n1=popn; pushn(max(n1,n2)), signed } ;"""
+        n2 = self.Number.asSigned(self.ds.popn())
+        n1 = self.Number.asSigned(self.ds.popn())
+        self.ds.pushn(max(n1, n2))
 
     def n_0eq(self):
         """: 0=   ( n -- ?)
         { n=popn; if n==0: pushn(FORTH_TRUE) else: pushn(FORTH_FALSE) } ;"""
         n = self.ds.popn()
         if n==0:
-            self.ds.pushn(Machine.TRUE)
+            self.ds.pushn(self.TRUE)
         else:
             self.ds.pushn(Machine.FALSE)
 
@@ -1622,33 +3673,23 @@ class Machine():
         { f=popn; if n==FORTH_FALSE: pushn(FORTH_TRUE) else: pushn(FORTH_FALSE) } ;"""
         f=self.ds.popn()
         if f==Machine.FALSE:
-            self.ds.pushn(Machine.TRUE)
+            self.ds.pushn(self.TRUE)
         else:
             self.ds.pushn(Machine.FALSE)
 
     def n_0lt(self):
         """: 0<   ( n -- ?)
-        { n=popn; if n<0: pushn(FORTH_TRUE) else: pushn(FORTH_FALSE) } ;"""
-        n = self.ds.popn()
-        #TODO: Needs a SIGNED COMPARISON
-        if n<0:
-            self.ds.pushn(Machine.TRUE)
-        else:
-            self.ds.pushn(Machine.FALSE)
+        { n=popn; pushn(n<0), signed } ;"""
+        self.flag(self.Number.asSigned(self.ds.popn()) < 0)
 
     def n_0gt(self):
         """: 0>   ( n -- ?)
-        { n=popn; if n>0: pushn(FORTH_TRUE) else: pushn(FORTH_FALSE) } ;"""
-        #TODO: Needs a SIGNED COMPARISON
-        n = self.ds.popn()
-        if n>0:
-            self.ds.pushn(Machine.TRUE)
-        else:
-            self.ds.pushn(Machine.FALSE)
+        { n=popn; pushn(n>0), signed } ;"""
+        self.flag(self.Number.asSigned(self.ds.popn()) > 0)
 
     def n_ult(self):
         """: U<   ( u1 u2 -- ?)
-        { u2=popn; u1=popn; u2&=0xFFFF; u1&=0xFFFF; if u1<u2: pushn(FORTH_TRUE) else: pushn(FORTH_FALSE) } ;"""
+        { u2=popn; u1=popn; u2&=MASK; u1&=MASK; if u1<u2: pushn(FORTH_TRUE) else: pushn(FORTH_FALSE) } ;"""
         Debug.fail("Not implemented")
         #TODO: Needs an UNSIGNED COMPARISON
 
@@ -1661,12 +3702,26 @@ class Machine():
     def n_keyq(self):
         """: n_KEYQ   ( -- ?)
         # { ds_pushn(kbhit) } ;"""
-        n = self.ins.waiting()
-        self.ds.pushn(n)
+        if self.ins.waiting() > 0:
+            self.ds.pushn(self.TRUE)
+        else:
+            self.ds.pushn(Machine.FALSE)
 
     def n_key(self):
         """: n_KEY   ( -- c)
         { ds_pushn(getch) } ;"""
+        if (len(self.tasks) > 1 or not self.blocking) and self.ins.waiting() == 0:
+            if self.others_active():
+                # let the other tasks run, and try this KEY again when resumed
+                self.w = self.ip - self.Number.SIZE
+                self.pause()
+                return
+            if not self.blocking:
+                # let run() return, and try this KEY again when it is resumed
+                self.w = self.ip - self.Number.SIZE
+                self.waiting = True
+                self.attention = True
+                return
         ch = self.ins.getch()
         b = ord(ch)
         self.ds.pushn(b)
@@ -1705,6 +3760,77 @@ class Machine():
         self.writeud(ud)
         self.outs.writech(' ')
 
+    def n_dotr(self):
+        """: n_DOTR ( n w --)
+        { print n right justified in w columns } ;"""
+        w = self.popwidth()
+        self.writen(self.ds.popn(), w)
+
+    def n_udotr(self):
+        """: n_UDOTR ( u w --)
+        { print u right justified in w columns } ;"""
+        w = self.popwidth()
+        self.writeu(self.ds.popn(), w)
+
+    def n_ddotr(self):
+        """: n_DDOTR ( d w --)
+        { print d right justified in w columns } ;"""
+        w = self.popwidth()
+        self.writed(self.ds.popd(), w)
+
+    def popwidth(self):
+        """Pop a field width, as a signed number, no padding if it is not positive"""
+        return max(0, self.Number.asSigned(self.ds.popn()))
+
+    def hold(self, ch):
+        """Add a character to the front of the pictured number"""
+        if self.hld <= self.holdstart:
+            Debug.fail("HOLD buffer overflow")
+        self.hld -= 1
+        self.mem.writeb(self.hld, ord(ch))
+
+    def n_lessnum(self):
+        """: n_LESSNUM ( --)
+        { hld=holdend } ;"""
+        self.hld = self.holdend
+
+    def n_num(self):
+        """: n_NUM ( ud1 -- ud2)
+        { ud2,r=divmod(ud1,base); hold(digit(r)) } ;"""
+        ud, d = divmod(self.ds.popd(), self.radix())
+        self.hold(DIGIT_CHARS[d])
+        self.ds.pushd(ud)
+
+    def n_nums(self):
+        """: n_NUMS ( ud -- 0 0)
+        { # until ud is 0 } ;"""
+        ud = self.ds.popd()
+        base = self.radix()
+        while True:
+            ud, d = divmod(ud, base)
+            self.hold(DIGIT_CHARS[d])
+            if ud == 0:
+                break
+        self.ds.pushd(0)
+
+    def n_hold(self):
+        """: n_HOLD ( c --)
+        { hold(c) } ;"""
+        self.hold(chr(self.ds.popn() & 0xFF))
+
+    def n_sign(self):
+        """: n_SIGN ( n --)
+        { if n<0: hold('-') } ;"""
+        if self.Number.asSigned(self.ds.popn()) < 0:
+            self.hold('-')
+
+    def n_numgreater(self):
+        """: n_NUMGREATER ( ud -- a u)
+        { drop ud; push hld, holdend-hld } ;"""
+        self.ds.popd()
+        self.ds.pushn(self.hld)
+        self.ds.pushn(self.holdend - self.hld)
+
     def n_rdpfa(self):
         """: n_RDPFA   ( -- n)
         { pfa=ip; r=mem[pfa]; ds_push(r) } ;"""
@@ -1718,41 +3844,263 @@ class Machine():
         { pfa=ds_pop; rel=mem[pfa]; a=uservars+rel; ds_push(a) } ;"""
         pfa = self.ds.popn()
         rel = self.mem.readn(pfa)
-        uservars = 0 # TODO: per-task offset to uservars
+        uservars = self.uv.start # this task's user variables
         a = uservars + rel
         self.ds.pushn(a)
 
+    def n_rdpfarel(self):
+        """: n_RDPFAREL   ( -- a)
+        { pfa=ip; rel=mem[pfa]; a=uservars+rel; ds_push(a) } ;"""
+        self.ds.pushn(self.uservar(self.mem.readn(self.ip)))
+
+    def n_pause(self):
+        """: n_PAUSE   ( -- )
+        { switch to the next active task } ;"""
+        self.pause()
+
+    def n_task(self):
+        """: n_TASK   ( -- t)
+        { t=stopped or new task with its own stacks and user variables; ds_push(t) } ;"""
+        # A task that has stopped gives its slot back
+        for t in range(1, len(self.tasks)):
+            if self.tasks[t].stopped and not self.tasks[t].active:
+                self.tasks[t].stopped = False
+                self.ds.pushn(t)
+                return
+
+        slotsize = Machine.TASK_DS_SIZE + Machine.TASK_RS_SIZE + Machine.TASK_UV_SIZE
+        start = self.taskstart + (len(self.tasks)-1) * slotsize
+        if start + slotsize > self.taskstart + self.tasksize:
+            Debug.fail("No room for another task")
+
+        ds = DataStack(self.mem, start, Machine.TASK_DS_SIZE)
+        start += Machine.TASK_DS_SIZE
+        rs = ReturnStack(self.mem, start, Machine.TASK_RS_SIZE)
+        start += Machine.TASK_RS_SIZE
+        uv = UserVars(self.mem, start, Machine.TASK_UV_SIZE)
+        self.tasks.append(Task(ds, rs, uv))
+        self.ds.pushn(len(self.tasks)-1)
+
+    def n_activate(self):
+        """: n_ACTIVATE   ( cfa t -- )
+        { t=ds_pop; cfa=ds_pop; start task t running cfa } ;"""
+        t   = self.ds.popn()
+        cfa = self.ds.popn()
+        if t == 0 or t == self.task or t >= len(self.tasks):
+            Debug.fail("Cannot activate task:%d" % t)
+
+        # A new task starts with empty stacks, and a copy of the operator's user variables
+        self.save_task()
+        operator = self.tasks[0]
+        task = self.tasks[t]
+        task.ds.reset()
+        task.rs.reset()
+        task.uv.reset()
+        used = operator.uv.getused()
+        if used > task.uv.size:
+            Debug.fail("Task user variable area too small, need:%d" % used)
+        for i in range(used):
+            self.mem.writeb(task.uv.start+i, self.mem.readb(operator.uv.start+i))
+        task.uv.fwd(used)
+
+        task.ip, task.w, task.depth, task.base = 0, cfa, 0, self.base
+        task.active  = True
+        task.stopped = False
+
+    def n_stop(self):
+        """: n_STOP   ( -- )
+        { deactivate this task, switch to the next active task } ;"""
+        if self.task != 0: # the operator task never stops, it just pauses
+            self.tasks[self.task].active  = False
+            self.tasks[self.task].stopped = True
+        self.pause()
+
     def n_branch(self):
         """: n_BRANCH   ( -- )
-        { rel=memn[ip]; ip+=2; abs=ip-rel; ip=abs } ;"""
+        { rel=memn[ip]; abs=ip+rel*cell; ip=abs } ;"""
         #print("BRANCH")
         ip = self.rs.popn() # points to REL
         #print("  ip on entry:0x%x" % ip)
-        rel = 2 * self.mem.readn(ip) # each cell is two bytes
+        rel = self.Number.SIZE * self.Number.asSigned(self.mem.readn(ip)) # rel is in cells
         #print("  rel:0x%x" % rel)
-        abs = (ip + rel) & 0xFFFF # 2's complement
+        abs = ip + rel
         #print("  to:0x%x" % abs)
+        if abs < ip:
+            self.tick() # loops are charged to the budget on the way back
         self.rs.pushn(abs)
 
     def n_0branch(self):
         """: n_0BRANCH   ( ? -- )
-        { f=ds_pop; r=mem[ip]; if f==0:ip=ip+(2*r) else: ip+=2 } ;"""
+        { f=ds_pop; r=mem[ip]; if f==0:ip=ip+(r*cell) else: ip+=cell } ;"""
         #print("0BRANCH")
-        f = self.ds.popn()
+        self.zero_branch(self.ds.popn())
+
+    def zero_branch(self, f):
+        # ( -- ) take the inline branch if f is false, skip over it if not
         #print("  flag:0x%x" % f)
         ip = self.rs.popn() # points to REL
         #print("  ip on entry:0x%x" % ip)
-        rel = 2 * self.mem.readn(ip) # each cell is two bytes
-        #print("  rel:%d dec" % rel)
 
-        if f == 0:
-            abs = (ip + rel) & 0xFFFF # 2's complement
+        if not f:
+            rel = self.Number.SIZE * self.Number.asSigned(self.mem.readn(ip)) # rel is in cells
+            #print("  rel:%d dec" % rel)
+            abs = ip + rel
+            if abs < ip:
+                self.tick()
         else:
-            abs = ip+2
+            abs = ip+self.Number.SIZE
 
         #print("  to:0x%x" % abs)
         self.rs.pushn(abs)
 
+    # A comparison then 0BRANCH, fused into one word by the compiler
+
+    def n_eq0branch(self):
+        """: n_EQ0BRANCH   ( n1 n2 -- )
+        { n2=ds_pop; n1=ds_pop; branch unless n1==n2 } ;"""
+        self.zero_branch(self.ds.popn() == self.ds.popn())
+
+    def n_ne0branch(self):
+        """: n_NE0BRANCH   ( n1 n2 -- )
+        { n2=ds_pop; n1=ds_pop; branch unless n1!=n2 } ;"""
+        self.zero_branch(self.ds.popn() != self.ds.popn())
+
+    def n_lt0branch(self):
+        """: n_LT0BRANCH   ( n1 n2 -- )
+        { n2=ds_pop; n1=ds_pop; branch unless n1<n2, signed } ;"""
+        n2 = self.Number.asSigned(self.ds.popn())
+        n1 = self.Number.asSigned(self.ds.popn())
+        self.zero_branch(n1 < n2)
+
+    def n_gt0branch(self):
+        """: n_GT0BRANCH   ( n1 n2 -- )
+        { n2=ds_pop; n1=ds_pop; branch unless n1>n2, signed } ;"""
+        n2 = self.Number.asSigned(self.ds.popn())
+        n1 = self.Number.asSigned(self.ds.popn())
+        self.zero_branch(n1 > n2)
+
+    def n_0eq0branch(self):
+        """: n_0EQ0BRANCH   ( n -- )
+        { n=ds_pop; branch unless n==0 } ;"""
+        self.zero_branch(self.ds.popn() == 0)
+
+    # Counted loops keep a frame of three cells on RS, under the return address
+    # that NEXT pushes: the address to LEAVE to, the limit, and the index on top.
+
+    def loop_enter(self, skip):
+        # ( limit index -- ) the inline cell is the offset to after the LOOP
+        ip = self.rs.popn() # points to REL
+        index = self.ds.popn()
+        limit = self.ds.popn()
+        leave = ip + self.Number.SIZE * self.Number.asSigned(self.mem.readn(ip))
+        if skip and index == limit:
+            self.rs.pushn(leave)
+            return
+        self.rs.pushn(leave)
+        self.rs.pushn(limit)
+        self.rs.pushn(index)
+        self.rs.pushn(ip + self.Number.SIZE)
+
+    def n_do(self):
+        """: n_DO   ( limit index -- )
+        { rs_push(leave); rs_push(limit); rs_push(index) } ;"""
+        self.loop_enter(False)
+
+    def n_qdo(self):
+        """: n_QDO   ( limit index -- )
+        { if index==limit: ip=leave else: DO } ;"""
+        self.loop_enter(True)
+
+    def loop_next(self, step):
+        # add step to the index, and go round again unless it crossed limit-1|limit
+        ip = self.rs.popn() # points to REL
+        index = self.rs.getn(0)
+        limit = self.rs.getn(1)
+        left = ((index - limit) & self.Number.MASK) + step
+        if left < 0 or left > self.Number.MASK:
+            self.rs.popn()
+            self.rs.popn()
+            self.rs.popn()
+            self.rs.pushn(ip + self.Number.SIZE)
+        else:
+            self.rs.setn(0, index + step)
+            self.tick() # loops are charged to the budget on the way back
+            self.rs.pushn(ip + self.Number.SIZE * self.Number.asSigned(self.mem.readn(ip)))
+
+    def n_loop(self):
+        """: n_LOOP   ( -- )
+        { index+=1; if crossed limit: drop frame; ip+=cell else: ip+=rel*cell } ;"""
+        self.loop_next(1)
+
+    def n_plusloop(self):
+        """: n_PLUSLOOP   ( n -- )
+        { index+=n; if crossed limit: drop frame; ip+=cell else: ip+=rel*cell } ;"""
+        self.loop_next(self.Number.asSigned(self.ds.popn()))
+
+    def n_i(self):
+        """: n_I   ( -- n)
+        { ds_push(index of the innermost loop) } ;"""
+        self.ds.pushn(self.rs.getn(1))
+
+    def n_j(self):
+        """: n_J   ( -- n)
+        { ds_push(index of the next outer loop) } ;"""
+        self.ds.pushn(self.rs.getn(4))
+
+    def n_leave(self):
+        """: n_LEAVE   ( -- )
+        { drop frame; ip=leave } ;"""
+        self.rs.popn() # return address
+        self.rs.popn() # index
+        self.rs.popn() # limit
+        # which leaves the address to leave to, for NEXT to return to
+
+    def n_unloop(self):
+        """: n_UNLOOP   ( -- )
+        { drop frame, so that EXIT can be used inside a loop } ;"""
+        ip = self.rs.popn()
+        self.rs.popn()
+        self.rs.popn()
+        self.rs.popn()
+        self.rs.pushn(ip)
+
+    # The return stack words work under the return address that NEXT pushes
+
+    def n_tor(self):
+        """: n_TOR   ( n -- )
+        { rs_push(ds_pop) } ;"""
+        ip = self.rs.popn()
+        self.rs.pushn(self.ds.popn())
+        self.rs.pushn(ip)
+
+    def n_rfrom(self):
+        """: n_RFROM   ( -- n)
+        { ds_push(rs_pop) } ;"""
+        ip = self.rs.popn()
+        self.ds.pushn(self.rs.popn())
+        self.rs.pushn(ip)
+
+    def n_rfetch(self):
+        """: n_RFETCH   ( -- n)
+        { ds_push(rs_top) } ;"""
+        self.ds.pushn(self.rs.getn(1))
+
+    def n_rpfetch(self):
+        """: n_RPFETCH   ( -- a)
+        { ds_push(rp) } ;"""
+        ip = self.rs.popn()
+        self.ds.pushn(self.rs.ptr)
+        self.rs.pushn(ip)
+
+    def n_rpstore(self):
+        """: n_RPSTORE   ( a -- )
+        { rp=ds_pop } ;"""
+        ip = self.rs.popn()
+        ptr = self.ds.popn()
+        self.rs.assertPtrValid(ptr)
+        self.rs.ptr = ptr
+        self.rs.pushn(ip)
+
     def n_rblk(self):
         """: n_RBLK  ( n a -- )
         { a=ds_pop; n=ds_pop; b=disk_rd(1024*b, mem, a, 1024) } ;"""
@@ -1763,8 +4111,8 @@ class Machine():
         if len(bytes) != Disk.BLOCK_SIZE:
             Debug.fail("Malformed disk response buffer")
 
-        for b in bytes:
-            self.mem.writeb(addr, ord(b))
+        for b in bytearray(bytes):
+            self.mem.writeb(addr, b)
             addr += 1
 
     def n_wblk(self):
@@ -1773,12 +4121,12 @@ class Machine():
         addr = self.ds.popn()
         blocknum = self.ds.popn()
 
-        bytes = ""
+        buf = bytearray()
         for i in range(Disk.BLOCK_SIZE):
-            bytes += chr(self.mem.readb(addr))
+            buf.append(self.mem.readb(addr))
             addr += 1
 
-        self.disk.write(blocknum, bytes)
+        self.disk.write(blocknum, bytes(buf))
 
     #---- INTERFACE FOR HIGH-LEVEL FORTH WORDS -----
 
@@ -1811,133 +4159,421 @@ class Machine():
         #self.dict.dump()
         self.ds.pushn(cfa)
 
+    def convert(self, text, ud):
+        """Accumulate the digits at the start of text into ud, using BASE.
+           Returns the new ud, and how many characters were digits."""
+        base = self.base
+        used = 0
+        for c in text:
+            d = DIGITS[c]
+            if d >= base:
+                break
+            ud = ud * base + d
+            used += 1
+        return ud & self.Double.MASK, used
+
+    def parse_number(self, text):
+        """Parse all of text as a number in BASE, sets DPL.
+           Returns (value, is_double), or None if it is not a number."""
+        base = self.base
+        if base < 2 or base > 36:
+            return None
+        start = 0
+        if len(text) > 0 and text[0] == ord('-'):
+            start = 1
+        value = 0
+        digits = 0
+        dpl = -1
+        for c in text[start:]:
+            d = DIGITS[c]
+            if d < base:
+                value = value * base + d
+                digits += 1
+                if dpl >= 0:
+                    dpl += 1
+            elif c in PUNCTUATION:
+                dpl = 0
+            else:
+                return None
+        if digits == 0:
+            return None
+        self.dpl = dpl
+        if start == 1:
+            value = -value
+        return value, dpl >= 0
+
+    def read_number(self):
+        """Pop the address of a counted string, and parse it"""
+        addr = self.ds.popn()
+        count = self.mem.readb(addr)
+        return self.parse_number(self.mem.readbytes(addr+1, count))
+
     def n_number(self):
         """Parse a number using the current BASE"""
         # ( a -- n) or ( a -- d) or ( a -- ) if parse error
         # a is address of a counted string
-
+        number = self.read_number()
+        if number == None:
+            Debug.trace("Parse error in NUMBER")
+            return # nothing pushed onto stack
+        value, double = number
+        if double:
+            self.ds.pushd(value & self.Double.MASK)
+        else:
+            self.ds.pushn(value & self.Number.MASK)
+
+    def n_numberq(self):
+        """: n_NUMBERQ ( a -- 0 | n 1 | d 2)
+        { parse counted string at a, push flag for what was found } ;"""
+        number = self.read_number()
+        if number == None:
+            self.ds.pushn(0)
+            return
+        value, double = number
+        if double:
+            self.ds.pushd(value & self.Double.MASK)
+            self.ds.pushn(2)
+        else:
+            self.ds.pushn(value & self.Number.MASK)
+            self.ds.pushn(1)
+
+    def n_tonumber(self):
+        """: n_TONUMBER ( ud1 a1 u1 -- ud2 a2 u2)
+        { convert digits until u1 used up or a non digit } ;"""
+        count = self.ds.popn()
+        addr  = self.ds.popn()
+        ud    = self.ds.popd()
+        ud, used = self.convert(self.mem.readbytes(addr, count), ud)
+        self.ds.pushd(ud)
+        self.ds.pushn(addr + used)
+        self.ds.pushn(count - used)
+
+    def n_convert(self):
+        """: n_CONVERT ( ud1 a1 -- ud2 a2)
+        { convert digits from a1+1, a2 is the first non digit } ;"""
+        addr = self.ds.popn() + 1
+        ud   = self.ds.popd()
+        # there is no count, so find the end of the digits first
+        end  = addr
+        while DIGITS[self.mem.readb(end)] < self.base:
+            end += 1
+        ud, used = self.convert(self.mem.readbytes(addr, end-addr), ud)
+        self.ds.pushd(ud)
+        self.ds.pushn(end)
+
+    #----- COMPILER
+    # Definitions are compiled straight into the dictionary. Control structures
+    # keep the address of the cell they have to patch on DS, until it is known.
+
+    # What is on DS, on top of that address, to say which structure left it
+    CS_DO, CS_BEGIN, CS_IF, CS_WHILE, CS_CASE, CS_OF, CS_ENDOF = range(1, 8)
+    CS_NAMES = {CS_DO:"DO", CS_BEGIN:"BEGIN", CS_IF:"IF", CS_WHILE:"WHILE",
+                CS_CASE:"CASE", CS_OF:"OF", CS_ENDOF:"ENDOF"}
+
+    def parse_name(self):
+        """Parse the next space delimited name from TIB, "" if there is none"""
+        inp  = self.var(">IN")
+        ptr  = self.mem.readn(inp)
+        end  = self.tibstart + self.mem.readn(self.var("SPAN"))
+        text = self.mem.readbytes(ptr, end-ptr)
+        start = 0
+        while start < len(text) and text[start] == 32:
+            start += 1
+        stop = start
+        while stop < len(text) and text[stop] != 32:
+            stop += 1
+        self.mem.writen(inp, ptr + min(stop+1, len(text))) # skip the space after it
+        return "".join([chr(c) for c in text[start:stop]])
+
+    def unknown(self, name):
+        """A word that is not defined, and not a number. Give up on the rest of the line."""
+        self.outs.writestr("%s ?\n" % name)
+        self.errors += 1
+        self.ds.reset()
+        self.state = 0
+        self.dict.abandon()
+        self.mem.writen(self.var(">IN"), self.tibstart + self.mem.readn(self.var("SPAN")))
+
+    def compile_error(self, msg):
+        """Stop compiling, forget the definition, and fail"""
+        self.state = 0
+        self.dict.abandon()
+        Debug.fail(msg)
+
+    def compile_word(self, cfa):
+        """Compile a call to the word at cfa"""
+        self.last_word = self.dict.comma(cfa)
+
+    def literal(self, number):
+        """Compile a number, it is pushed when the definition runs"""
+        self.compile_word(self.find_cfa(" DOLIT"))
+        self.dict.comma(number)
+
+    def control_push(self, addr, kind):
+        # ( -- addr kind)
+        self.ds.pushn(addr)
+        self.ds.pushn(kind)
+
+    def control_pop(self, kind, word):
+        # ( addr kind -- ) returns addr, if kind is the one word needs
+        if self.ds.getused() - self.csp < 2*self.Number.SIZE or self.ds.popn() != kind:
+            self.compile_error("%s without %s" % (word, Machine.CS_NAMES[kind]))
+        return self.ds.popn()
+
+    def resolve(self, orig):
+        """Patch the offset at orig, to branch to here"""
+        self.mem.writen(orig, (self.dict.here() - orig) // self.Number.SIZE)
+        self.last_word = None # here is a branch target now, so nothing before it is fused
+
+    def branch(self, name, dest=None):
+        """Compile a branch to dest, or one to resolve() later. Returns its offset address."""
+        if name == "0BRANCH" and self.last_word == self.dict.here() - self.Number.SIZE \
+                and self.mem.readn(self.last_word) in self.fused:
+            # comparison then 0BRANCH, rewrite it as the fused word
+            self.mem.writen(self.last_word, self.fused[self.mem.readn(self.last_word)])
+        else:
+            self.compile_word(self.find_cfa(name))
+        orig = self.dict.comma(0)
+        if dest != None:
+            self.mem.writen(orig, (dest - orig) // self.Number.SIZE)
+        self.last_word = None
+        return orig
+
+    def n_interpret(self):
+        """: n_INTERPRET   ( a -- )
+        { find counted string a; execute it, compile it, or else do the same for a number } ;"""
         addr = self.ds.popn()
-        count = self.mem.readb(addr)
-        addr += 1
-
-        #print("NUMBER %d %s" % (count, self.mem.readb(addr)))
-
-        base = self.base
-        index = 0
-        negate = False
-        double = False
-        accumulator = 0
-
-        while count > 0:
-            c = self.mem.readb(addr+index)
-            ch = chr(c)
-            if ch == '-':
-                if index == 0:
-                    negate = True
-                else:
-                    double = True
-
-            elif ch in [',', '/', '.', ';']:
-                double = True
-
-            elif ch >= '0' and ch <= '9':
-                accumulator *= base
-                v = c - 48
-                if v < base:
-                    accumulator += v
-                else:
-                    Debug.trace("Conversion error in NUMBER, out of range digit for base")
-                    return # nothing pushed onto stack
+        name = self.read_counted_string(addr)
+        ffa = self.dict.find(name)
+        if ffa != 0:
+            cfa = self.dict.ffa2cfa(ffa)
+            if self.state != 0 and not self.dict.is_immediate(ffa):
+                self.compile_word(cfa)
             else:
-                Debug.trace("Parse error in NUMBER, non digit found")
-                return # nothing pushed onto stack
-            index += 1
-            count -= 1
+                self.w = cfa # NEXT runs it straight after this returns, as EXECUTE does
+            return
 
-        if negate:
-            accumulator = -accumulator
-        if double:
-            self.ds.pushd(accumulator & 0xFFFFFFFF)
+        self.ds.pushn(addr)
+        number = self.read_number()
+        if number == None:
+            self.unknown(name)
+            return
+        value, double = number
+        if self.state == 0:
+            if double:
+                self.ds.pushd(value & self.Double.MASK)
+            else:
+                self.ds.pushn(value & self.Number.MASK)
+        elif double:
+            value = value & self.Double.MASK
+            self.literal(value >> self.Number.BITS) # pushd leaves the low cell on top
+            self.literal(value & self.Number.MASK)
         else:
-            self.ds.pushn(accumulator & 0xFFFF)
+            self.literal(value & self.Number.MASK)
+
+    def n_colon(self):
+        """: n_COLON   ( -- )
+        { name=parse; create name with cf=DODOES, not yet findable; state=TRUE } ;"""
+        name = self.parse_name()
+        if name == "":
+            Debug.fail("No name given to :")
+        self.dict.abandon() # anything left half compiled
+        self.csp = self.ds.getused()
+        self.dict.create(nf=name, cf=self.getNativeRoutineAddress(" DODOES"))
+        self.state = self.TRUE
+
+    def n_semicolon(self):
+        """: n_SEMICOLON   ( -- )
+        { compile EXIT; finish the definition; state=FALSE } ;"""
+        if self.dict.defining_ffa == None:
+            Debug.fail("; without :")
+        if self.ds.getused() != self.csp:
+            self.compile_error("Unfinished control structure in definition")
+        self.compile_word(self.find_cfa("EXIT"))
+        self.dict.finished()
+        self.state = 0
+
+    def n_immediate(self):
+        """: n_IMMEDIATE   ( -- )
+        { mark the last word defined as immediate } ;"""
+        self.dict.immediate()
+
+    def n_lbracket(self):
+        """: n_LBRACKET   ( -- )
+        { state=FALSE } ;"""
+        self.state = 0
+
+    def n_rbracket(self):
+        """: n_RBRACKET   ( -- )
+        { state=TRUE } ;"""
+        self.state = self.TRUE
+
+    def n_literal(self):
+        """: n_LITERAL   ( n -- )
+        { compile DOLIT n } ;"""
+        self.literal(self.ds.popn())
+
+    def n_tick(self):
+        """: n_TICK   ( -- cfa)
+        { name=parse; push cfa of name } ;"""
+        name = self.parse_name()
+        ffa = self.dict.find(name)
+        if ffa == 0:
+            self.unknown(name)
+            return
+        self.ds.pushn(self.dict.ffa2cfa(ffa))
+
+    def n_brackettick(self):
+        """: n_BRACKETTICK   ( -- )
+        { name=parse; compile DOLIT cfa of name } ;"""
+        name = self.parse_name()
+        ffa = self.dict.find(name)
+        if ffa == 0:
+            self.unknown(name)
+            return
+        self.literal(self.dict.ffa2cfa(ffa))
+
+    def compile_do(self, runtime):
+        # ( -- a k) the runtime, then the offset to after the LOOP, which patches it
+        self.control_push(self.branch(runtime), Machine.CS_DO)
+
+    def compile_loop(self, runtime):
+        # ( a k -- ) the runtime, then the offset back to the first word after DO
+        do = self.control_pop(Machine.CS_DO, runtime.strip())
+        self.branch(runtime, do + self.Number.SIZE)
+        self.resolve(do)
+
+    def n_cdo(self):
+        """: n_CDO   ( -- a)
+        { compile DO, leave address of its offset } ;"""
+        self.compile_do(" DO")
+
+    def n_cqdo(self):
+        """: n_CQDO   ( -- a)
+        { compile ?DO, leave address of its offset } ;"""
+        self.compile_do(" ?DO")
+
+    def n_cloop(self):
+        """: n_CLOOP   ( a -- )
+        { compile LOOP, patch the offsets of it and its DO } ;"""
+        self.compile_loop(" LOOP")
+
+    def n_cplusloop(self):
+        """: n_CPLUSLOOP   ( a -- )
+        { compile +LOOP, patch the offsets of it and its DO } ;"""
+        self.compile_loop(" +LOOP")
+
+    def n_if(self):
+        """: n_IF   ( -- a k)
+        { compile 0BRANCH, leave address of its offset } ;"""
+        self.control_push(self.branch("0BRANCH"), Machine.CS_IF)
+
+    def n_else(self):
+        """: n_ELSE   ( a k -- a k)
+        { compile BRANCH, patch the IF to here, leave address of its offset } ;"""
+        orig = self.control_pop(Machine.CS_IF, "ELSE")
+        self.control_push(self.branch("BRANCH"), Machine.CS_IF)
+        self.resolve(orig)
+
+    def n_then(self):
+        """: n_THEN   ( a k -- )
+        { patch the IF or ELSE to here } ;"""
+        self.resolve(self.control_pop(Machine.CS_IF, "THEN"))
+
+    def n_begin(self):
+        """: n_BEGIN   ( -- a k)
+        { leave here, to branch back to } ;"""
+        self.last_word = None # here is a branch target, so nothing before it is fused
+        self.control_push(self.dict.here(), Machine.CS_BEGIN)
+
+    def n_until(self):
+        """: n_UNTIL   ( a k -- )
+        { compile 0BRANCH back to the BEGIN } ;"""
+        self.branch("0BRANCH", self.control_pop(Machine.CS_BEGIN, "UNTIL"))
+
+    def n_again(self):
+        """: n_AGAIN   ( a k -- )
+        { compile BRANCH back to the BEGIN } ;"""
+        self.branch("BRANCH", self.control_pop(Machine.CS_BEGIN, "AGAIN"))
+
+    def n_while(self):
+        """: n_WHILE   ( a k -- a2 k2 a k)
+        { compile 0BRANCH, leave address of its offset under the BEGIN } ;"""
+        dest = self.control_pop(Machine.CS_BEGIN, "WHILE")
+        self.control_push(self.branch("0BRANCH"), Machine.CS_WHILE)
+        self.control_push(dest, Machine.CS_BEGIN)
+
+    def n_repeat(self):
+        """: n_REPEAT   ( a2 k2 a k -- )
+        { compile BRANCH back to the BEGIN, patch the WHILE to here } ;"""
+        self.branch("BRANCH", self.control_pop(Machine.CS_BEGIN, "REPEAT"))
+        self.resolve(self.control_pop(Machine.CS_WHILE, "REPEAT"))
+
+    def n_case(self):
+        """: n_CASE   ( -- 0 k)
+        { mark where the ENDOFs to patch end } ;"""
+        self.control_push(0, Machine.CS_CASE)
+
+    def n_of(self):
+        """: n_OF   ( -- a k)
+        { compile OVER =0BRANCH, leave address of its offset; compile DROP } ;"""
+        self.compile_word(self.find_cfa("OVER"))
+        self.compile_word(self.find_cfa("="))
+        self.control_push(self.branch("0BRANCH"), Machine.CS_OF)
+        self.compile_word(self.find_cfa("DROP"))
+
+    def n_endof(self):
+        """: n_ENDOF   ( a k -- a2 k2)
+        { compile BRANCH, patch the OF to here, leave address of its offset } ;"""
+        orig = self.control_pop(Machine.CS_OF, "ENDOF")
+        self.control_push(self.branch("BRANCH"), Machine.CS_ENDOF)
+        self.resolve(orig)
+
+    def n_endcase(self):
+        """: n_ENDCASE   ( 0 k a2 k2 ... -- )
+        { compile DROP, patch every ENDOF to here } ;"""
+        self.compile_word(self.find_cfa("DROP"))
+        while self.ds.getused() - self.csp >= 2*self.Number.SIZE and self.ds.getn(0) == Machine.CS_ENDOF:
+            self.resolve(self.control_pop(Machine.CS_ENDOF, "ENDCASE"))
+        self.control_pop(Machine.CS_CASE, "ENDCASE")
 
     def n_bye(self):
         self.running = False
+        self.attention = True
 
     def n_execute(self):
         """EXECUTE a high level address"""
         # ( cfa -- )
-        #Debug.trace("EXECUTE")
-        cfa = self.ds.popn()
-        #Debug.trace(" cfa:0x%x" % cfa)
-        pfa = self.dict.cfa2pfa(cfa)
-        #Debug.trace(" pfa:0x%x" % pfa)
-        cf = self.mem.readn(cfa)
-        self.ip = pfa
-        #Debug.trace(" calling cf:0x%x" % cf)
-        self.call(cf)
-
-    depth = 0
+        # NEXT runs it straight after this returns, as if it were the next cell
+        self.w = self.ds.popn()
+
     def n_dodoes(self):
-        """Repeatedly fetch and execute CFA's until EXIT"""
+        """Enter a high level word, NEXT then fetches CFA's from its PFA until EXIT"""
+        # NEXT has already pushed the caller's return address, and set ip to
+        # our PFA. Push that, so NEXT pops it back into ip once we return.
+        self.rs.pushn(self.ip)
         self.depth += 1
-        thisname = self.dict.pfa02name(self.ip)
-        #Debug.trace("DODOES enter, depth:%d word:%x %s" % (self.depth, self.ip, thisname))
-        #DODOES = self.getNativeRoutineAddress(" DODOES")
-        #EXIT   = self.getNativeRoutineAddress("EXIT")
-
-        # TODO when this executes an EXIT, it MUST return in python land
-        # otherwise the python stack will fill up and overflow.
-
-        while self.running:
-            #NEXT
-            #Debug.trace("NEXT")
-            if self.limit != None:
-                self.limit -= 1
-                if self.limit <= 0:
-                    self.running = False
-                    break
-
-            # ip points to the cfa of the word to execute
-            #Debug.trace(" fetch from ip:0x%x" % self.ip)
-            cfa = self.mem.readn(self.ip)
-            #print(" exec: %s" % self.dict.cfa2name(cfa))
-            #Debug.trace(" cfa:0x%x" % cfa)
-            cf = self.mem.readn(cfa)
-            #Debug.trace(" cf:0x%x" % cf)
-            self.rs.pushn(self.ip+2)
-            # put something useful in self.ip, i.e. the pfa
-            self.ip = cfa+2 # pfa
-            #print("calling cf:%x" % cf)
-            #if cf == DODOES:
-            #    print("dodoes %s calling dodoes, word:%x %s" % (thisname, self.ip, self.dict.pfa02name(self.ip)))
-            #elif cf == EXIT:
-            #    print("dodoes %s calling exit" % thisname)
-            self.call(cf) # if this called n_exit, we must now exit this level of the dodoes loop.
-            self.ip = self.rs.popn() # this still needs to happen after call()
-
-            if self.exits_pending > 0:
-                #print("dodoes %s EXITS pending %d" % (thisname, self.exits_pending))
-                self.exits_pending -= 1
-                #print("dodoes %s exits now pending %d" % (thisname, self.exits_pending))
-                break
-
-        #self.ip = self.rs.popn()
-
-        self.depth -= 1
-        #print("returning from DODOES %s, depth now %d" % (thisname, self.depth))
+        self.tick()
 
     def n_dolit(self):
-        """Process an inline 16 bit literal and put it on DS"""
+        """Process an inline cell sized literal and put it on DS"""
         #: n_DOLIT  ( -- )
-        #{ip=rs_pop; n=mem_readn(ip); ds.pushn(n) ip+=2}
+        #{ip=rs_pop; n=mem_readn(ip); ds.pushn(n) ip+=cell}
         ip = self.rs.popn()
         n = self.mem.readn(ip)
         self.ds.pushn(n)
         #Debug.trace("found literal: %d" % n)
-        ip += 2
+        ip += self.Number.SIZE
         self.rs.pushn(ip)
 
+    def n_dosq(self):
+        """Get the address and length of a string encoded inline in the pf"""
+        # Same encoding as DOSTR, this is the runtime of a compiled S"
+        self.n_dostr()
+        a = self.ds.popn()
+        self.ds.pushn(a+1)
+        self.ds.pushn(self.mem.readb(a))
+
     def n_dostr(self):
         """Get the address of a string encoded inline in the pf"""
         # Get the address of the PFA, which is the start of the count preceded string
@@ -1946,31 +4582,39 @@ class Machine():
         self.ds.pushn(pfa)
 
         # work out how many cells of data to jump for the return point
-        # This includes an optional pad byte at the end, which is not accounted
-        # for in the length byte, but required to 16-bit align all cells.
+        # This includes optional pad bytes at the end, which are not accounted
+        # for in the length byte, but required to align all cells.
 
         l = self.mem.readb(ip)
-        cellbytes = (l/2)+1 # account for length byte, and optional pad at end
+        cells = (l//self.Number.SIZE)+1 # account for length byte, and optional pad at end
         #for a in range(pfa+1, pfa+l+1):
         #    ch = chr(self.mem.readb(a))
         #    sys.stdout.write(ch)
 
-        ip += cellbytes*2
+        ip += cells*self.Number.SIZE
         self.rs.pushn(ip)
 
     def n_exit(self):
         """EXIT word - basically a high level Forth return"""
-        #print("****EXIT")
-        self.exits_pending += 1
+        # Drop our own return address, so NEXT pops the caller's one instead
+        self.rs.popn()
+        self.depth -= 1
 
 #----- FORTH OUTER INTERPRETER ------------------------------------------------
 
 class Forth():
     """The outer interpreter"""
-    def __init__(self, ins=None, outs=None, disks=None):
-        self.ins   = ins
-        self.outs  = outs
-        self.disks = disks
+    # Words that parse the text after them up to a delimiter, chunks() keeps that text whole
+    PARSING = {'S"': '"'}
+
+    def __init__(self, ins=None, outs=None, disks=None, memsize=MEM_SIZE, shared=True, cellbits=CELL_BITS):
+        self.ins     = ins
+        self.outs    = outs
+        self.disks   = disks
+        self.memsize = memsize
+        self.shared  = shared # share the sealed base words, rather than synthesise our own
+        self.cellbits = cellbits
+        self.basedict = None
 
     def boot(self):
         if self.outs==None:
@@ -1979,9 +4623,15 @@ class Forth():
             self.ins  = Input() # Mock
         if self.disks==None:
             self.disk = Disk(DISK_FILE_NAME) #Mock
+        else:
+            self.disk = self.disks
 
-        self.machine = Machine(self).boot()
-        self.synthesise()
+        if self.shared:
+            self.basedict = base_dictionary(self.cellbits)
+            self.machine = Machine(self).boot()
+        else:
+            self.machine = Machine(self).boot()
+            self.synthesise()
 
         #self.machine.dict.dump()
         return self
@@ -1996,7 +4646,7 @@ class Forth():
                 a = Forth.flatten(a)
                 for i in a:
                     r.append(i)
-            elif type(a) == str or type(a) == int:
+            elif type(a) == str or type(a) == bytearray or isinstance(a, INTEGER_TYPES):
                 r.append(a)
             else:
                 Debug.fail("Unhandled arg type:%s %s" % (str(type(a)), str(a)))
@@ -2006,39 +4656,44 @@ class Forth():
     def create_word(self, name, *args):
         """Create a new high level dictionary entry containing a list of words.
              Note this is not a full defining compiler, just a word list
-             that also understands numbers."""
-
-        # Build the PF entries (all should contain CFAs)
-        plist  = []
-        DODOES = self.machine.getNativeRoutineAddress(" DODOES")
-
+             that also understands numbers. Immediate words, such as
+             IF THEN and DO LOOP, run as they are met, and compile their branches."""
+        m = self.machine
         args = self.flatten(args)
 
-        for word in args:
-            if type(word) == str:
-                # It's a word, so lookup it's address in DICT
-                ffa = self.machine.dict.find(word)
-                if ffa == 0:
-                    Debug.fail("Word not in dictionary:%s" % word)
-                #TODO if not found, should pass to NUMBER to see if it parses,
-                # and then just append it if it does.
-                cfa = self.machine.dict.ffa2cfa(ffa)
-                plist.append(cfa)
-            elif type(word) == int:
-                plist.append(word)
-
-        exit_cfa = self.machine.dict.ffa2cfa(self.machine.dict.find("EXIT"))
-        plist.append(exit_cfa)
-
-        # Now create the dictionary entry
         # CF=DODOES is implied for all high level word definitions
-        #Debug.trace(plist)
-        self.machine.dict.create(
-            nf=name,
-            cf=DODOES,
-            pf=plist,
-            finish=True
-        )
+        m.dict.create(nf=name, cf=m.getNativeRoutineAddress(" DODOES"))
+        csp = m.csp
+        m.csp = m.ds.getused() # control structures are checked like : checks them
+        try:
+            for word in args:
+                if type(word) == str:
+                    # It's a word, so lookup it's address in DICT
+                    ffa = m.dict.find(word)
+                    if ffa == 0:
+                        Debug.fail("Word not in dictionary:%s" % word)
+                    cfa = m.dict.ffa2cfa(ffa)
+                    if not m.dict.is_immediate(ffa):
+                        m.compile_word(cfa)
+                    elif m.mem.readn(cfa) - m.nrstart < m.nrsize:
+                        m.call(m.mem.readn(cfa)) # a native, such as IF
+                    else:
+                        m.execute(cfa)
+                elif type(word) == bytearray:
+                    m.dict.comma_bytes(word) # an inline string
+                else:
+                    m.dict.comma(word)
+
+            if m.ds.getused() != m.csp:
+                Debug.fail("Unfinished control structure in:%s" % name)
+        except:
+            m.dict.abandon()
+            raise
+        finally:
+            m.csp = csp
+
+        m.compile_word(m.find_cfa("EXIT"))
+        m.dict.finished()
         #self.machine.dict.dumpraw()
 
     @staticmethod
@@ -2047,10 +4702,11 @@ class Forth():
 
     @staticmethod
     def LITERAL(number):
-        return " DOLIT", (number & 0xFFFF)
+        return " DOLIT", number # masked to a cell when it is compiled
 
     @staticmethod
-    def STRING(string):
+    def pack(string):
+        """Pack a count preceded string into bytes, padded to whole cells when compiled"""
         # Length is stored in a byte, so can't be too big. But it can be zero.
         #print("STR:%s" % string)
         l = len(string)
@@ -2058,33 +4714,22 @@ class Forth():
             Debug.fail("Cannot encode strings longer than 255 characters")
 
         # first should be the length
-        s = chr(l) + string
-        # List should be an even number of bytes long
-        if (len(s) % 2) != 0: # odd length including length byte
-            s = s + chr(0) # pad byte
-            l += 1
-
-        # Encode bytestream, two bytes per cell, note first byte encoded is length
-        # last byte encoded might be last char, or a pad char of 0
-        nlist = []
-        for i in range(0, l, 2): # encode pairs of numbers
-            # Using from_bytes means it works with any endianness
-            n = Number.from_bytes((ord(s[i]), ord(s[i+1])))
-            nlist.append(n)
-
-        # build a list of 16 bit numbers, numbers ready for word encoding
-        wlist = [" DOSTR"]
-        wlist.append(nlist)
-        #x = ""
-        #for n in nlist:
-        #    x += "%x " % n
-        #print("Will encode as:%s" % x)
-        #print(wlist)
-        return wlist
+        return bytearray([l] + [ord(ch) for ch in string])
+
+    @staticmethod
+    def STRING(string):
+        """An inline string that pushes its address, the count is at that address"""
+        # build a list of cell sized numbers, ready for word encoding
+        return [" DOSTR", Forth.pack(string)]
+
+    @staticmethod
+    def SQUOTE(string):
+        """An inline string that pushes its address and length, like S" """
+        return [" DOSQ", Forth.pack(string)]
 
 
     def create_const(self, name, number):
-        """Create a constant with a given 16 bit value"""
+        """Create a constant with a given cell sized value"""
         RDPFA = self.machine.getNativeRoutineAddress(" RDPFA")
 
         # Now create the dictionary entry
@@ -2096,19 +4741,20 @@ class Forth():
         )
         #self.machine.dict.dumpraw()
 
-    def create_var(self, name, size=2, init=0):
-        """Create a variable with a given 16 bit default value"""
-        if size!=2:
-            Debug.fail("var size != 2 not yet supported")
+    def create_var(self, name, size=None, init=0):
+        """Create a variable with a given cell sized default value"""
+        if size != None and size != self.machine.Number.SIZE:
+            Debug.fail("var size other than a cell not yet supported")
 
+        # Variables live in the user variable area, so each task has its own
         addr=self.machine.uv.pushn(init)
-        RDPFA = self.machine.getNativeRoutineAddress(" RDPFA")
+        RDPFAREL = self.machine.getNativeRoutineAddress(" RDPFAREL")
 
         # Now create the dictionary entry
         self.machine.dict.create(
             nf=name,
-            cf=RDPFA, #TODO: something goes wrong with this at runtime
-            pf=[addr],
+            cf=RDPFAREL,
+            pf=[addr - self.machine.uv.start],
             finish=True
         )
         #self.machine.dict.dumpraw()
@@ -2119,18 +4765,90 @@ class Forth():
         # Push PFA of word to execute on stack (equivalent to TICK)
         word_ffa = self.machine.dict.find(word)
         word_cfa = self.machine.dict.ffa2cfa(word_ffa)
-        self.machine.ds.pushn(word_cfa)
 
-        # Execute word who's CFA is on the stack (actually, EXECUTE)
-        exec_ffa = self.machine.dict.find("EXECUTE")
-        exec_cfa = self.machine.dict.ffa2cfa(exec_ffa)
-        exec_cf  = self.machine.mem.readn(exec_cfa)
-        self.machine.running = True
-        self.machine.call(exec_cf)
+        # Run it to completion as the top level word (actually, EXECUTE)
+        self.machine.execute(word_cfa)
 
         import sys
         sys.stdout.flush()
 
+    def optimise(self, word):
+        """Translate a high level word, and the words it calls, to Python.
+           Returns False if it can't be, and then it runs as before."""
+        return self.machine.optimise(self.machine.find_cfa(word))
+
+    def deoptimise(self, word):
+        """Put a word back to being run by the inner interpreter"""
+        self.machine.deoptimise(self.machine.find_cfa(word))
+
+    def start_word(self, word):
+        """Get word ready to run as the top level word, machine.run() then runs it"""
+        word_ffa = self.machine.dict.find(word)
+        self.machine.start(self.machine.dict.ffa2cfa(word_ffa))
+
+    def var(self, name):
+        """Get the address of a variable in the running task"""
+        return self.machine.var(name)
+
+    def evaluate(self, text):
+        """Interpret source text a line at a time, like REPL but without prompts.
+           Returns False if the machine stopped (BYE, ABORT) before the end."""
+        for line in text.splitlines():
+            for chunk in self.chunks(line):
+                if not self.interpret(chunk):
+                    return False
+        return True
+
+    def chunks(self, line):
+        """Split a line at spaces, into pieces that each fit in TIB"""
+        size = self.machine.tibsize
+        while len(line) > size:
+            cut = -1
+            for space in self.spaces(line):
+                if space > size:
+                    break
+                cut = space
+            if cut <= 0:
+                Debug.fail("Word or string too long for TIB:%s" % line[:size])
+            yield line[:cut]
+            line = line[cut+1:]
+        yield line
+
+    def spaces(self, line):
+        """Where a line can be split, the spaces between words but not in a string literal"""
+        pos = 0
+        while pos < len(line):
+            if line[pos] == " ":
+                yield pos
+                pos += 1
+                continue
+            end = line.find(" ", pos)
+            if end < 0:
+                return
+            delim = Forth.PARSING.get(line[pos:end])
+            if delim != None:
+                end = line.find(delim, end+1)
+                if end < 0:
+                    return # the literal runs to the end of the line
+                end += 1
+            pos = end
+
+    def set_tib(self, line):
+        """Put a line in TIB, ready for WORD to parse it"""
+        if len(line) > self.machine.tibsize:
+            Debug.fail("Line too long for TIB:%s" % line)
+        tib = self.machine.tibstart
+        for i in range(len(line)):
+            self.machine.mem.writeb(tib+i, ord(line[i]))
+        self.machine.mem.writen(self.var("SPAN"), len(line))
+        self.machine.mem.writen(self.var(">IN"), tib)
+
+    def interpret(self, line):
+        """Interpret one line, returns False if the machine stopped"""
+        self.set_tib(line)
+        self.execute_word("INTERPRET")
+        return self.machine.running
+
     #word parser      - parses a word from an input stream
     #output formatter - formats numbers etc
     #interpreter      - interprets words on an input stream
@@ -2146,7 +4864,7 @@ class Forth():
         # CONSTANTS -----------------------------------------------------------
 
         consts = [
-            # name,  value (all size 2)
+            # name,  value (all a cell)
             ("D0",    self.machine.dict.start),
             ("DZ",    self.machine.dict.size),
             ("S0",    self.machine.ds.start),
@@ -2158,8 +4876,11 @@ class Forth():
             ("PAD",   self.machine.padstart),
             ("PADZ",  self.machine.padsize),
             ("FALSE", 0x0000),
-            ("TRUE",  0xFFFF),
+            ("TRUE",  self.machine.TRUE),
             ("BL",    32),
+            ("INT16",   0), # ARRAY types
+            ("INT32",   1),
+            ("FLOAT64", 2),
             # No number parser yet, so pre-seed a few
             #("0",     0),
             #("1",     1),
@@ -2184,13 +4905,12 @@ class Forth():
             #name     size,   init
             (">IN",),
             ("BLK",),
-            #("BINDEX", 2*2),
-            ("BASE",    2,    10),
+            #("BINDEX", 2*Number.SIZE),
             ("SPAN",),
         ]
         for v in vars:
             name = v[0]
-            size = 2
+            size = None
             init = 0
             if len(v) > 1:
                 size = v[1]
@@ -2209,35 +4929,13 @@ class Forth():
 
         words = [
             #name      parts                  stack effects
-            #----- RELATIONAL
-            ("=",      ["-", "0="]),
-            ("<>",     ["-", "0=", "NOT"]),
-            ("<",      ["-", "0>"]),
-            (">",      ["-", "0<"]),
             #----- ALU
-            ("/MOD",   ["DUP", "DUP", "/", "ROT", "ROT", "MOD", "SWAP"]),   # ( n1 n2 -- n-rem n-quot)
-            ("1+",     [LIT(1),  "+"]),                                          # ( n -- n+1)
-            ("1-",     [LIT(1),  "-"]),                                          # ( n -- n-1)
             ("2+",     [LIT(2),  "+"]),                                          # ( n -- n+2)
             ("2-",     [LIT(2),  "-"]),                                          # ( n -- n-2)
-            ("2*",     [LIT(2),  "*"]),                                          # ( n -- n*2)
-            ("2/",     [LIT(2),  "/"]),                                          # ( n -- n/2)
-            ("NEGATE", [LIT(-1), "*"]),                                          # ( n -- -n)
-
-            ("ABS",    ["DUP", "0<", "0BRANCH", +2, "NEGATE"]),                          # ( n -- |n|)
-            ("MIN",    ["OVER", "OVER", "<", "NOT", "0BRANCH", +2, "SWAP", "DROP"]),     # ( n1 n2 -- min)
-            ("MAX",    ["OVER", "OVER", ">", "NOT", "0BRANCH", +2, "SWAP", "DROP"]),     # ( n1 n2 -- max)
 
             #----- STACK OPS
-            (">R",      ["RP", "@", LIT(1), "+", "DUP", "ROT", "!", "RP", "!"]),             # ( n -- )
-            ("R>",      ["RP", "DUP", "@", "@", "SWAP", LIT(1), "-", "RP", "!"]),            # ( -- n)
-            ("R@",      ["RP", "@", "@"]),                                              # ( -- n)
             ("SP@",     ["SP", "@"]),                                                   # ( -- a)
-            ("?DUP",    ["DUP", "0BRANCH", +2, "DUP"]),                                  # ( n -- n n or 0 -- 0)
-            ("2SWAP",   ["ROT", ">R", "ROT", "R>"]),                                    # ( d1 d2 -- d2 d1)
-            ("2DUP",    ["OVER", "OVER"]),                                              # ( d -- d d)
-            ("2OVER",   ["2SWAP", "2DUP", ">R", ">R", "2SWAP", "R>", "R>"]),            # ( d1 d2 -- d1 d2 d1)
-            ("2DROP",   ["DROP", "DROP"]),                                              # ( d --)
+            ("?DUP",    ["DUP", "IF", "DUP", "THEN"]),                                  # ( n -- n n or 0 -- 0)
 
             #----- GENERAL I/O
             ("HEX",      [LIT(16), "BASE", "!"]),                                            #( -- )
@@ -2249,29 +4947,21 @@ class Forth():
 
             #---- SIMPLE MEMORY OPS
             ("+!",       ["DUP", "@", "ROT", "+", "!"]),                                    #( n a -- )
-            ("2!",       ["ROT", "SWAP", "DUP", "ROT", "SWAP", "!", LIT(2), "+", "!"]),     #( d a -- )
-            ("2@",       ["DUP", "@", "SWAP", 2, "+", "@"]),                                #( a -- d)
 
 
             #-----
             ("EXPECT", [                                        # ( a # -- )
-                "SPAN", "!",                                    # ( a)          use SPAN as the char counter while in loop
-                "DUP",                                          # ( a a)        leave user buffer start on stack, for later cleanup
-                ">IN", "!",                                     # ( a)          set INP to start of user buffer, use as write ptr in loop
-                # loop                                          # ( a)
+                "OVER", ">IN", "!",                             # ( a #)        >IN is the write ptr, a if nothing read
+                "OVER", "+", "OVER",                            # ( a a+# a)
+                "?DO",                                          # ( a)          I is the address to write to
                     "KEY",                                      # ( a c)        read a char
-                    "DUP", LIT(4), "=", "0BRANCH", +2, "BYE",   # ( a c)        is it EOF? If it is, BYE
-                    "DUP", LIT(10), "=", "NOT", "0BRANCH", +23, # ( a c ?)      is it LF?, to:done
-                    ">IN", "@", "C!",                           # ( a)          write via INP ptr
-                    ">IN", "@", LIT(1), "+", ">IN", "!",        # ( a)          advance write pointer
-                    "SPAN", "@", LIT(1), "-", "SPAN", "!",      # ( a)          dec counter
-                    "SPAN", "@", "0=",                          # ( a ?)        is span=0 (buffer full)
-                    "0BRANCH", -36,                             # ( a)          to:loop go round again if it isn't
-                # done                                          # ( a c)        address on stack is of start of buffer
-                #                                               #               >IN points to char after last written
-                #                                               #               a on stack is start of user buffer
-                #                                               #               >IN - a is the true SPAN including optional CR
-                "DROP",                                         # ( aTIB)
+                    "DUP", LIT(4), "=", "IF", "BYE", "THEN",    # ( a c)        is it EOF? If it is, BYE
+                    "DUP", LIT(10), "=", "IF",                  # ( a c)        is it LF?
+                        "DROP", "LEAVE",                        # ( a)          yes, done
+                    "THEN",
+                    "I", "C!",                                  # ( a)          write it
+                    "I", LIT(1), "+", ">IN", "!",               # ( a)          >IN points to char after last written
+                "LOOP",                                         # ( a)
                 "DUP",                                          # ( aTIB aTIB)
                 ">IN", "@",                                     # ( aTIB aTIB aLASTWR+1)
                 "SWAP",                                         # ( aTIB aLASTWR+1 aTIB)
@@ -2281,16 +4971,10 @@ class Forth():
             ]),
             #-----
             ("TYPE", [                                      # ( a # -- )
-                                                            # target:read
-                "DUP", "0=", "NOT", "0BRANCH", +14,         # (exit) ( a #) if counter zero, exit
-                "SWAP", "DUP", "C@",                        # ( # a c)      read char at address
-                "EMIT",                                     # ( # a)        show char
-                LIT(1), "+",                                # ( # a)        advance address
-                "SWAP",                                     # ( a #)
-                LIT(1), "-",                                # ( a #)        dec count
-                "BRANCH", -17,                              # (read)        go round for another
-                                                            # target:exit
-                "DROP", "DROP",
+                "OVER", "+", "SWAP",                        # ( a+# a)
+                "?DO",                                      # ( )
+                    "I", "C@", "EMIT",                      # ( )       show char at I
+                "LOOP",
             ]),
             #-----
             ("COUNT", [                                     # ( a)
@@ -2302,34 +4986,32 @@ class Forth():
             ]),
             #-----
             ("SPACES", [                                    # ( n -- )
-                # loop                                      # ( n)
-                    "DUP",                                  # ( n n)
-                    "0BRANCH", +9,                          # ( n)      to:exit
-                    LIT(32), "EMIT",                        # ( n)
-                    LIT(1), "-",                            # ( n-1)
-                    "BRANCH", -10,                          # ( n)      to:loop
-                # exit                                      # ( n)
-                "DROP"                                      # ( )
+                LIT(0), "?DO",                              # ( )
+                    LIT(32), "EMIT",                        # ( )
+                "LOOP",
             ]),
             #-----
             ("IN@+", [                                          # ( -- c)
                 "TIB", "SPAN", "@", "+",                        # ( a)          address of first unused byte at end of buffer
                 ">IN", "@", "=",                                # ( ?)          is IN ptr at end of buffer?  TRUE if at end
-                LIT(0), "SWAP", "NOT", "0BRANCH", +12, "DROP",  # ( -- or 0)    to:exit with 0 on stack if end, stack empty if chars
-                ">IN", "@", "C@",                               # ( c)          read next char at ptr
-                ">IN", "@", LIT(1), "+", ">IN", "!",            # ( c)          advance IN ptr
-                # exit                                          # ( c or 0)
+                "IF",
+                    LIT(0),                                     # ( 0)          end of buffer
+                "ELSE",
+                    ">IN", "@", "C@",                           # ( c)          read next char at ptr
+                    ">IN", "@", LIT(1), "+", ">IN", "!",        # ( c)          advance IN ptr
+                "THEN",                                         # ( c or 0)
             ]),
             #-----
-            ("SKIP", [                                  # ( s)                  skip until end or not c
-            # skip                                      # ( s)
-                "IN@+",                                 # ( s c or c 0)         read next from input stream, returns 0 if empty
-                "DUP", "0BRANCH", +14,                  # ( s c) to:exitskip    exit if at end of buffer??
-                "OVER", "=", "NOT", "0BRANCH", -8,      # ( s )  to:skip        if matches separator
-            ">IN", "@", LIT(1), "-", ">IN", "!",        # ( s )                 just seen non separator, wind back to first non sep char
-            "DUP",                                      # ( s s)                two items on stack
-            # exitskip                                  # ( s c)
-            "DROP", "DROP",                             # ( )
+            ("SKIP", [                                  # ( s)                  skip until end or not s
+                "BEGIN",                                # ( s)
+                    "IN@+",                             # ( s c or s 0)         read next from input stream, returns 0 if empty
+                    "DUP", "0=", "IF",                  # ( s c)
+                        "DROP", "DROP", "EXIT",         # ( )                   at end of buffer
+                    "THEN",
+                    "OVER", "<>",                       # ( s ?)
+                "UNTIL",                                # ( s)                  until not a separator
+                ">IN", "@", LIT(1), "-", ">IN", "!",    # ( s )                 just seen non separator, wind back to first non sep char
+                "DROP",                                 # ( )
             ]),
             #-----
             ("0PAD>", [                                 # ( -- )
@@ -2344,62 +5026,43 @@ class Forth():
             ("WORD", [                                      # ( cs -- a)
                 "0PAD>",                                    # ( cs)             reset PAD pointer/count
                 "DUP", "SKIP",                              # ( cs)             leave separator on stack, need it later
-                # copy                                      # ( cs)
-                    "IN@+",                                 # ( cs c or cs 0)   try to consume next char
-                    "DUP", "0BRANCH", +17,                  # ( cs c)  to:exit  zero marks end of buffer
+                "BEGIN",                                    # ( cs)
+                    "IN@+", "DUP",                          # ( cs c c or cs 0 0) try to consume next char
+                "WHILE",                                    # ( cs c)           zero marks end of buffer
                     "DUP", "PAD>+",                         # ( cs c)           write char to next pad, advance ptr
-                    "OVER", "=", "0BRANCH", -9,             # ( cs)  to:copy    if not separator, go round again
-                    "DROP",                                 # ( )
-                    "PAD", "C@", LIT(1), "-", "PAD","C!",   # ( )               take one off count value
-                    "BRANCH", +3,                           # ( )
-                # exit                                      # ( c c)
+                    "OVER", "=", "IF",                      # ( cs)             the separator ends the word
+                        "DROP",                             # ( )
+                        "PAD", "C@", LIT(1), "-", "PAD","C!",   # ( )           take one off count value
+                        "PAD", "EXIT",                      # ( a)
+                    "THEN",
+                "REPEAT",                                   # ( cs 0)
                 "DROP", "DROP",                             # ( )
-                # ret                                       # ( )
                 "PAD"                                       # ( a)              address of PAD (count in ofs 0) returned on stack
             ]),
             #-----
             ("STAR", [CHR('*')]), # could do as a CONSTANT
             #-----
             ("INTERPRET", [
-                # getword                                   # ( )
-                "BL", "WORD", "COUNT",                      # ( a #)
-                "0=", "0BRANCH", +4,                        # ( a)          to: findword
+                "BEGIN",                                    # ( )
+                    "BL", "WORD",                           # ( a)
+                    "DUP", "C@",                            # ( a #)
+                "WHILE",                                    # ( a)          until the end of the line
+                    " INTERPRET",                           # ( )           execute or compile it, as STATE says
+                "REPEAT",
                 "DROP",                                     # ( )
-                "BRANCH", +19,                              # ( )           to: exit
-
-                # findword                                  # ( a)
-                LIT(1), "-",                                # ( a)          litcells=2: subtract one to point to count byte for FIND
-                "DUP",                                      # ( a:t a:t)    save addr in case we want to print ?name on not found
-                "FIND",                                     # ( a:t a:cfa)  0 if not found, cfa if found
-                "DUP", "NOT", "0BRANCH", +5,                # ( a:t a:cfa)  to: run
-
-                # notword                                   # ( a:t a:cfa)
-                "DROP",                                     # ( a:t)
-                "NUMBER",                                   # ( n or u or d or ud or -- )
-                "BRANCH", -21,                              # ( ) to:getword
-
-                #TODO: might have to put this in REPL loop, with a way to trap ABORT??
-                # notnumber
-                #CHR("?"), "EMIT",                           # ( a:t)        chrcells=2
-                #"COUNT", "TYPE",                            # ( )
-                #"BRANCH", +6,                               # ( )           to: exit
-
-                # run                                       # ( a:t a:cfa)  addr is cfa of word to exec
-                "SWAP", "DROP",                             # ( a:cfa)
-                "EXECUTE",                                  # ( )           execute the word whose address info is on the DS
-                "BRANCH", -26,                              # ( )           to: getword
             ]),
             #-----
             ("REPL", [
-                LIT(0), "SPAN", "!",                        # ( )       clear span so we don't get repeat on blank line
-                "TIB", "TIBZ", "EXPECT",                    # ( )       read in a whole line up to CR
-                "TIB", ">IN", "!",                          # ( )       set IN read ptr to start of TIB
-                "INTERPRET",                                # ()
-                #TODO could return true or false depending on whether it worked or failed
-                #this wold allow us to display Ok or Err here
-                STR("Ok"), "COUNT", "TYPE",                 # ()        strcells=3 (dostr)(count,O)(k,-)
-                "CR",
-                "BRANCH", -18                               # ()        to:start
+                "BEGIN",
+                    LIT(0), "SPAN", "!",                    # ( )       clear span so we don't get repeat on blank line
+                    "TIB", "TIBZ", "EXPECT",                # ( )       read in a whole line up to CR
+                    "TIB", ">IN", "!",                      # ( )       set IN read ptr to start of TIB
+                    "INTERPRET",                            # ()
+                    #TODO could return true or false depending on whether it worked or failed
+                    #this wold allow us to display Ok or Err here
+                    STR("Ok"), "COUNT", "TYPE",             # ()
+                    "CR",
+                "AGAIN",
             ]),
         ]
 
@@ -2411,6 +5074,102 @@ class Forth():
 
 
 
+#----- SHARED BASE DICTIONARY -------------------------------------------------
+#
+# Every booted Forth has the same synthesised words, so they are built once
+# per process, sealed, and then mapped read-only into every Machine.
+# Each Machine adds its own words above them, in its own memory.
+
+sealed_bases = {} # cell width -> BaseDictionary
+
+def base_dictionary(cellbits=CELL_BITS):
+    """Get the sealed base words for a cell width, synthesising them on first use"""
+    if cellbits not in sealed_bases:
+        forth = Forth(ins=Input(), outs=Output(), shared=False, cellbits=cellbits).boot()
+        sealed_bases[cellbits] = BaseDictionary(forth.machine)
+    return sealed_bases[cellbits]
+
+
+#----- INTERPRETER POOL -------------------------------------------------------
+
+class ForthPool():
+    """A pool of booted interpreters, each put back to its boot state on release"""
+    def __init__(self, size, ins=Input, outs=Output, **kwargs):
+        # ins and outs are factories, so every interpreter has its own I/O
+        self.ins    = ins
+        self.outs   = outs
+        self.kwargs = kwargs
+        self.free   = [self.boot() for i in range(size)]
+
+    def boot(self):
+        forth = Forth(ins=self.ins(), outs=self.outs(), **self.kwargs).boot()
+        forth.pristine = forth.machine.checkpoint()
+        return forth
+
+    def acquire(self):
+        """Get a clean interpreter, booting another one if the pool is empty"""
+        if len(self.free) > 0:
+            return self.free.pop()
+        return self.boot()
+
+    def release(self, forth):
+        """Reset an interpreter to its boot state, and return it to the pool"""
+        self.reset(forth)
+        self.free.append(forth)
+
+    def reset(self, forth):
+        forth.machine.restore(forth.pristine)
+        forth.ins.clear()
+        forth.outs.clear()
+
+
+#----- BATCH RUNNER -----------------------------------------------------------
+#
+# Runs many short, independent Forth jobs over a pool of processes.
+# The interpreter is booted once in the parent, and each worker inherits the
+# booted image copy-on-write when it forks. Before every job the worker puts
+# its memory and registers back to that pristine state.
+
+batch_forth = None # booted before the pool forks, so every worker inherits it
+batch_image = None # checkpoint of batch_forth just after boot
+
+def batch_job(job):
+    """Run one (source, input) job in a worker, returns (output, stack, error)"""
+    source, input = job
+    machine = batch_forth.machine
+    machine.restore(batch_image)
+    batch_forth.ins.set(input)
+    batch_forth.outs.clear()
+
+    error = None
+    try:
+        batch_forth.evaluate(source)
+        if machine.limit != None and machine.limit <= 0:
+            error = "Step limit reached"
+    except Exception as e:
+        error = "%s:%s" % (type(e).__name__, str(e))
+    return batch_forth.outs.get(), machine.ds.items(), error
+
+def run_batch(jobs, processes=None, max_steps=None):
+    """Run a list of (source, input) jobs over a process pool.
+       Returns a list of (output, data stack, error or None), one per job."""
+    global batch_forth, batch_image
+    batch_forth = Forth(ins=Input(), outs=Output()).boot()
+    batch_forth.machine.limit = max_steps
+    batch_image = batch_forth.machine.checkpoint()
+
+    import multiprocessing
+    if hasattr(multiprocessing, "get_context"):
+        multiprocessing = multiprocessing.get_context("fork") # workers must inherit the boot image
+    pool = multiprocessing.Pool(processes)
+    try:
+        chunksize = max(1, len(jobs) // (4 * (processes or multiprocessing.cpu_count())))
+        return pool.map(batch_job, jobs, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+
 #----- RUNNER -----------------------------------------------------------------
 
 forth = Forth(ins=KeyboardInput(), outs=ScreenOutput()).boot()
@@ -2444,16 +5203,66 @@ def test_echoloop():
     #        #"TIB", "SPAN", "@", "TYPE",
     #        "BRANCH", -4
     #)
-    forth.create_word("TEST", "TIB", "TIBZ", "EXPECT" , "TIB", "SPAN", "@", "TYPE", "BRANCH", -8 )
+    forth.create_word("TEST", "BEGIN", "TIB", "TIBZ", "EXPECT" , "TIB", "SPAN", "@", "TYPE", "AGAIN")
     #forth.machine.dict.dump()
     forth.execute_word("TEST")
 
 def repl():
     forth.execute_word("REPL")
 
+def run_script(path=None, each=None):
+    """Interpret a source file, then run a word for each line of stdin.
+       Returns the exit status, 1 if ABORT or an error stopped it."""
+    machine = forth.machine
+    try:
+        running = True
+        if path != None:
+            f = open(path)
+            try:
+                for line in f.read().splitlines():
+                    running = forth.evaluate(line) and machine.errors == 0
+                    if not running:
+                        break
+            finally:
+                f.close()
+        if running and each != None and machine.dict.find(each) == 0:
+            machine.unknown(each)
+            running = False
+        if running and each != None:
+            # like awk, the word finds the line in TIB, and its length in SPAN.
+            # A line too long for TIB is run a piece at a time, split at spaces.
+            for line in sys.stdin:
+                for chunk in forth.chunks(line.rstrip("\r\n")):
+                    forth.set_tib(chunk)
+                    forth.execute_word(each)
+                    running = machine.running and machine.errors == 0
+                    if not running:
+                        break
+                if not running:
+                    break
+    except Exception as e:
+        sys.stdout.flush()
+        sys.stderr.write("%s:%s\n" % (type(e).__name__, str(e)))
+        return 1
+    sys.stdout.flush()
+    if machine.aborted or machine.errors != 0:
+        return 1
+    return 0
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="A minimal FORTH, runs the REPL if there is nothing else to do")
+    parser.add_argument("script", nargs="?", help="source file to interpret")
+    parser.add_argument("-e", "--each", metavar="WORD", help="run WORD once for each line of stdin")
+    args = parser.parse_args(argv)
+    if args.script == None and args.each == None:
+        repl()
+        return 0
+    return run_script(args.script, args.each)
+
 if __name__ == "__main__":
     #test_hello()
     #test_echoloop()
-    repl()
+    sys.exit(main())
 
 # END
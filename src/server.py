@@ -0,0 +1,115 @@
+# server.py
+#
+# Serve the Forth REPL to many connections at once, over TCP or Unix sockets.
+# Each connection gets its own interpreter from a pool. The interpreters run
+# in slices on one asyncio event loop, so a KEY with no input waits for the
+# socket instead of blocking the whole process.
+#
+# This needs Python 3.7 or later, forth.py itself does not.
+
+import argparse
+import asyncio
+
+import forth
+
+SLICE_STEPS = 1000 # calls and backward branches per slice, before other sessions get a go
+READ_SIZE   = 4096
+POOL_SIZE   = 8    # interpreters booted up front, more are booted when needed
+
+
+class SocketInput(forth.Input):
+    """Characters received on a connection, fed in as they arrive"""
+
+    def feed(self, data):
+        self.append(data.decode("latin-1"))
+
+    def eof(self):
+        self.append(chr(4)) # CTRL-D, EXPECT does a BYE
+
+
+class SocketOutput(forth.Output):
+    """Characters for a connection, sent after each slice"""
+
+    async def drain(self, writer):
+        if len(self.buf) > 0:
+            writer.write(self.buf.encode("latin-1"))
+            self.buf = ""
+            await writer.drain()
+
+
+class ForthServer():
+    """Runs one REPL per connection, interleaving them on the event loop"""
+
+    def __init__(self, pool_size=POOL_SIZE, slice_steps=SLICE_STEPS):
+        self.pool = forth.ForthPool(pool_size, ins=SocketInput, outs=SocketOutput)
+        self.slice_steps = slice_steps
+        self.sessions = 0
+
+    async def session(self, reader, writer):
+        """Run a REPL for one connection, until BYE, ABORT or the connection closes"""
+        f = self.pool.acquire()
+        self.sessions += 1
+        try:
+            await self.run(f, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.sessions -= 1
+            writer.close()
+            self.pool.release(f)
+
+    async def run(self, f, reader, writer):
+        machine = f.machine
+        f.start_word("REPL")
+        while True:
+            status = machine.run(self.slice_steps)
+            await f.outs.drain(writer)
+
+            if status == machine.YIELDED:
+                await asyncio.sleep(0) # let the other sessions run
+
+            elif status == machine.WAITING:
+                data = await reader.read(READ_SIZE)
+                if data:
+                    f.ins.feed(data)
+                else:
+                    f.ins.eof()
+
+            elif status == machine.ERROR:
+                # Report it and start again, like a terminal would
+                f.outs.writestr("\n%s:%s\n" % (type(machine.error).__name__, machine.error))
+                await f.outs.drain(writer)
+                machine.ds.reset()
+                f.start_word("REPL")
+
+            else: # HALTED
+                return
+
+    async def start_tcp(self, host, port):
+        return await asyncio.start_server(self.session, host, port)
+
+    async def start_unix(self, path):
+        return await asyncio.start_unix_server(self.session, path)
+
+
+async def serve(host=None, port=None, path=None):
+    server = ForthServer()
+    if path != None:
+        listener = await server.start_unix(path)
+    else:
+        listener = await server.start_tcp(host, port)
+    async with listener:
+        await listener.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the Forth REPL over sockets")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4242)
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead of TCP")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.unix))
+
+if __name__ == "__main__":
+    main()
+
+# END
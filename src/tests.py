@@ -2,12 +2,25 @@
 #
 # Test harness for forth.py
 
+import os
+import shutil
+import struct
+import sys
+import tempfile
 import unittest
+import zlib
 import forth
 
+try:
+    import numpy
+except ImportError:
+    numpy = None # the array tests are skipped
+
 # Aliases, for brevity
 LIT = forth.Forth.LITERAL
+CHR = forth.Forth.CHARACTER
 STR = forth.Forth.STRING
+SQ  = forth.Forth.SQUOTE
 
 class Experiment(unittest.TestCase):
     """A small smoke test - non exhaustive"""
@@ -257,26 +270,562 @@ class TestForth(unittest.TestCase):
     #    #self.f.machine.mem.dump(65536-1024, 16) # TODO compare it
     #    #TODO: assertEquals self.f.outs.get()
 
+    def test_31_compressed_disk(self):
+        """WBLK/RBLK round trip through a compressed block file"""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            name = os.path.join(tmpdir, "blocks.bin")
+            disk = forth.CompressedDisk(name)
+            self.f = forth.Forth(outs=forth.Output(), disks=disk).boot()
+
+            # A mostly-blank source screen in a free area of memory
+            screen = (": STAR 42 EMIT ;" + " " * 1024)[:1024]
+            for i in range(1024):
+                self.f.machine.mem.writeb(0xC000+i, ord(screen[i]))
+                self.f.machine.mem.writeb(0xC400+i, 32)
+
+            self.f.create_word("W", LIT(3), LIT(0xC000), "WBLK", LIT(4), LIT(0xC400), "WBLK")
+            self.f.create_word("R", LIT(3), LIT(0xC800), "RBLK", LIT(9), LIT(0xCC00), "RBLK")
+            self.f.execute_word("W")
+            self.f.execute_word("R")
+
+            for i in range(1024):
+                self.assertEquals(ord(screen[i]), self.f.machine.mem.readb(0xC800+i))
+                self.assertEquals(32, self.f.machine.mem.readb(0xCC00+i)) # never written, reads blank
+
+            self.assertEquals(0, disk.index[4][1]) # blank block has no payload
+            self.assertTrue(os.path.getsize(name) < 1024)
+
+            # The index survives a reopen
+            again = forth.CompressedDisk(name)
+            self.assertEquals(disk.read(3), again.read(3))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_31b_compressed_disk_wide(self):
+        """Block numbers past 16 bits, with 32 bit cells, and version 1 files still read"""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            name = os.path.join(tmpdir, "blocks.bin")
+            disk = forth.CompressedDisk(name)
+            f = forth.Forth(outs=forth.Output(), disks=disk, cellbits=32).boot()
+            f.evaluate("42 49152 C! 70000 49152 WBLK 0 49152 C! 70000 49152 RBLK 49152 C@ .")
+            self.assertEquals("42 ", f.outs.get())
+            self.assertEquals(disk.read(70000), forth.CompressedDisk(name).read(70000))
+
+            # A version 1 file, with 16 bit block numbers in its index
+            old = os.path.join(tmpdir, "old.bin")
+            payload = zlib.compress(b"*" * 1024)
+            h = open(old, "wb")
+            h.write(struct.pack(">4sBII", b"PFZB", 0, 13 + len(payload), 1) + payload)
+            h.write(struct.pack(">HII", 5, 13, len(payload)))
+            h.close()
+            self.assertEquals(b"*" * 1024, forth.CompressedDisk(old).read(5))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_32_journal_disk(self):
+        """WBLK through a write-behind journal, with replay after a crash"""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            name = os.path.join(tmpdir, "blocks.bin")
+            disk = forth.JournalDisk(forth.Disk(name), interval=None)
+            self.f = forth.Forth(outs=forth.Output(), disks=disk).boot()
+            for i in range(1024):
+                self.f.machine.mem.writeb(0xC000+i, i & 0xFF)
+
+            self.f.create_word("W", LIT(2), LIT(0xC000), "WBLK")
+            self.f.create_word("R", LIT(2), LIT(0xC400), "RBLK")
+            self.f.execute_word("W")
+            self.assertFalse(os.path.exists(name)) # not applied yet
+            self.f.execute_word("R")               # but readable
+            readback = [self.f.machine.mem.readb(0xC400+i) for i in range(1024)]
+            self.assertEquals([i & 0xFF for i in range(1024)], readback)
+
+            # A flush applies the batch with one fsync, and empties the journal
+            disk.close()
+            self.assertEquals(disk.read(2), forth.Disk(name).read(2))
+            self.assertEquals(0, os.path.getsize(disk.journal_name))
+
+            # Committed but never applied, so a restart must replay it
+            crashed = forth.JournalDisk(forth.Disk(name), interval=None)
+            crashed.write(0, b"*" * 1024)
+            crashed.commit()
+            crashed.journal.close() # the process dies here
+
+            replayed = forth.JournalDisk(forth.Disk(name), interval=None)
+            self.assertEquals(b"*" * 1024, forth.Disk(name).read(0))
+            self.assertEquals(disk.read(2), forth.Disk(name).read(2))
+            replayed.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_32_journal_disk_wide(self):
+        """Journal block numbers past 16 bits, and version 1 journals still replay"""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            name = os.path.join(tmpdir, "blocks.bin")
+            disk = forth.JournalDisk(forth.CompressedDisk(name), interval=None)
+            f = forth.Forth(outs=forth.Output(), disks=disk, cellbits=32).boot()
+            f.evaluate("42 49152 C! 70000 49152 WBLK")
+            disk.commit()
+            disk.journal.close() # the process dies here
+
+            replayed = forth.JournalDisk(forth.CompressedDisk(name), interval=None)
+            self.assertEquals(42, bytearray(replayed.read(70000))[0])
+            replayed.close()
+
+            # A version 1 journal, with 16 bit block numbers and no magic
+            data = b"*" * 1024
+            h = open(name + ".jnl", "wb")
+            h.write(struct.pack(">HII", 7, len(data), zlib.crc32(data) & 0xFFFFFFFF) + data)
+            h.close()
+            replayed = forth.JournalDisk(forth.CompressedDisk(name), interval=None)
+            self.assertEquals(data, replayed.read(7))
+            replayed.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_32_journal_disk_error(self):
+        """A failed apply leaves the journal usable, and is retried"""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            name = os.path.join(tmpdir, "blocks.bin")
+            inner = forth.Disk(name)
+            disk = forth.JournalDisk(inner, interval=None)
+            writemany = inner.writemany
+            def failing(*args, **kwargs):
+                raise OSError("disk full")
+            inner.writemany = failing
+
+            disk.write(1, b"a" * 1024)
+            self.assertRaises(OSError, disk.flush)
+            disk.write(2, b"b" * 1024) # would deadlock if a lock was still held
+            self.assertEquals(b"a" * 1024, disk.read(1))
+
+            inner.writemany = writemany
+            disk.close()
+            self.assertEquals(b"a" * 1024, forth.Disk(name).read(1))
+            self.assertEquals(b"b" * 1024, forth.Disk(name).read(2))
+            self.assertFalse(os.path.exists(disk.journal_name + ".old"))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_33_separate_memory(self):
+        """Two Forths in one process must not share memory"""
+        other = forth.Forth(outs=forth.Output()).boot()
+        self.f.create_word("SET", LIT(42), LIT(0xC000), "!")
+        self.f.execute_word("SET")
+        self.assertEquals(42, self.f.machine.mem.readn(0xC000))
+        self.assertEquals(0, other.machine.mem.readn(0xC000))
+
+        # Both dictionaries still work after the other one has grown
+        self.f.create_word("TEST", LIT(1), ".")
+        self.f.execute_word("TEST")
+        other.execute_word("STAR")
+        self.assertEquals("1 ", self.f.outs.get())
+
+    def test_34_memsize(self):
+        """Memory size comes from configuration, and must hold every region"""
+        small = forth.Forth(outs=forth.Output(), memsize=0xC000).boot()
+        self.assertEquals(0xC000, small.machine.mem.size)
+        try:
+            forth.Forth(outs=forth.Output(), memsize=0x8000).boot()
+            self.fail("Did not get expected ValueError")
+        except ValueError:
+            pass # expected
+
+    def test_34b_cell_width(self):
+        """32 and 64 bit cells are a boot-time setting"""
+        for bits in (32, 64):
+            f = forth.Forth(outs=forth.Output(), cellbits=bits).boot()
+            f.create_word("T", SQ("wide"), "TYPE", LIT(-1), "U.")
+            f.execute_word("T")
+            f.evaluate("1000 70000 * . TRUE . 1 0 D. 3 4 < .")
+            self.assertEquals("wide%d 70000000 -1 %d -1 " % (2**bits-1, 2**bits), f.outs.get())
+            self.assertEquals(bits//8, f.machine.Number.SIZE)
+
+        # Each machine keeps its own width, whatever was booted after it
+        self.f.create_word("T", SQ("narrow"), "TYPE", LIT(-1), "U.")
+        self.f.execute_word("T")
+        self.f.evaluate("1 2 + .")
+        self.assertEquals("narrow65535 3 ", self.f.outs.get())
+        self.assertEquals(2, forth.Number.SIZE)
+        f.outs.clear()
+        f.evaluate("-1 U.")
+        self.assertEquals("%d " % (2**64-1), f.outs.get())
+
+    def cfa(self, name):
+        return self.f.machine.dict.ffa2cfa(self.f.machine.dict.find(name))
+
+    def test_35_tasks(self):
+        """Two tasks take turns when they PAUSE"""
+        self.f.create_word("BG", LIT(66), "EMIT", "PAUSE", "BRANCH", -5)
+        self.f.create_word("TEST",
+            LIT(self.cfa("BG")), "TASK", "ACTIVATE",
+            LIT(65), "EMIT", "PAUSE",
+            LIT(65), "EMIT", "PAUSE",
+            LIT(65), "EMIT"
+        )
+        self.f.execute_word("TEST")
+        self.assertEquals("ABABA", self.f.outs.get())
+
+    def test_36_task_stop(self):
+        """A task that STOPs is not run again, and has its own user variables"""
+        self.f.create_word("BG", "SPAN", "@", ".", LIT(7), "SPAN", "!", "STOP", LIT(66), "EMIT")
+        self.f.create_word("TEST",
+            LIT(3), "SPAN", "!",
+            LIT(self.cfa("BG")), "TASK", "ACTIVATE",
+            "PAUSE", "PAUSE",
+            "SPAN", "@", "."
+        )
+        self.f.execute_word("TEST")
+        self.assertEquals("3 3 ", self.f.outs.get())
+        self.assertFalse(self.f.machine.tasks[1].active)
+
+    def test_36_task_reuse(self):
+        """TASK hands out the slot of a task that has stopped"""
+        self.f.create_word("BG", LIT(66), "EMIT")
+        self.f.create_word("TEST", LIT(self.cfa("BG")), "TASK", "ACTIVATE", "PAUSE", "PAUSE")
+        for i in range(20):
+            self.f.execute_word("TEST")
+        self.assertEquals("B" * 20, self.f.outs.get())
+        self.assertEquals(2, len(self.f.machine.tasks))
+
+    def test_36_task_user_var_bounds(self):
+        """A user variable past the end of a task's area fails"""
+        m = self.f.machine
+        m.dict.create(nf="FAR", cf=m.getNativeRoutineAddress(" RDPFAREL"),
+                      pf=[forth.Machine.TASK_UV_SIZE + 8], finish=True)
+        self.f.create_word("BG", "FAR", "DROP")
+        self.f.create_word("TEST", LIT(self.cfa("BG")), "TASK", "ACTIVATE", "PAUSE")
+        self.assertRaises(RuntimeError, self.f.execute_word, "TEST")
+
+    def test_37_task_key_yields(self):
+        """KEY lets other tasks run while there is no input"""
+        self.f.create_word("KEYS", "KEY", "EMIT")
+        self.f.create_word("TEST", LIT(self.cfa("KEYS")), "TASK", "ACTIVATE", "PAUSE", LIT(65), "EMIT")
+        self.f.execute_word("TEST")
+        self.assertEquals("A", self.f.outs.get())
+
+        self.f.ins.set("x")
+        self.f.create_word("RESUME", "PAUSE")
+        self.f.execute_word("RESUME")
+        self.assertEquals("Ax", self.f.outs.get())
+
+    def test_38_evaluate(self):
+        """Interpret source text without the REPL"""
+        self.assertTrue(self.f.evaluate("1 2 + .\nSTAR EMIT 7"))
+        self.assertEquals("3 *", self.f.outs.get())
+        self.assertEquals([7], self.f.machine.ds.items())
+
+    def test_39_run_batch(self):
+        """Independent jobs over a process pool, each from a clean boot"""
+        jobs = [
+            ("1 2 + .", ""),
+            ("KEY EMIT 5 6", "z"),
+            ("DROP", ""),
+            ("HEX", ""),
+        ]
+        results = forth.run_batch(jobs, processes=2, max_steps=1000)
+        self.assertEquals(("3 ", [], None), results[0])
+        self.assertEquals(("z", [5, 6], None), results[1])
+        self.assertEquals("BufferUnderflow", results[2][2].split(":")[0])
+        self.assertEquals(("", [], None), results[3])
+
+    def test_39b_pool(self):
+        """An interpreter comes back from the pool exactly as it was booted"""
+        pool = forth.ForthPool(1)
+        f = pool.acquire()
+        pristine = f.machine.mem.load(0, f.machine.mem.size)
+        f.create_word("TEST", LIT(1), LIT(2), "HEX", LIT(42), "EMIT")
+        f.execute_word("TEST")
+        f.ins.set("pending")
+        self.assertEquals("*", f.outs.get())
+        pool.release(f)
+
+        self.assertTrue(pool.acquire() is f)
+        self.assertEquals(0, f.machine.dict.find("TEST"))
+        self.assertEquals([], f.machine.ds.items())
+        self.assertEquals("", f.outs.get())
+        self.assertEquals(0, f.ins.waiting())
+        self.assertEquals(pristine, f.machine.mem.load(0, f.machine.mem.size))
+        f.evaluate("STAR EMIT")
+        self.assertEquals("*", f.outs.get())
+
+    def test_39c_checkpoint(self):
+        """Roll back a failed speculative evaluation"""
+        m = self.f.machine
+        self.f.evaluate("1 2")
+        cp = m.checkpoint()
+        try:
+            self.f.evaluate("STAR EMIT DROP DROP DROP")
+            self.fail("Did not get expected BufferUnderflow exception")
+        except forth.BufferUnderflow:
+            pass # expected
+        self.f.create_word("TEST", LIT(3))
+        m.restore(cp)
+
+        self.assertEquals([1, 2], m.ds.items())
+        self.assertEquals(0, m.dict.find("TEST"))
+        self.f.evaluate("+ .")
+        self.assertEquals("*3 ", self.f.outs.get())
+
+        # The same checkpoint can be restored again, into the same state
+        m.restore(cp)
+        self.assertEquals([1, 2], m.ds.items())
+
+    def test_39c_checkpoint_registers(self):
+        """A checkpoint also rolls back number conversion and error state"""
+        m = self.f.machine
+        self.f.evaluate("1.5")
+        cp = m.checkpoint()
+        self.f.evaluate("12 NOSUCHWORD")
+        self.f.evaluate("7 0 <# # #S")
+        self.assertEquals(1, m.errors)
+        m.restore(cp)
+        self.assertEquals(1, m.dpl)
+        self.assertEquals(m.holdend, m.hld)
+        self.assertEquals(0, m.errors)
+        self.assertFalse(m.aborted)
+
+    def test_39d_checkpoint_pages(self):
+        """Checkpoints of a mostly unchanged memory share their pages"""
+        m = self.f.machine
+        first = m.checkpoint()
+        m.mem.writeb(0xC000, 42)
+        self.assertEquals(1, m.mem.owned.count(True)) # only the written page was copied
+        self.assertEquals(0, first.pages[0xC000 // forth.Memory.PAGE_SIZE][0])
+        second = m.checkpoint()
+        shared = [a is b for a, b in zip(first.pages, second.pages)]
+        self.assertEquals(len(shared)-1, shared.count(True))
+        m.restore(first)
+        self.assertEquals(0, m.mem.readb(0xC000))
+
+    def test_39e_shared_base(self):
+        """Booted interpreters share their base words, and keep their own words"""
+        other = forth.Forth(outs=forth.Output()).boot()
+        self.assertTrue(self.f.machine.dict.base is other.machine.dict.base)
+
+        # Only the pages an interpreter has written have storage of their own
+        mem = other.machine.mem
+        self.assertTrue(mem.pages[0x400 // mem.PAGE_SIZE] is forth.Memory.ZERO) # under the sealed words
+        self.assertTrue(mem.owned.count(True) < 4)
+        self.f.create_word("SPARKLE", LIT(42), "EMIT")
+        self.assertEquals(0, other.machine.dict.find("SPARKLE"))
+        self.f.execute_word("SPARKLE")
+        self.assertEquals("*", self.f.outs.get())
+        self.assertRaises(RuntimeError, self.f.machine.mem.writeb, self.f.machine.dict.start+1, 0)
+        self.assertRaises(RuntimeError, self.f.machine.dict.forget, "DUP")
+        self.f.machine.dict.forget("SPARKLE")
+        self.assertEquals(0, self.f.machine.dict.find("SPARKLE"))
+
+        private = forth.Forth(outs=forth.Output(), shared=False).boot()
+        self.assertEquals(None, private.machine.dict.base)
+        self.assertNotEquals(0, private.machine.dict.find("DUP"))
+
     def test_40_branch(self):
         """Test unconditional branch feature"""
         self.f.create_word("B", LIT(42), "EMIT", "BRANCH", -4)
-        self.f.machine.limit = 20 # limit number of times round execute loop
+        self.f.machine.limit = 20 # limit number of calls and backward branches
         self.f.execute_word("B")
-        self.assertEquals("******", self.f.outs.get())
+        self.assertEquals("*" * 19, self.f.outs.get()) # one call, 19 times round
 
     def test_41_0branch_taken(self):
         """Test conditional branch always taken"""
         self.f.create_word("B", LIT(43), "EMIT", LIT(1), "0BRANCH", -6)
-        self.f.machine.limit = 20 # limit number of times round execute loop
+        self.f.machine.limit = 20 # limit number of calls and backward branches
         self.f.execute_word("B")
         self.assertEquals("+", self.f.outs.get())
 
     def test_42_0branch_nottaken(self):
         """Test conditional branch always not taken"""
         self.f.create_word("B", LIT(44), "EMIT", LIT(0), "0BRANCH", -6)
-        self.f.machine.limit = 20 # limit to 10 times round DODOES
+        self.f.machine.limit = 20 # limit number of calls and backward branches
         self.f.execute_word("B")
-        self.assertEquals(",,,,,", self.f.outs.get())
+        self.assertEquals("," * 19, self.f.outs.get())
+
+    def test_43_run_budget(self):
+        """run() stops when its budget is spent, and carries on from there"""
+        m = self.f.machine
+        self.f.create_word("B", LIT(42), "EMIT", "BRANCH", -4)
+        self.f.start_word("B")
+        self.assertEquals(m.YIELDED, m.run(5)) # the call, and 4 times round
+        self.assertEquals("****", self.f.outs.get())
+        self.assertEquals(m.YIELDED, m.run(5))
+        self.assertEquals("*********", self.f.outs.get())
+
+    def test_44_run_waiting(self):
+        """run() returns WAITING when KEY has no input, and retries the KEY"""
+        m = self.f.machine
+        self.f.create_word("K", "KEY", "EMIT", "KEY", "EMIT")
+        self.f.start_word("K")
+        self.assertEquals(m.WAITING, m.run())
+        self.f.ins.set("a")
+        self.assertEquals(m.WAITING, m.run())
+        self.f.ins.set("b")
+        self.assertEquals(m.HALTED, m.run())
+        self.assertEquals("ab", self.f.outs.get())
+        self.assertEquals(m.HALTED, m.run())
+
+    def test_45_run_error(self):
+        """run() returns ERROR instead of raising"""
+        m = self.f.machine
+        self.f.create_word("U", "DROP")
+        self.f.start_word("U")
+        self.assertEquals(m.ERROR, m.run())
+        self.assertEquals("BufferUnderflow", type(m.error).__name__)
+
+    @unittest.skipIf(sys.version_info < (3, 7), "server needs asyncio")
+    def test_46_server(self):
+        """Two sessions on the socket server run their own interpreters"""
+        import asyncio
+        import server
+        import socket
+        import threading
+
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, "forth.sock")
+        loop = asyncio.new_event_loop()
+        listener = loop.run_until_complete(
+            server.ForthServer(pool_size=1, slice_steps=10).start_unix(path))
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+        try:
+            clients = []
+            for line in ["STAR EMIT\n", "BL 1 + EMIT\n"]:
+                c = socket.socket(socket.AF_UNIX)
+                c.connect(path)
+                c.sendall(line.encode("latin-1"))
+                c.shutdown(socket.SHUT_WR) # EXPECT sees it as CTRL-D, and does a BYE
+                clients.append(c)
+            outputs = []
+            for c in clients:
+                data = b""
+                while True: # until the server closes the connection
+                    chunk = c.recv(1024)
+                    if not chunk:
+                        break
+                    data += chunk
+                c.close()
+                outputs.append(data.decode("latin-1"))
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            listener.close()
+            loop.close()
+            shutil.rmtree(tmp)
+        self.assertEquals(["*Ok\r\n", "!Ok\r\n"], outputs)
+
+    def test_45b_bye_stops(self):
+        """BYE stops the machine straight away"""
+        self.f.create_word("B", "BYE", "STAR", "EMIT")
+        self.f.execute_word("B")
+        self.assertEquals("", self.f.outs.get())
+        self.assertEquals(False, self.f.machine.running)
+
+    def test_47_keyq(self):
+        """KEY? polls a file descriptor without blocking"""
+        r, w = os.pipe()
+        try:
+            f = forth.Forth(ins=forth.KeyboardInput(r), outs=forth.Output()).boot()
+            f.create_word("POLL", "KEY?", ".")
+            f.create_word("ECHO", "KEY", "EMIT")
+            f.execute_word("POLL")
+            self.assertEquals("0 ", f.outs.get())
+            f.outs.clear()
+
+            os.write(w, b"AB")
+            f.execute_word("POLL")
+            f.execute_word("ECHO")
+            f.execute_word("ECHO")
+            self.assertEquals("-1 AB", f.outs.get())
+            os.close(w)
+            w = None
+            self.assertEquals(chr(4), f.ins.getch()) # EOF
+        finally:
+            os.close(r)
+            if w != None:
+                os.close(w)
+
+    def test_47b_bulk_input(self):
+        """Pasted input is read a chunk at a time, without copying what is left"""
+        tmp = tempfile.mkdtemp()
+        try:
+            name = os.path.join(tmp, "paste.txt")
+            text = "".join([chr(65 + i % 26) for i in range(3 * forth.KeyboardInput.READ_SIZE + 10)])
+            f = open(name, "w")
+            f.write(text)
+            f.close()
+            fd = os.open(name, os.O_RDONLY)
+            try:
+                ins = forth.KeyboardInput(fd)
+                got = []
+                for i in range(len(text)):
+                    got.append(ins.getch())
+                    self.assertTrue(len(ins.buf) <= forth.KeyboardInput.READ_SIZE)
+                self.assertEquals(text, "".join(got))
+                self.assertEquals(chr(4), ins.getch()) # EOF
+            finally:
+                os.close(fd)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_47c_appended_input(self):
+        """Input that arrives in pieces drops what has been read, as it goes"""
+        ins = forth.Input()
+        for i in range(500):
+            ins.append("ABCDEFGHIJ")
+            self.assertEquals("ABCDEFGHIJ", "".join([ins.getch() for j in range(10)]))
+            self.assertTrue(len(ins.buf) <= forth.Input.TRIM + 10)
+        self.assertEquals(0, ins.waiting())
+
+    def test_48_script(self):
+        """Script mode interprets a file, and runs a word per line of stdin"""
+        import subprocess
+        tmp = tempfile.mkdtemp()
+        try:
+            script = os.path.join(tmp, "script.fs")
+            f = open(script, "w")
+            f.write("1 2 + .\n" + "STAR EMIT " * 20 + "\n")
+            f.close()
+            cmd = [sys.executable, forth.__file__.replace(".pyc", ".py"), script, "-e", "INTERPRET"]
+            p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            out = p.communicate(b"BL EMIT STAR EMIT\nABORT\nSTAR EMIT\n")[0]
+            self.assertEquals(b"3 " + b"*" * 20 + b" *", out)
+            self.assertEquals(1, p.returncode) # stopped by ABORT
+
+            # An undefined word stops the script too
+            f = open(script, "w")
+            f.write("1 2 + .\nNOSUCHWORD\nSTAR EMIT\n")
+            f.close()
+            p = subprocess.Popen(cmd[:3], stdout=subprocess.PIPE)
+            out = p.communicate()[0]
+            self.assertEquals(b"3 NOSUCHWORD ?\n", out)
+            self.assertEquals(1, p.returncode)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_48b_script_each(self):
+        """Script mode copes with an undefined word, and lines longer than TIB"""
+        import subprocess
+        cmd = [sys.executable, forth.__file__.replace(".pyc", ".py"), "-e"]
+        p = subprocess.Popen(cmd + ["NOSUCHWORD"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        out = p.communicate(b"1 2 + .\n")[0]
+        self.assertEquals(b"NOSUCHWORD ?\n", out)
+        self.assertEquals(1, p.returncode)
+
+        p = subprocess.Popen(cmd + ["INTERPRET"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        out = p.communicate(b"STAR EMIT " * 20 + b"\n")[0]
+        self.assertEquals(b"*" * 20, out)
+        self.assertEquals(0, p.returncode)
+
+    def test_48c_chunks(self):
+        """A long line is not split inside a string literal"""
+        line = "STAR EMIT " * 6 + 'S" a string with spaces that crosses the end of TIB" TYPE'
+        self.assertTrue(len(line) > self.f.machine.tibsize)
+        self.assertTrue(self.f.evaluate(line))
+        self.assertEquals("*" * 6 + "a string with spaces that crosses the end of TIB", self.f.outs.get())
 
     def test_50_0eq(self):
         """Test 0= relational operator"""
@@ -302,29 +851,25 @@ class TestForth(unittest.TestCase):
 
     def test_52_0lt(self):
         """Test 0< relational operator"""
-        self.f.create_word("LF", LIT(0), "0<", ".") #TODO: which way round is this?
+        self.f.create_word("LF", LIT(0), "0<", ".")
         self.f.execute_word("LF")
         self.assertEquals("0 ", self.f.outs.get())
         self.f.outs.clear()
 
-        #TODO: This fails due to incorrect handling of -1 in Machine
-        #it comes out as 0xFFFF which is not less than 0.
-        #This should be a SIGNED COMPARISON
-        self.f.create_word("LT", LIT(-1), "0<", ".") #TODO: which way round is this?
+        self.f.create_word("LT", LIT(-1), "0<", ".")
         self.f.execute_word("LT")
-        self.assertEquals("0 ", self.f.outs.get())
+        self.assertEquals("-1 ", self.f.outs.get())
 
-    def XXXXtest_53_0gt(self): #TODO
+    def test_53_0gt(self):
         """Test 0> relational operator"""
-        #TODO: needs a SIGNED COMPARISON
-        self.f.create_word("GF")
+        self.f.create_word("GF", LIT(-1), "0>", ".")
         self.f.execute_word("GF")
-        self.assertEquals("xxx ", self.f.outs.get())
+        self.assertEquals("0 ", self.f.outs.get())
         self.f.outs.clear()
 
-        self.f.create_word("GT")
+        self.f.create_word("GT", LIT(1), "0>", ".")
         self.f.execute_word("GT")
-        self.assertEquals("xxx ", self.f.outs.get())
+        self.assertEquals("-1 ", self.f.outs.get())
 
     def XXXXtest_54_ult(self): #TODO
         """Test U< relational operator"""
@@ -551,6 +1096,403 @@ class TestForth(unittest.TestCase):
         self.assertEquals("32767 ", self.f.outs.get()) # T8
         self.f.outs.clear()
 
+    def test_number_base(self):
+        """NUMBER uses BASE, with digits up to Z"""
+        self.f.evaluate("HEX FF 7fff DECIMAL . . 36 BASE ! Z DECIMAL .")
+        self.assertEquals("32767 255 35 ", self.f.outs.get())
+
+    def test_numberq(self):
+        """NUMBER? reports what it found, and sets DPL for doubles"""
+        self.f.create_word("T", STR("12"), "NUMBER?", ".", ".",
+                                STR("1.25"), "NUMBER?", ".", "D.", "DPL", "@", ".",
+                                STR("1Q"), "NUMBER?", ".")
+        self.f.execute_word("T")
+        self.assertEquals("1 12 2 125 2 0 ", self.f.outs.get())
+
+    def test_tonumber(self):
+        """>NUMBER stops at the first non digit"""
+        self.f.create_word("T", LIT(0), LIT(0), STR("123x"), "COUNT", ">NUMBER", ".", "DROP", "D.")
+        self.f.execute_word("T")
+        self.assertEquals("1 123 ", self.f.outs.get())
+
+    def test_convert(self):
+        """CONVERT accumulates digits after a1, up to the first non digit"""
+        self.f.create_word("T", LIT(0), LIT(7), STR("123x"), "CONVERT", "C@", "EMIT", "D.")
+        self.f.execute_word("T")
+        self.assertEquals("x7123 ", self.f.outs.get())
+
+    def test_dot_base(self):
+        """. and U. print in BASE"""
+        self.f.evaluate("HEX FF . 1234 U. DECIMAL -5 . 65535 U.")
+        self.assertEquals("FF 1234 -5 65535 ", self.f.outs.get())
+
+    def test_pictured(self):
+        """Pictured numeric output of a double, high cell pushed first"""
+        self.f.create_word("P", LIT(0), LIT(1234), "<#", "#", "#", CHR('.'), "HOLD", "#S",
+                                LIT(-1), "SIGN", "#>", "TYPE")
+        self.f.execute_word("P")
+        self.assertEquals("-12.34", self.f.outs.get())
+
+    def test_dotr(self):
+        """.R and U.R right justify"""
+        self.f.create_word("R", LIT(-42), LIT(5), ".R", LIT(7), LIT(3), "U.R", LIT(12345), LIT(2), ".R")
+        self.f.execute_word("R")
+        self.assertEquals("  -42  712345", self.f.outs.get())
+
+        # A width that is not positive means no padding, whatever the cell width
+        self.f.outs.clear()
+        self.f.evaluate("5 -3 .R 6 0 U.R 7. -1 D.R")
+        self.assertEquals("567", self.f.outs.get())
+        f = forth.Forth(outs=forth.Output(), cellbits=64).boot()
+        f.evaluate("5 -1 .R")
+        self.assertEquals("5", f.outs.get())
+
+    def test_num_base(self):
+        """# and #S check BASE, as the number output words do"""
+        self.f.create_word("N", LIT(7), LIT(0), "<#", "#", "#>")
+        self.f.create_word("NS", LIT(7), LIT(0), "<#", "#S", "#>")
+        for base in (0, 1, 37):
+            self.f.machine.base = base
+            self.assertRaises(RuntimeError, self.f.execute_word, "N")
+            self.assertRaises(RuntimeError, self.f.execute_word, "NS")
+
+    def test_double_arith(self):
+        """Native double cell arithmetic"""
+        self.f.evaluate("100000. 23456. D+ D. 5. 7. D- D. 3. DNEGATE D. 1. 2. D< . 2. 2. D= .")
+        self.assertEquals("123456 -2 -3 -1 -1 ", self.f.outs.get())
+
+    def test_mixed_arith(self):
+        """Single by single to double, and double by single division"""
+        self.f.evaluate("1000 1000 UM* D. -3 7 M* D. 100000. 7 UM/MOD . .")
+        self.assertEquals("1000000 -21 14285 5 ", self.f.outs.get())
+        self.f.outs.clear()
+        self.f.create_word("S", LIT(-1), LIT(-7), LIT(2), "SM/REM", ".", ".",
+                                LIT(-1), LIT(-7), LIT(2), "FM/MOD", ".", ".")
+        self.f.execute_word("S")
+        self.assertEquals("-3 -1 -4 1 ", self.f.outs.get())
+
+        # A quotient that does not fit in a cell is an error, not a wrong answer
+        self.assertRaises(RuntimeError, self.f.evaluate, "65536. 1 UM/MOD")
+        self.assertRaises(RuntimeError, self.f.evaluate, "32768. 1 SM/REM")
+        self.assertRaises(RuntimeError, self.f.evaluate, "-32769. 1 FM/MOD")
+        self.f.outs.clear()
+        self.f.evaluate("65535. 1 UM/MOD U. . -32768. 1 FM/MOD . .")
+        self.assertEquals("65535 0 -32768 0 ", self.f.outs.get())
+
+    def test_scaled(self):
+        """*/ and */MOD keep a double length product"""
+        self.f.evaluate("30000 3 4 */ . 30000 3 7 */MOD . .")
+        self.assertEquals("22500 12857 1 ", self.f.outs.get())
+
+    def test_double_stack(self):
+        """2DUP 2SWAP 2OVER 2DROP 2! 2@"""
+        self.f.evaluate("1 2 3 4 2SWAP . . . . 1 2 3 4 2OVER . . 2DROP 2DUP . . 2DROP")
+        self.assertEquals("2 1 4 3 2 1 2 1 ", self.f.outs.get())
+        self.f.outs.clear()
+        self.f.evaluate("123456. 49152 2! 49152 2@ D. 49152 @ .")
+        self.assertEquals("123456 1 ", self.f.outs.get())
+
+    def put(self, addr, text):
+        for i in range(len(text)):
+            self.f.machine.mem.writeb(addr+i, ord(text[i]))
+
+    def get(self, addr, count):
+        return "".join([chr(self.f.machine.mem.readb(addr+i)) for i in range(count)])
+
+    def test_cmove(self):
+        """CMOVE and CMOVE> overlap exactly as a byte at a time copy does"""
+        self.put(0xC000, "ABCDEF")
+        self.f.evaluate("49152 49153 5 CMOVE")
+        self.assertEquals("AAAAAA", self.get(0xC000, 6))
+        self.put(0xC000, "ABCDEF")
+        self.f.evaluate("49153 49152 5 CMOVE>")
+        self.assertEquals("FFFFFF", self.get(0xC000, 6))
+        self.put(0xC000, "ABCDEF")
+        self.f.evaluate("49152 49154 4 CMOVE>")
+        self.assertEquals("ABABCD", self.get(0xC000, 6))
+
+    def test_move(self):
+        """MOVE does not repeat a pattern in either direction"""
+        self.put(0xC000, "ABCDEF")
+        self.f.evaluate("49152 49153 5 MOVE")
+        self.assertEquals("AABCDE", self.get(0xC000, 6))
+        self.f.evaluate("49153 49152 5 MOVE")
+        self.assertEquals("ABCDEE", self.get(0xC000, 6))
+
+    def test_fill(self):
+        """FILL ERASE BLANK, also across a handler region"""
+        self.f.evaluate("49152 4 42 FILL 49153 2 BLANK")
+        self.assertEquals("*  *", self.get(0xC000, 4))
+        self.f.evaluate("49152 2 ERASE")
+        self.assertEquals("\x00\x00 *", self.get(0xC000, 4))
+        self.assertRaises(RuntimeError, self.f.evaluate, "0 4 ERASE") # native routines
+
+    def test_do_loop(self):
+        """Counted loops, nested loops and +LOOP both ways"""
+        self.f.create_word("T1", LIT(3), LIT(0), "DO", "I", ".", "LOOP")
+        self.f.create_word("T2", LIT(3), LIT(1), "DO", LIT(12), LIT(10), "DO", "I", "J", "*", ".", "LOOP", "LOOP")
+        self.f.create_word("T3", LIT(10), LIT(0), "DO", "I", ".", LIT(4), "+LOOP")
+        self.f.create_word("T4", LIT(0), LIT(3), "DO", "I", ".", LIT(-1), "+LOOP")
+        self.f.create_word("T5", LIT(5), LIT(5), "?DO", "I", ".", "LOOP", LIT(1), LIT(0), "DO", LIT(9), ".", "LOOP")
+        for w in ("T1", "T2", "T3", "T4", "T5"):
+            self.f.execute_word(w)
+        self.assertEquals("0 1 2 10 11 20 22 0 4 8 3 2 1 0 9 ", self.f.outs.get())
+        self.assertEquals([], self.f.machine.ds.items())
+
+    def test_leave(self):
+        """LEAVE goes to after the LOOP, UNLOOP lets EXIT leave the word"""
+        self.f.create_word("T1", LIT(100), LIT(0), "DO", "I", "DUP", ".", LIT(2), "=", "0BRANCH", +2, "LEAVE", "LOOP", LIT(7), ".")
+        self.f.create_word("T2", LIT(100), LIT(0), "DO", "I", ".", "UNLOOP", "EXIT", "LOOP", LIT(7), ".")
+        self.f.create_word("T3", "T2", "T1")
+        self.f.execute_word("T3")
+        self.assertEquals("0 0 1 2 7 ", self.f.outs.get())
+        self.assertEquals([], self.f.machine.ds.items())
+
+    def test_return_stack(self):
+        """>R R> R@ keep temporaries on RS, RP@ RP! save and restore its depth"""
+        self.f.create_word("T1", LIT(1), LIT(2), ">R", LIT(3), "R@", "R>")
+        self.f.create_word("T2", LIT(7), ">R", "T1", ".", ".", ".", ".", "R>", ".")
+        self.f.create_word("T3", "RP@", LIT(5), ">R", LIT(6), ">R", "RP!", "RP@", "RP@", "-", ".")
+        self.f.execute_word("T2")
+        self.f.execute_word("T3")
+        self.assertEquals("2 2 3 1 7 0 ", self.f.outs.get())
+        self.assertEquals([], self.f.machine.ds.items())
+
+    def test_signed_arith(self):
+        """Comparisons, /MOD, 2/ ABS MIN MAX treat cells as signed"""
+        self.f.create_word("T1", LIT(-1), LIT(1), "<", ".", LIT(32767), LIT(-32768), ">", ".",
+                                 LIT(3), LIT(3), "=", ".", LIT(3), LIT(4), "<>", ".")
+        self.f.create_word("T2", LIT(-7), LIT(2), "/MOD", ".", ".", LIT(7), LIT(-2), "/", ".",
+                                 LIT(-7), LIT(2), "MOD", ".", LIT(-7), "2/", ".", LIT(-5), "2*", ".")
+        self.f.create_word("T3", LIT(-5), "ABS", ".", LIT(-5), LIT(3), "MIN", ".",
+                                 LIT(-5), LIT(3), "MAX", ".", LIT(5), "NEGATE", "1+", "1-", ".")
+        self.f.execute_word("T1")
+        self.assertEquals("-1 -1 -1 -1 ", self.f.outs.get())
+        self.f.outs.clear()
+        self.f.execute_word("T2")
+        self.assertEquals("-4 1 -4 1 -4 -10 ", self.f.outs.get())
+        self.f.outs.clear()
+        self.f.execute_word("T3")
+        self.assertEquals("5 -5 3 -5 ", self.f.outs.get())
+
+    def test_register(self):
+        """A native word registered after boot can be called like any other"""
+        m = self.f.machine
+        def n_square():
+            n = forth.Number.asSigned(m.ds.popn())
+            m.ds.pushn(n * n)
+        m.register("SQUARE", n_square)
+        self.f.create_word("T", LIT(-12), "SQUARE", ".")
+        self.f.execute_word("T")
+        self.assertEquals("144 ", self.f.outs.get())
+
+    def test_colon(self):
+        """: and ; compile a definition from source, over more than one line"""
+        self.f.evaluate(": SQ DUP * ;\n: T 3 SQ .\n 100000. D. ;")
+        self.f.evaluate("T")
+        self.assertEquals("9 100000 ", self.f.outs.get())
+        self.assertEquals(0, self.f.machine.state)
+
+    def test_compile_words(self):
+        """IMMEDIATE runs while compiling, [ ] LITERAL ' ['] DO and S" compile inline"""
+        self.f.evaluate(": NOW 7 . ; IMMEDIATE : LATER NOW 8 . ; LATER")
+        self.f.evaluate(": FIVE [ 2 3 + ] LITERAL ; FIVE .")
+        self.f.evaluate("4 ' FIVE EXECUTE * . : T ['] FIVE EXECUTE ; T .")
+        self.f.evaluate(': CNT 3 0 DO I . LOOP S" ok" TYPE ; CNT')
+        self.assertEquals("7 8 5 20 5 0 1 2 ok", self.f.outs.get())
+        self.assertEquals([], self.f.machine.ds.items())
+
+    def test_unknown_word(self):
+        """An unknown word gives up on the line, and the definition it was in"""
+        self.f.evaluate(": BAD NOPE ; 1 .")
+        self.f.evaluate("BAD")
+        self.f.evaluate("STATE @ .")
+        self.assertEquals("NOPE ?\nBAD ?\n0 ", self.f.outs.get())
+
+    def test_if_else(self):
+        """IF ELSE THEN patch their own offsets, from create_word and from source"""
+        self.f.create_word("T", "DUP", "IF", LIT(1), "ELSE", LIT(2), "THEN", ".", "DROP")
+        self.f.create_word("T1", LIT(0), "T", LIT(5), "T")
+        self.f.execute_word("T1")
+        self.f.evaluate(": SGN DUP 0= IF DROP 0 ELSE 0> IF 1 ELSE -1 THEN THEN ; 7 SGN . 0 SGN .")
+        self.assertEquals("2 1 1 0 ", self.f.outs.get())
+
+    def test_begin_loops(self):
+        """BEGIN UNTIL, BEGIN WHILE REPEAT and BEGIN AGAIN"""
+        self.f.create_word("T", LIT(3), "BEGIN", "DUP", ".", "1-", "DUP", "0=", "UNTIL", "DROP")
+        self.f.execute_word("T")
+        self.f.evaluate(": W BEGIN DUP 5 < WHILE DUP . 1+ REPEAT DROP ; 3 W")
+        self.f.evaluate(": A 0 BEGIN 1+ DUP 9 = IF EXIT THEN AGAIN ; A .")
+        self.assertEquals("3 2 1 3 4 9 ", self.f.outs.get())
+        self.assertEquals([], self.f.machine.ds.items())
+
+    def test_case(self):
+        """CASE OF ENDOF ENDCASE, the default sees the selector and ENDCASE drops it"""
+        self.f.evaluate(": C CASE 1 OF 10 ENDOF 2 OF 20 ENDOF DUP 100 * SWAP ENDCASE ;")
+        self.f.evaluate("1 C . 2 C . 3 C .")
+        self.assertEquals("10 20 300 ", self.f.outs.get())
+
+    def test_fused_branch(self):
+        """A comparison before IF compiles as one word, unless a THEN lands between them"""
+        m = self.f.machine
+        self.f.evaluate(": T1 = IF 1 THEN ; : T2 IF 1 THEN = IF 2 THEN ;")
+        t1 = m.mem.readn(m.dict.ffa2pfa(m.dict.find("T1")))
+        self.assertEquals(m.find_cfa("=0BRANCH"), t1)
+        self.f.evaluate("3 3 T1 . 5 5 0 T2 . 1 1 T2 .")
+        self.assertEquals("1 2 2 ", self.f.outs.get())
+        self.f.outs.clear()
+
+        # BEGIN is a branch target too, so = before it stays a word of its own
+        self.f.evaluate(": T3 -1 0 0 5 6 = BEGIN UNTIL 7 . ; T3")
+        self.assertEquals("7 ", self.f.outs.get())
+        self.assertRaises(RuntimeError, self.f.evaluate, ": BAD THEN ;")
+        self.assertEquals(0, m.state)
+
+    def test_optimise(self):
+        """A translated word, and the words it calls, give the same results"""
+        self.f.evaluate(": SQ DUP * ; : SUMSQ 0 SWAP 0 DO I SQ + LOOP ;")
+        self.f.evaluate(": LV 10 0 DO I 3 = IF LEAVE THEN I . LOOP ; : PL 0 10 DO I . -3 +LOOP ;")
+        self.f.evaluate(': C CASE 1 OF S" one" TYPE ENDOF DUP . ENDCASE ;')
+        for w in ("SUMSQ", "LV", "PL", "C"):
+            self.assertTrue(self.f.optimise(w))
+        self.f.evaluate("100 SUMSQ . LV PL 1 C 2 C")
+        self.assertEquals("670 0 1 2 10 7 4 1 one2 ", self.f.outs.get())
+        self.assertEquals([], self.f.machine.ds.items())
+
+    def test_optimise_refused(self):
+        """Words that need NEXT, and sealed words, are left as they are"""
+        self.f.evaluate(": K KEY ; : K2 K DROP ; : SP2 SPACE SPACE ;")
+        self.assertFalse(self.f.optimise("K2"))
+        self.assertFalse(self.f.optimise("TYPE"))
+        self.assertTrue(self.f.optimise("SP2")) # SPACE is sealed, but it can still be called
+        self.f.evaluate("SP2")
+        self.assertEquals("  ", self.f.outs.get())
+
+    def test_optimise_malformed(self):
+        """A PF that does not make sense as a word is refused, not an error"""
+        self.f.evaluate(": W1 LEAVE ; : W2 J ; : W3 3 0 DO I >R R> . LOOP ;")
+        for w in ("W1", "W2", "W3"):
+            self.assertFalse(self.f.optimise(w))
+        self.f.evaluate("W3") # NEXT still runs it
+        self.assertEquals("0 1 2 ", self.f.outs.get())
+
+    def test_optimise_run_budget(self):
+        """A translated loop is charged to run(), and stops when it is spent"""
+        m = self.f.machine
+        self.f.evaluate(": B BEGIN 42 EMIT AGAIN ;")
+        self.assertTrue(self.f.optimise("B"))
+        self.f.start_word("B")
+        self.assertEquals(m.YIELDED, m.run(5)) # the call, and 4 times round
+        self.assertEquals("****", self.f.outs.get())
+        self.assertEquals(m.YIELDED, m.run(5))
+        self.assertEquals("*********", self.f.outs.get())
+        self.f.outs.clear()
+
+        # Stopped inside nested loops of a called translation, NEXT carries on
+        self.f.evaluate(": SQ DUP * ; : IN 0 SWAP 0 DO I SQ + LOOP ;")
+        self.f.evaluate(": OUT 0 5 0 DO I 10 + IN + 3 0 DO I + LOOP LOOP . ;")
+        self.assertTrue(self.f.optimise("OUT"))
+        self.f.start_word("OUT")
+        runs = 1
+        while m.run(7) == m.YIELDED:
+            runs += 1
+        self.assertTrue(runs > 10)
+        self.assertEquals("2660 ", self.f.outs.get())
+        self.assertEquals([], m.ds.items())
+
+    def test_deoptimise(self):
+        """Changing the PF of a translated word, or one it calls, puts it back to NEXT"""
+        m = self.f.machine
+        self.f.evaluate(": SQ DUP * ; : T SQ . ;")
+        self.assertTrue(self.f.optimise("T"))
+        self.f.evaluate("3 T")
+        m.mem.writen(m.dict.ffa2pfa(m.dict.find("SQ")) + forth.Number.SIZE, m.find_cfa("+"))
+        self.f.evaluate("3 T")
+        self.assertEquals(m.getNativeRoutineAddress(" DODOES"), m.mem.readn(m.find_cfa("T")))
+        self.assertTrue(self.f.optimise("T"))
+        self.f.evaluate("4 T")
+        self.f.deoptimise("T")
+        self.f.evaluate("5 T")
+        self.assertEquals("9 6 8 10 ", self.f.outs.get())
+
+    def test_squote(self):
+        """S" parses a string in the interpreter, and SQUOTE compiles one"""
+        self.f.evaluate('S" hello world" TYPE S" x"TYPE')
+        self.assertEquals("hello worldx", self.f.outs.get())
+        self.f.outs.clear()
+        self.f.create_word("T", SQ("inline"), "TYPE")
+        self.f.execute_word("T")
+        self.assertEquals("inline", self.f.outs.get())
+
+    def test_compare(self):
+        """COMPARE orders strings like memcmp, then by length"""
+        self.f.create_word("T", SQ("abc"), SQ("abd"), "COMPARE", ".",
+                                SQ("abc"), SQ("abc"), "COMPARE", ".",
+                                SQ("abcd"), SQ("abc"), "COMPARE", ".")
+        self.f.execute_word("T")
+        self.assertEquals("-1 0 1 ", self.f.outs.get())
+
+    def test_search(self):
+        """SEARCH leaves the rest of the string from the match"""
+        self.f.create_word("T", SQ("one two three"), SQ("two"), "SEARCH", ".", "TYPE",
+                                SQ("one"), SQ("four"), "SEARCH", ".", "TYPE")
+        self.f.execute_word("T")
+        self.assertEquals("-1 two three0 one", self.f.outs.get())
+
+    def test_trailing(self):
+        """-TRAILING and /STRING trim a string"""
+        self.f.create_word("T", SQ("  pad   "), "-TRAILING", LIT(2), "/STRING", "TYPE", CHR("|"), "EMIT")
+        self.f.execute_word("T")
+        self.assertEquals("pad|", self.f.outs.get())
+
+    @unittest.skipIf(numpy == None, "needs numpy")
+    def test_array(self):
+        """Typed arrays, with bulk operations as single words"""
+        self.f.evaluate("5 INT16 ARRAY 3 OVER ARRAY-FILL DUP 7 1 ROT ARRAY! DUP -9 4 ROT ARRAY!")
+        self.f.evaluate("DUP ARRAY-SUM D. DUP ARRAY-SORT 0 OVER ARRAY@ . 4 OVER ARRAY@ .")
+        self.assertEquals("7 -9 7 ", self.f.outs.get())
+        self.f.outs.clear()
+        self.f.evaluate("2 OVER ARRAY-MAP+ DUP DUP ARRAY-DOT D. DUP ARRAY-LEN . ARRAY-FREE")
+        self.assertEquals("205 5 ", self.f.outs.get())
+        self.assertEquals([], self.f.machine.ds.items())
+
+    @unittest.skipIf(numpy == None, "needs numpy")
+    def test_array_checkpoint(self):
+        """Checkpoints share arrays, and an array is copied when it is written"""
+        m = self.f.machine
+        self.f.evaluate("3 INT16 ARRAY 4 INT16 ARRAY")
+        cp = m.checkpoint()
+        self.assertTrue(m.arrays.arrays[0] is cp.regs["arrays"].arrays[0])
+        self.f.evaluate("DUP 7 SWAP ARRAY-FILL")
+        self.assertTrue(m.arrays.arrays[0] is cp.regs["arrays"].arrays[0]) # not written
+        self.assertFalse(m.arrays.arrays[1] is cp.regs["arrays"].arrays[1])
+
+        m.restore(cp)
+        self.f.evaluate("ARRAY-SUM D.")
+        self.assertEquals("0 ", self.f.outs.get())
+
+    @unittest.skipIf(numpy == None, "needs numpy")
+    def test_array_big(self):
+        """Arrays are not limited by the 64K address space"""
+        self.f.evaluate("60000 FLOAT64 ARRAY 30000 OVER ARRAY-FILL DUP ARRAY-SUM UD. ARRAY-LEN U.")
+        self.assertEquals("1800000000 60000 ", self.f.outs.get())
+
+        # The length is one unsigned cell, like an index, so this is the most
+        self.f.outs.clear()
+        self.f.evaluate("65535 INT16 ARRAY DUP ARRAY-LEN U. 65534 SWAP ARRAY@ .")
+        self.assertEquals("65535 0 ", self.f.outs.get())
+
+    @unittest.skipIf(numpy == None, "needs numpy")
+    def test_array_wrap(self):
+        """A value too big for the element type wraps, at any cell width"""
+        for bits in (16, 32, 64):
+            f = forth.Forth(outs=forth.Output(), cellbits=bits).boot()
+            f.evaluate("10 INT16 ARRAY DUP 70000 0 ROT ARRAY! 0 SWAP ARRAY@ .")
+            self.assertEquals("4464 ", f.outs.get())
+            f.outs.clear()
+            f.evaluate("3 INT16 ARRAY 40000 OVER ARRAY-FILL 0 OVER ARRAY@ . 70000 OVER ARRAY-MAP+ 0 SWAP ARRAY@ .")
+            self.assertEquals("-25536 -21072 ", f.outs.get())
+
     def test_read_dshash(self):
         """Read the size of the data stack in bytes"""
         self.f.create_word("T", "DS#", "@", ".", LIT(1), "DS#", "@", ".", LIT(2), "DS#", "@", ".")